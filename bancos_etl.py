@@ -0,0 +1,348 @@
+#######################################################################
+# BANCOS DE DESTINO DO ETL - CRIMES CURITIBA
+#######################################################################
+
+# O loader v2 (coleta_mysql_v2.py) grava o mesmo modelo estrela (DIM_*, FATO_OCORRENCIA, AGG_*)
+# em dois bancos, escolhidos com --banco:
+# 1. BancoMySQL: servidor MySQL/MariaDB; o esquema vem do setup_database.sql
+# 2. BancoSQLite: um arquivo só, sem servidor (notebook, CI, benchmark); o esquema é criado aqui.
+#    Conexões em WAL (leitores não bloqueiam a carga) com synchronous=NORMAL; na carga em massa
+#    (--bulk) synchronous=OFF e foreign_keys=OFF, validadas no final como no MySQL
+#
+# Cada banco cria a engine já configurada, garante o esquema e prepara/finaliza a carga em massa.
+# O benchmark_etl.py usa o mesmo BancoSQLite, então os números do benchmark e os da carga
+# real no SQLite saem das mesmas configurações.
+#
+# Exemplo:
+#   python coleta_mysql_v2.py --banco sqlite --sqlite data/crimes_curitiba.db --bulk
+#   engine = BancoSQLite('data/crimes_curitiba.db').criar_engine()
+#######################################################################
+
+import os
+import time
+from datetime import date
+
+from sqlalchemy import create_engine, event, text
+
+#############################################################
+# CONFIGURAÇÕES
+#############################################################
+
+ARQUIVO_SQLITE = os.path.join('data', 'crimes_curitiba.db')
+
+# PRAGMAs de cada conexão SQLite. cache_size negativo = KiB (256 MB de páginas em memória)
+PRAGMAS_SQLITE = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'foreign_keys': 'ON',
+    'cache_size': -262144,
+    'temp_store': 'MEMORY',
+}
+# Carga em massa: sem fsync (uma queda do sistema operacional no meio da carga pode corromper
+# o arquivo; basta recarregar) e sem checar FK linha a linha (validar_chaves_estrangeiras no final)
+PRAGMAS_SQLITE_BULK = {**PRAGMAS_SQLITE, 'synchronous': 'OFF', 'foreign_keys': 'OFF'}
+
+# Segundos que uma conexão espera pelo lock de escrita antes de desistir
+TIMEOUT_SQLITE = 60
+
+# Sessão das conexões da carga: sem verificação de FK. A unicidade continua ligada: o INSERT IGNORE
+# da carga idempotente depende do índice único da chave_fato. Vai no init_command de cada conexão,
+# então vale também para as conexões dos workers
+SQL_SESSAO_BULK = "SET SESSION foreign_key_checks = 0"
+
+# Índices secundários e FKs da FATO_OCORRENCIA (mesmas definições do setup_database.sql).
+# Removidos antes da carga e recriados de uma vez no final. O índice único da chave_fato e o do
+# atendimento não estão aqui: a carga idempotente usa os dois durante a carga
+INDICES_FATO = {
+    'idx_fato_tempo': '(tempo_id, natureza_id, local_id, hora_id)',
+    'idx_fato_local': '(local_id, tempo_id, natureza_id, hora_id)',
+    'idx_fato_natureza': '(natureza_id, tempo_id, local_id, hora_id)',
+    'idx_fato_hora': '(hora_id, natureza_id)',
+}
+FKS_FATO = {
+    'fk_fato_tempo': ('tempo_id', 'DIM_TEMPO'),
+    'fk_fato_natureza': ('natureza_id', 'DIM_NATUREZA'),
+    'fk_fato_local': ('local_id', 'DIM_LOCAL'),
+    'fk_fato_hora': ('hora_id', 'DIM_HORA'),
+}
+
+# Uma única consulta, baseada em conjuntos, conta as linhas da fato sem a dimensão correspondente
+SQL_ORFAOS_FATO = " UNION ALL ".join(
+    f"SELECT '{coluna}' AS chave, COUNT(*) AS orfaos FROM FATO_OCORRENCIA f "
+    f"LEFT JOIN {dimensao} d ON f.{coluna} = d.{coluna} "
+    f"WHERE f.{coluna} IS NOT NULL AND d.{coluna} IS NULL"
+    for coluna, dimensao in FKS_FATO.values()
+)
+
+#############################################################
+# MODELO ESTRELA NO SQLITE (mesmas tabelas, índices e views do setup_database.sql)
+#############################################################
+
+# INTEGER PRIMARY KEY é o rowid do SQLite: gera o próximo id como o AUTO_INCREMENT e aceita
+# os ids de 63 bits do --chaves hash. CARGA_MANIFESTO, CARGA_VERSAO e o índice idx_fato_arquivo
+# (a coluna só existe em bancos antigos depois da migração) são criados pelo loader
+DDL_SQLITE = [
+    """CREATE TABLE IF NOT EXISTS DIM_TEMPO (tempo_id INTEGER PRIMARY KEY, data_completa DATE NOT NULL UNIQUE,
+       ocorrencia_ano INT, ocorrencia_mes INT, ocorrencia_dia INT, ocorrencia_dia_semana VARCHAR(50),
+       ocorrencia_periodo VARCHAR(50), nome_mes VARCHAR(20), trimestre INT, semestre INT)""",
+    "CREATE INDEX IF NOT EXISTS idx_dim_tempo_ano_mes ON DIM_TEMPO (ocorrencia_ano, ocorrencia_mes, nome_mes)",
+    "CREATE INDEX IF NOT EXISTS idx_dim_tempo_dia_semana ON DIM_TEMPO (ocorrencia_dia_semana)",
+    """CREATE TABLE IF NOT EXISTS DIM_NATUREZA (natureza_id INTEGER PRIMARY KEY, natureza1_codigo INT,
+       natureza1_descricao VARCHAR(255), natureza2_descricao VARCHAR(255), tipo_envolvimento VARCHAR(100),
+       categoria_crime VARCHAR(50))""",
+    """CREATE INDEX IF NOT EXISTS idx_dim_natureza_busca
+       ON DIM_NATUREZA (natureza1_descricao, natureza2_descricao, tipo_envolvimento)""",
+    "CREATE INDEX IF NOT EXISTS idx_dim_natureza_categoria ON DIM_NATUREZA (categoria_crime)",
+    """CREATE TABLE IF NOT EXISTS DIM_LOCAL (local_id INTEGER PRIMARY KEY, bairro_nome VARCHAR(100),
+       regional_nome VARCHAR(100), logradouro_nome VARCHAR(255), classificacao_bairro_regional VARCHAR(100))""",
+    "CREATE INDEX IF NOT EXISTS idx_dim_local_busca ON DIM_LOCAL (bairro_nome, regional_nome, logradouro_nome)",
+    "CREATE INDEX IF NOT EXISTS idx_dim_local_regional ON DIM_LOCAL (regional_nome, bairro_nome)",
+    """CREATE TABLE IF NOT EXISTS DIM_HORA (hora_id INTEGER PRIMARY KEY, hora_completa VARCHAR(8) NOT NULL UNIQUE,
+       hora INT, minuto INT, periodo_dia VARCHAR(20))""",
+    "CREATE INDEX IF NOT EXISTS idx_dim_hora_periodo ON DIM_HORA (periodo_dia, hora)",
+    "CREATE TABLE IF NOT EXISTS FATO_OCORRENCIA (ocorrencia_id INTEGER PRIMARY KEY, "
+    "tempo_id BIGINT NOT NULL, natureza_id BIGINT NOT NULL, local_id BIGINT NOT NULL, hora_id BIGINT, "
+    "atendimento_numero BIGINT, chave_fato BIGINT NOT NULL, arquivo_id BIGINT, "
+    "CONSTRAINT uk_fato_chave UNIQUE (chave_fato), "
+    + ", ".join(f"CONSTRAINT {nome} FOREIGN KEY ({coluna}) REFERENCES {dimensao} ({coluna})"
+                for nome, (coluna, dimensao) in FKS_FATO.items()) + ")",
+    *(f"CREATE INDEX IF NOT EXISTS {nome} ON FATO_OCORRENCIA {colunas}" for nome, colunas in INDICES_FATO.items()),
+    "CREATE TABLE IF NOT EXISTS AGG_CRIMES_ANO (ocorrencia_ano INT PRIMARY KEY, total BIGINT NOT NULL)",
+    """CREATE TABLE IF NOT EXISTS AGG_CRIMES_MES (ocorrencia_ano INT, ocorrencia_mes INT, nome_mes VARCHAR(20),
+       total BIGINT NOT NULL, PRIMARY KEY (ocorrencia_ano, ocorrencia_mes))""",
+    """CREATE TABLE IF NOT EXISTS AGG_CRIMES_BAIRRO (bairro_nome VARCHAR(100), regional_nome VARCHAR(100),
+       total BIGINT NOT NULL, PRIMARY KEY (bairro_nome, regional_nome))""",
+    "CREATE TABLE IF NOT EXISTS AGG_CRIMES_TIPO (tipo_crime VARCHAR(255) PRIMARY KEY, total BIGINT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS AGG_CRIMES_CATEGORIA (categoria_crime VARCHAR(50) PRIMARY KEY, total BIGINT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS AGG_CRIMES_PERIODO (periodo_dia VARCHAR(20) PRIMARY KEY, total BIGINT NOT NULL)",
+    """CREATE VIEW IF NOT EXISTS vw_ocorrencias_completas AS
+       SELECT f.ocorrencia_id, f.atendimento_numero, t.data_completa, t.ocorrencia_ano, t.ocorrencia_mes,
+              t.nome_mes, t.ocorrencia_dia_semana, t.trimestre, t.semestre, h.hora_completa, h.hora,
+              h.periodo_dia, n.natureza1_descricao AS tipo_crime, n.natureza2_descricao, n.tipo_envolvimento,
+              n.categoria_crime, l.bairro_nome, l.regional_nome, l.logradouro_nome
+       FROM FATO_OCORRENCIA f
+       JOIN DIM_TEMPO t ON f.tempo_id = t.tempo_id
+       JOIN DIM_NATUREZA n ON f.natureza_id = n.natureza_id
+       JOIN DIM_LOCAL l ON f.local_id = l.local_id
+       LEFT JOIN DIM_HORA h ON f.hora_id = h.hora_id""",
+    """CREATE VIEW IF NOT EXISTS vw_crimes_por_ano AS
+       SELECT ocorrencia_ano, total AS total_ocorrencias FROM AGG_CRIMES_ANO""",
+    """CREATE VIEW IF NOT EXISTS vw_top_bairros AS
+       SELECT NULLIF(bairro_nome, '') AS bairro_nome, NULLIF(regional_nome, '') AS regional_nome,
+              total AS total_ocorrencias
+       FROM AGG_CRIMES_BAIRRO""",
+    """CREATE VIEW IF NOT EXISTS vw_crimes_por_periodo AS
+       SELECT periodo_dia, total AS total_ocorrencias FROM AGG_CRIMES_PERIODO""",
+]
+
+#############################################################
+# VALIDAÇÃO (comum aos dois bancos)
+#############################################################
+
+def validar_chaves_estrangeiras(engine):
+
+    """Conta as linhas órfãs da FATO_OCORRENCIA (uma consulta para as quatro FKs) e devolve chave -> órfãs"""
+
+    with engine.connect() as connection:
+        orfaos = {chave: quantidade for chave, quantidade in connection.execute(text(SQL_ORFAOS_FATO))}
+
+    if any(orfaos.values()):
+        print("❌ Linhas órfãs na FATO_OCORRENCIA (FK sem linha na dimensão):")
+        for chave, quantidade in orfaos.items():
+            if quantidade:
+                print(f"   {chave}: {quantidade:,}")
+    else:
+        print("✅ Nenhuma linha órfã na FATO_OCORRENCIA")
+    return orfaos
+
+#############################################################
+# MYSQL
+#############################################################
+
+class BancoMySQL:
+
+    """MySQL/MariaDB. Com bulk=True as conexões saem com SQL_SESSAO_BULK no init_command."""
+
+    nome = 'mysql'
+    modos_carga = ('insert', 'load_data')
+    # Vários processos podem gravar ao mesmo tempo (--workers)
+    escritores_concorrentes = True
+
+    def __init__(self, config, bulk=False, local_infile=False):
+        self.config = config
+        self.bulk = bulk
+        self.local_infile = local_infile
+
+    def url(self):
+        return (f"mysql+pymysql://{self.config['user']}:{self.config['password']}"
+                f"@{self.config['host']}:{self.config['port']}/{self.config['database']}?charset=utf8mb4")
+
+    def descricao(self):
+        return f"MySQL {self.config['host']}:{self.config['port']}/{self.config['database']}"
+
+    def existe(self):
+        return True
+
+    def criar_engine(self):
+        # LOAD DATA LOCAL INFILE precisa ser habilitado também no cliente
+        connect_args = {'local_infile': True} if self.local_infile else {}
+        if self.bulk:
+            connect_args['init_command'] = SQL_SESSAO_BULK
+        return create_engine(self.url(), pool_pre_ping=True, connect_args=connect_args)
+
+    def criar_esquema(self, engine):
+
+        """No MySQL as tabelas vêm do setup_database.sql (que também cria o banco)"""
+
+    def _objetos_fato(self, connection):
+
+        """Nomes dos índices e das FKs que existem hoje na FATO_OCORRENCIA"""
+
+        indices = {linha[0] for linha in connection.execute(text("""
+            SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'FATO_OCORRENCIA'
+        """))}
+        fks = {linha[0] for linha in connection.execute(text("""
+            SELECT CONSTRAINT_NAME FROM information_schema.TABLE_CONSTRAINTS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'FATO_OCORRENCIA' AND CONSTRAINT_TYPE = 'FOREIGN KEY'
+        """))}
+        return indices, fks
+
+    def preparar_carga_em_massa(self, engine):
+
+        """
+        Remove as FKs e os índices secundários da FATO_OCORRENCIA num único ALTER TABLE.
+        Pode ser repetida: só remove o que ainda existe (uma carga --bulk interrompida é
+        retomada rodando --bulk de novo).
+        """
+
+        with engine.begin() as connection:
+            indices, fks = self._objetos_fato(connection)
+            remocoes = [f"DROP FOREIGN KEY {nome}" for nome in FKS_FATO if nome in fks]
+            remocoes += [f"DROP INDEX {nome}" for nome in INDICES_FATO if nome in indices]
+            if remocoes:
+                connection.execute(text(f"ALTER TABLE FATO_OCORRENCIA {', '.join(remocoes)}"))
+        print(f"🚚 Carga em massa: {len(remocoes)} FKs/índices da FATO_OCORRENCIA removidos até o fim da carga")
+
+    def finalizar_carga_em_massa(self, engine):
+
+        """
+        Recria os índices que faltam (um ALTER TABLE, cada índice construído uma vez por ordenação)
+        e depois as FKs. Como a sessão está com foreign_key_checks = 0 as FKs entram sem revalidar
+        linha a linha: a validação é feita em seguida por validar_chaves_estrangeiras.
+        """
+
+        inicio = time.perf_counter()
+        with engine.begin() as connection:
+            indices, fks = self._objetos_fato(connection)
+            faltando = [f"ADD INDEX {nome} {colunas}" for nome, colunas in INDICES_FATO.items()
+                        if nome not in indices]
+            if faltando:
+                connection.execute(text(f"ALTER TABLE FATO_OCORRENCIA {', '.join(faltando)}"))
+            restricoes = [
+                f"ADD CONSTRAINT {nome} FOREIGN KEY ({coluna}) REFERENCES {dimensao} ({coluna})"
+                for nome, (coluna, dimensao) in FKS_FATO.items() if nome not in fks
+            ]
+            if restricoes:
+                connection.execute(text(f"ALTER TABLE FATO_OCORRENCIA {', '.join(restricoes)}"))
+        print(f"🧱 Índices e FKs da FATO_OCORRENCIA recriados em {time.perf_counter() - inicio:.1f}s")
+        validar_chaves_estrangeiras(engine)
+
+#############################################################
+# SQLITE
+#############################################################
+
+def _field(valor, *lista):
+    return lista.index(valor) + 1 if valor in lista else 0
+
+
+def _datediff(fim, inicio):
+    if fim is None or inicio is None:
+        return None
+    return (date.fromisoformat(str(fim)[:10]) - date.fromisoformat(str(inicio)[:10])).days
+
+
+class BancoSQLite:
+
+    """
+    Um arquivo SQLite com o modelo estrela. Cada conexão recebe os PRAGMAS_SQLITE (ou
+    PRAGMAS_SQLITE_BULK com bulk=True) e as funções do MySQL que os scripts usam.
+    Um escritor por vez: a carga roda no pipeline (sem --workers).
+    """
+
+    nome = 'sqlite'
+    modos_carga = ('insert',)
+    escritores_concorrentes = False
+
+    def __init__(self, caminho=ARQUIVO_SQLITE, bulk=False):
+        self.caminho = caminho
+        self.bulk = bulk
+
+    def url(self):
+        return f"sqlite:///{self.caminho}"
+
+    def descricao(self):
+        return f"SQLite {self.caminho}"
+
+    def existe(self):
+        return os.path.exists(self.caminho)
+
+    def pragmas(self):
+        return PRAGMAS_SQLITE_BULK if self.bulk else PRAGMAS_SQLITE
+
+    def criar_engine(self):
+        os.makedirs(os.path.dirname(self.caminho) or '.', exist_ok=True)
+        engine = create_engine(self.url(), connect_args={'timeout': TIMEOUT_SQLITE})
+        pragmas = self.pragmas()
+
+        @event.listens_for(engine, 'connect')
+        def _configurar(dbapi_connection, _):
+            for nome, valor in pragmas.items():
+                dbapi_connection.execute(f"PRAGMA {nome} = {valor}")
+            # O v1 busca o id gerado com SELECT LAST_INSERT_ID()
+            dbapi_connection.create_function(
+                'LAST_INSERT_ID', 0, lambda: dbapi_connection.execute('SELECT last_insert_rowid()').fetchone()[0]
+            )
+            # consultas_uteis.sql ordena dias da semana e períodos com FIELD() e mede o período com DATEDIFF()
+            dbapi_connection.create_function('FIELD', -1, _field, deterministic=True)
+            dbapi_connection.create_function('DATEDIFF', 2, _datediff, deterministic=True)
+
+        return engine
+
+    def criar_esquema(self, engine):
+
+        """Cria o que faltar do modelo estrela (pode rodar a cada carga)"""
+
+        with engine.begin() as connection:
+            for ddl in DDL_SQLITE:
+                connection.execute(text(ddl))
+
+    def preparar_carga_em_massa(self, engine):
+
+        """Remove os índices secundários da FATO_OCORRENCIA (as FKs já estão desligadas na conexão)"""
+
+        with engine.begin() as connection:
+            for nome in INDICES_FATO:
+                connection.execute(text(f"DROP INDEX IF EXISTS {nome}"))
+        print(f"🚚 Carga em massa: {len(INDICES_FATO)} índices da FATO_OCORRENCIA removidos até o fim da carga, "
+              f"synchronous=OFF e foreign_keys=OFF")
+
+    def finalizar_carga_em_massa(self, engine):
+
+        """
+        Recria os índices (cada um numa ordenação só), valida as FKs com uma consulta,
+        atualiza as estatísticas do planejador e esvazia o WAL no arquivo principal.
+        """
+
+        inicio = time.perf_counter()
+        with engine.begin() as connection:
+            for nome, colunas in INDICES_FATO.items():
+                connection.execute(text(f"CREATE INDEX IF NOT EXISTS {nome} ON FATO_OCORRENCIA {colunas}"))
+        with engine.connect() as connection:
+            connection.exec_driver_sql("ANALYZE")
+            connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        print(f"🧱 Índices da FATO_OCORRENCIA recriados em {time.perf_counter() - inicio:.1f}s")
+        validar_chaves_estrangeiras(engine)
+
+
+BANCOS = {'mysql': BancoMySQL, 'sqlite': BancoSQLite}
@@ -0,0 +1,810 @@
+#######################################################################
+# BENCHMARK DO ETL - CRIMES CURITIBA
+#######################################################################
+
+# Este script:
+# 1. Gera CSVs sintéticos no layout do Sigesguarda (CSV_COLUMNS), de 10 mil a 10 milhões de linhas
+# 2. Executa os caminhos de carga v1 (process_csv_url_to_db) e v2 (processar_csv_para_mysql)
+#    contra um banco SQLite local (bancos_etl.BancoSQLite, o mesmo do loader com --banco sqlite)
+# 3. Mede linhas/s, pico de memória e quantidade de queries por etapa
+#
+# Exemplos:
+#   python benchmark_etl.py gerar data/bench/sigesguarda_1m.csv --linhas 1000000 --encoding utf-8
+#   python benchmark_etl.py executar --linhas 100000 --saida data/bench/resultado.json
+#   python benchmark_etl.py executar --linhas 100000 --baseline data/bench/resultado.json
+#   python benchmark_etl.py executar --linhas 100000 --bulk
+#   python benchmark_etl.py transformacoes --linhas 400000
+#   python benchmark_etl.py memoria
+#   python benchmark_etl.py consultas --linhas 2000000 --banco data/bench/consultas.db
+#######################################################################
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import event, text
+
+import coleta_mysql
+import coleta_mysql_v2
+import harness_consultas
+from bancos_etl import BancoSQLite
+
+#############################################################
+# DADOS DE REFERÊNCIA PARA O GERADOR
+#############################################################
+
+# Bairros de Curitiba e a regional de cada um
+BAIRROS_REGIONAIS = {
+    'CENTRO': 'MATRIZ', 'CENTRO CÍVICO': 'MATRIZ', 'ALTO DA GLÓRIA': 'MATRIZ', 'ALTO DA RUA XV': 'MATRIZ',
+    'BATEL': 'MATRIZ', 'BIGORRILHO': 'MATRIZ', 'BOM RETIRO': 'MATRIZ', 'CABRAL': 'MATRIZ',
+    'CRISTO REI': 'MATRIZ', 'HUGO LANGE': 'MATRIZ', 'JARDIM BOTÂNICO': 'MATRIZ', 'JARDIM SOCIAL': 'MATRIZ',
+    'JUVEVÊ': 'MATRIZ', 'MERCÊS': 'MATRIZ', 'PRADO VELHO': 'MATRIZ', 'REBOUÇAS': 'MATRIZ',
+    'SÃO FRANCISCO': 'MATRIZ', 'AHÚ': 'MATRIZ',
+    'ABRANCHES': 'BOA VISTA', 'ATUBA': 'BOA VISTA', 'BACACHERI': 'BOA VISTA', 'BAIRRO ALTO': 'BOA VISTA',
+    'BARREIRINHA': 'BOA VISTA', 'BOA VISTA': 'BOA VISTA', 'CACHOEIRA': 'BOA VISTA', 'PILARZINHO': 'BOA VISTA',
+    'SANTA CÂNDIDA': 'BOA VISTA', 'SÃO LOURENÇO': 'BOA VISTA', 'TARUMÃ': 'BOA VISTA', 'TINGUI': 'BOA VISTA',
+    'TABOÃO': 'BOA VISTA',
+    'ALTO BOQUEIRÃO': 'BOQUEIRÃO', 'BOQUEIRÃO': 'BOQUEIRÃO', 'HAUER': 'BOQUEIRÃO', 'XAXIM': 'BOQUEIRÃO',
+    'CAJURU': 'CAJURU', 'CAPÃO DA IMBUIA': 'CAJURU', 'GUABIROTUBA': 'CAJURU', 'JARDIM DAS AMÉRICAS': 'CAJURU',
+    'UBERABA': 'CAJURU',
+    'CIDADE INDUSTRIAL DE CURITIBA': 'CIC', 'AUGUSTA': 'CIC', 'RIVIERA': 'CIC', 'SÃO MIGUEL': 'CIC',
+    'CAPÃO RASO': 'PINHEIRINHO', 'FAZENDINHA': 'PINHEIRINHO', 'LINDÓIA': 'PINHEIRINHO',
+    'NOVO MUNDO': 'PINHEIRINHO', 'PINHEIRINHO': 'PINHEIRINHO',
+    'ÁGUA VERDE': 'PORTÃO', 'CAMPO COMPRIDO': 'PORTÃO', 'FANNY': 'PORTÃO', 'GUAÍRA': 'PORTÃO',
+    'PAROLIN': 'PORTÃO', 'PORTÃO': 'PORTÃO', 'SANTA QUITÉRIA': 'PORTÃO', 'SEMINÁRIO': 'PORTÃO',
+    'VILA IZABEL': 'PORTÃO',
+    'BUTIATUVINHA': 'SANTA FELICIDADE', 'CAMPINA DO SIQUEIRA': 'SANTA FELICIDADE',
+    'CASCATINHA': 'SANTA FELICIDADE', 'LAMENHA PEQUENA': 'SANTA FELICIDADE', 'MOSSUNGUÊ': 'SANTA FELICIDADE',
+    'ORLEANS': 'SANTA FELICIDADE', 'SANTA FELICIDADE': 'SANTA FELICIDADE', 'SANTO INÁCIO': 'SANTA FELICIDADE',
+    'SÃO BRAZ': 'SANTA FELICIDADE', 'SÃO JOÃO': 'SANTA FELICIDADE', 'VISTA ALEGRE': 'SANTA FELICIDADE',
+    'SÍTIO CERCADO': 'BAIRRO NOVO', 'UMBARÁ': 'BAIRRO NOVO', 'GANCHINHO': 'BAIRRO NOVO',
+    'CAMPO DE SANTANA': 'TATUQUARA', 'CAXIMBA': 'TATUQUARA', 'TATUQUARA': 'TATUQUARA',
+}
+
+NATUREZAS = [
+    'FURTO', 'FURTO QUALIFICADO', 'FURTO DE VEÍCULO', 'TENTATIVA DE FURTO', 'ROUBO', 'ROUBO A TRANSEUNTE',
+    'ROUBO DE VEÍCULO', 'LESÃO CORPORAL', 'LESAO CORPORAL CULPOSA', 'AMEAÇA', 'DANO', 'DANO AO PATRIMÔNIO PÚBLICO',
+    'VIAS DE FATO', 'PERTURBAÇÃO DO SOSSEGO', 'ACIDENTE DE TRÂNSITO', 'INFRAÇÃO DE TRANSITO',
+    'POSSE DE ENTORPECENTES', 'TRÁFICO DE DROGAS', 'USO DE DROGA', 'HOMICÍDIO', 'TENTATIVA DE HOMICIDIO',
+    'DESACATO', 'VIOLÊNCIA DOMÉSTICA', 'EMBRIAGUEZ AO VOLANTE', 'PICHAÇÃO', 'ATO OBSCENO', 'RECEPTAÇÃO',
+    'ABORDAGEM A PESSOA EM ATITUDE SUSPEITA', 'APOIO A ÓRGÃOS', 'AUXÍLIO AO CIDADÃO', 'DESOBEDIÊNCIA',
+    'PORTE ILEGAL DE ARMA', 'INVASÃO DE PROPRIEDADE', 'MAUS TRATOS A ANIMAIS', 'ESTELIONATO',
+    'COMÉRCIO IRREGULAR', 'SOM ALTO', 'PESSOA DESAPARECIDA', 'ALARME DISPARADO', 'ÓBITO',
+]
+NATUREZAS2 = ['', '', '', '', 'FURTO', 'AMEAÇA', 'DANO', 'LESÃO CORPORAL', 'DESACATO', 'RESISTÊNCIA']
+TIPOS_ENVOLVIMENTO = ['AUTOR', 'VÍTIMA', 'TESTEMUNHA', 'SUSPEITO', 'COMUNICANTE', 'ENVOLVIDO']
+TIPOS_LOGRADOURO = ['RUA', 'AVENIDA', 'TRAVESSA', 'ALAMEDA', 'PRAÇA', 'RODOVIA']
+NOMES_LOGRADOURO = [
+    'XV DE NOVEMBRO', 'MARECHAL DEODORO', 'SETE DE SETEMBRO', 'JOÃO GUALBERTO', 'CÂNDIDO DE ABREU',
+    'REPÚBLICA ARGENTINA', 'WINSTON CHURCHILL', 'BRIGADEIRO FRANCO', 'COMENDADOR ARAÚJO', 'SILVA JARDIM',
+    'DESEMBARGADOR WESTPHALEN', 'IGUAÇU', 'VISCONDE DE GUARAPUAVA', 'MATEUS LEME', 'PRESIDENTE KENNEDY',
+    'MANOEL RIBAS', 'PADRE ANCHIETA', 'BATEL', 'SALGADO FILHO', 'COMENDADOR FRANCO',
+]
+DIAS_SEMANA = ['SEGUNDA-FEIRA', 'TERÇA-FEIRA', 'QUARTA-FEIRA', 'QUINTA-FEIRA', 'SEXTA-FEIRA', 'SÁBADO', 'DOMINGO']
+
+# Colunas extras que existem nos CSVs reais e são descartadas pelo usecols
+COLUNAS_EXTRAS = ['OCORRENCIA_CODIGO', 'SECRETARIA_NOME', 'SUBCATEGORIA_DESCRICAO']
+
+#############################################################
+# GERADOR DE CSV SINTÉTICO
+#############################################################
+
+def _pesos_zipf(n, s=1.1):
+    pesos = 1.0 / np.arange(1, n + 1) ** s
+    return pesos / pesos.sum()
+
+
+def gerar_csv_sigesguarda(caminho, linhas, encoding='latin1', ano=2019, seed=42, bloco=500000):
+
+    """
+    Gera um CSV sintético no layout do Sigesguarda (separador ';', colunas de CSV_COLUMNS + extras).
+    Bairros, naturezas e logradouros seguem distribuições com cauda longa, como nos dados reais;
+    a quantidade de logradouros cresce com o tamanho do arquivo (até 30 mil).
+    """
+
+    rng = np.random.default_rng(seed)
+    bairros = np.array(list(BAIRROS_REGIONAIS))
+    regionais = np.array([BAIRROS_REGIONAIS[b] for b in bairros])
+    naturezas = np.array(NATUREZAS)
+    qtd_logradouros = int(min(30000, max(200, linhas // 50)))
+    logradouros = np.array([
+        f"{TIPOS_LOGRADOURO[i % len(TIPOS_LOGRADOURO)]} {NOMES_LOGRADOURO[i % len(NOMES_LOGRADOURO)]} {i // 20 + 1}"
+        for i in range(qtd_logradouros)
+    ])
+    pesos_bairros = _pesos_zipf(len(bairros), 0.8)
+    pesos_naturezas = _pesos_zipf(len(naturezas))
+    pesos_logradouros = _pesos_zipf(qtd_logradouros)
+    inicio_ano = np.datetime64(f'{ano}-01-01')
+    dias_no_ano = int((np.datetime64(f'{ano + 1}-01-01') - inicio_ano).astype(int))
+
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    atendimento = 1_000_000
+    with open(caminho, 'w', encoding=encoding, newline='') as arquivo:
+        for inicio in range(0, linhas, bloco):
+            n = min(bloco, linhas - inicio)
+            datas = pd.to_datetime(inicio_ano + rng.integers(0, dias_no_ano, n).astype('timedelta64[D]'))
+            horas = rng.integers(0, 24, n)
+            minutos = rng.integers(0, 60, n)
+            idx_bairro = rng.choice(len(bairros), n, p=pesos_bairros)
+            # Um atendimento pode ter mais de um envolvido (linhas seguidas com o mesmo número)
+            novos = rng.random(n) < 0.7
+            numeros = atendimento + np.cumsum(novos)
+            atendimento = int(numeros[-1]) + 1
+
+            df = pd.DataFrame({
+                'OCORRENCIA_DATA': datas.strftime('%d/%m/%Y'),
+                'OCORRENCIA_ANO': ano,
+                'OCORRENCIA_MES': datas.month,
+                'OCORRENCIA_HORA': [f"{h:02d}:{m:02d}" for h, m in zip(horas, minutos)],
+                'OCORRENCIA_DIA_SEMANA': np.array(DIAS_SEMANA)[datas.dayofweek],
+                'OCORRENCIA_PERIODO': np.select(
+                    [horas < 6, horas < 12, horas < 18], ['MADRUGADA', 'MANHÃ', 'TARDE'], 'NOITE'
+                ),
+                'ATENDIMENTO_BAIRRO_NOME': bairros[idx_bairro],
+                'ATENDIMENTO_REGIONAL_NOME': regionais[idx_bairro],
+                'ATENDIMENTO_LOGRADOURO_NOME': logradouros[rng.choice(qtd_logradouros, n, p=pesos_logradouros)],
+                'CLASSIFICACAO_BAIRRO_REGIONAL': 'BAIRRO',
+                'NATUREZA1_CODIGO': rng.choice(len(naturezas), n, p=pesos_naturezas) + 1,
+                'NATUREZA1_DESCRICAO': '',
+                'NATUREZA2_DESCRICAO': np.array(NATUREZAS2)[rng.integers(0, len(NATUREZAS2), n)],
+                'TIPO_ENVOLVIMENTO': np.array(TIPOS_ENVOLVIMENTO)[rng.integers(0, len(TIPOS_ENVOLVIMENTO), n)],
+                'ATENDIMENTO_NUMERO': numeros,
+                'OCORRENCIA_CODIGO': np.arange(inicio, inicio + n),
+                'SECRETARIA_NOME': 'GUARDA MUNICIPAL',
+                'SUBCATEGORIA_DESCRICAO': '',
+            })
+            df['NATUREZA1_DESCRICAO'] = naturezas[df['NATUREZA1_CODIGO'] - 1]
+            df.to_csv(arquivo, sep=';', index=False, header=(inicio == 0), lineterminator='\n')
+    return caminho
+
+#############################################################
+# BANCO LOCAL (SQLite no papel do MySQL)
+#############################################################
+
+# Modelo do v1 (TEMPO/NATUREZA/LOCAL/OCORRENCIA); o v2 (DIM_*/FATO_OCORRENCIA) é criado pelo BancoSQLite,
+# o mesmo usado pelo loader com --banco sqlite
+DDL_SQLITE_V1 = [
+    """CREATE TABLE TEMPO (tempo_id INTEGER PRIMARY KEY AUTOINCREMENT, data_completa DATE NOT NULL UNIQUE,
+       ocorrencia_ano INT, ocorrencia_mes INT, ocorrencia_dia_semana VARCHAR(50), ocorrencia_periodo VARCHAR(50))""",
+    """CREATE TABLE NATUREZA (natureza_id INTEGER PRIMARY KEY AUTOINCREMENT, natureza1_descricao VARCHAR(255),
+       natureza2_descricao VARCHAR(255), tipo_envolvimento VARCHAR(100))""",
+    "CREATE INDEX idx_natureza_busca ON NATUREZA (natureza1_descricao, natureza2_descricao, tipo_envolvimento)",
+    """CREATE TABLE LOCAL (local_id INTEGER PRIMARY KEY AUTOINCREMENT, bairro_nome VARCHAR(100),
+       regional_nome VARCHAR(100), logradouro_nome VARCHAR(255), classificacao_bairro_regional VARCHAR(100))""",
+    "CREATE INDEX idx_local_busca ON LOCAL (bairro_nome, regional_nome, logradouro_nome)",
+    """CREATE TABLE OCORRENCIA (ocorrencia_id INTEGER PRIMARY KEY AUTOINCREMENT, tempo_id INT NOT NULL,
+       natureza_id INT NOT NULL, local_id INT NOT NULL, ocorrencia_hora VARCHAR(10), atendimento_numero BIGINT,
+       chave_ocorrencia BIGINT NOT NULL UNIQUE)""",
+]
+
+
+def conectar_banco_local(caminho, bulk=False):
+
+    """Engine para um banco SQLite local, com os PRAGMAs e as funções do MySQL do BancoSQLite"""
+
+    return BancoSQLite(caminho, bulk=bulk).criar_engine()
+
+
+def criar_banco_local(caminho, bulk=False):
+
+    """Cria um banco SQLite vazio com os dois modelos e devolve a engine"""
+
+    for arquivo in (caminho, caminho + '-wal', caminho + '-shm'):
+        if os.path.exists(arquivo):
+            os.remove(arquivo)
+    banco = BancoSQLite(caminho, bulk=bulk)
+    engine = banco.criar_engine()
+    with engine.begin() as connection:
+        for ddl in DDL_SQLITE_V1:
+            connection.execute(text(ddl))
+    banco.criar_esquema(engine)
+    coleta_mysql_v2.garantir_tabela_manifesto(engine)
+    coleta_mysql_v2.garantir_chave_fato(engine)
+    return engine
+
+#############################################################
+# MEDIÇÃO POR ETAPA
+#############################################################
+
+class Medidor:
+
+    """
+    Acumula tempo, chamadas e queries por etapa do ETL.
+    As etapas são marcadas envolvendo funções dos módulos de carga (sem alterar os scripts).
+    """
+
+    def __init__(self):
+        self.etapa_atual = 'outros'
+        self.segundos = defaultdict(float)
+        self.chamadas = defaultdict(int)
+        self.queries = defaultdict(lambda: defaultdict(int))
+        self._originais = []
+
+    @contextlib.contextmanager
+    def etapa(self, nome):
+        anterior, self.etapa_atual = self.etapa_atual, nome
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.segundos[nome] += time.perf_counter() - inicio
+            self.chamadas[nome] += 1
+            self.etapa_atual = anterior
+            # O tempo de uma etapa interna não conta de novo na etapa que a chamou
+            if anterior != 'outros':
+                self.segundos[anterior] -= time.perf_counter() - inicio
+
+    def envolver(self, modulo, nome_funcao, etapa):
+        original = getattr(modulo, nome_funcao)
+        medidor = self
+
+        def funcao(*args, **kwargs):
+            with medidor.etapa(etapa):
+                return original(*args, **kwargs)
+
+        self._originais.append((modulo, nome_funcao, original))
+        setattr(modulo, nome_funcao, funcao)
+
+    def envolver_gerador(self, modulo, nome_funcao, etapa):
+
+        """Mede o tempo gasto produzindo cada item de um gerador (ex.: leitura dos chunks do CSV)"""
+
+        original = getattr(modulo, nome_funcao)
+        medidor = self
+
+        def funcao(*args, **kwargs):
+            iterador = iter(original(*args, **kwargs))
+            while True:
+                with medidor.etapa(etapa):
+                    try:
+                        item = next(iterador)
+                    except StopIteration:
+                        return
+                yield item
+
+        self._originais.append((modulo, nome_funcao, original))
+        setattr(modulo, nome_funcao, funcao)
+
+    def restaurar(self):
+        for modulo, nome_funcao, original in reversed(self._originais):
+            setattr(modulo, nome_funcao, original)
+        self._originais.clear()
+
+    def contar_queries(self, engine):
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _contar(conn, cursor, statement, parameters, context, executemany):
+            partes = statement.split()
+            comando = partes[0].upper() if partes else '?'
+            tabela = next((p for p in partes if p.isupper() and p not in (
+                'SELECT', 'INSERT', 'INTO', 'FROM', 'WHERE', 'UPDATE', 'SET', 'VALUES', 'AND', 'COALESCE')), '')
+            chave = f"{comando} {tabela}".strip()
+            self.queries[self.etapa_atual][chave] += 1
+            self.queries[self.etapa_atual]['_total'] += 1
+
+
+def _preparar_v1(medidor):
+    medidor.envolver(coleta_mysql.pd, 'read_csv', 'leitura_csv')
+    medidor.envolver(coleta_mysql.pd, 'to_datetime', 'conversao_datas')
+    medidor.envolver(coleta_mysql, 'limpar_coluna', 'transformacao')
+    medidor.envolver(coleta_mysql, 'resolver_dimensao', 'dimensoes')
+    medidor.envolver(coleta_mysql, 'inserir_lote', 'fatos')
+
+
+def _executar_v1(csv, engine):
+    coleta_mysql.process_csv_url_to_db(csv, engine)
+
+
+def _preparar_v2(medidor):
+    medidor.envolver_gerador(coleta_mysql_v2, 'ler_chunks_csv', 'leitura_csv')
+    medidor.envolver(coleta_mysql_v2, 'converter_tipos', 'conversao_datas')
+    medidor.envolver(coleta_mysql_v2, 'resolver_chaves_chunk', 'dimensoes')
+    medidor.envolver(coleta_mysql_v2, 'calcular_chaves_fato', 'chaves')
+    medidor.envolver(coleta_mysql_v2, 'inserir_fatos', 'fatos')
+
+
+def _executar_v2(csv, engine):
+    coleta_mysql_v2.processar_csv_para_mysql(csv, engine)
+
+
+CAMINHOS = {
+    'v1': (_preparar_v1, _executar_v1, 'OCORRENCIA'),
+    'v2': (_preparar_v2, _executar_v2, 'FATO_OCORRENCIA'),
+}
+
+
+def medir_caminho(nome, csv, diretorio, bulk=False):
+
+    """
+    Executa um caminho de carga de ponta a ponta e devolve as métricas.
+    Com bulk=True usa os PRAGMAs de carga em massa e mede também a remoção e a recriação
+    dos índices da fato (etapa 'carga_em_massa'), como o loader faz com --bulk.
+    """
+
+    preparar, executar, tabela_fato = CAMINHOS[nome]
+    caminho = os.path.join(diretorio, f'{nome}.db')
+    engine = criar_banco_local(caminho, bulk)
+    banco = BancoSQLite(caminho, bulk)
+    medidor = Medidor()
+    medidor.contar_queries(engine)
+    preparar(medidor)
+
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    try:
+        # Os scripts imprimem progresso por lote; aqui só interessa o resultado
+        with contextlib.redirect_stdout(io.StringIO()):
+            if bulk:
+                with medidor.etapa('carga_em_massa'):
+                    banco.preparar_carga_em_massa(engine)
+            executar(csv, engine)
+            if bulk:
+                with medidor.etapa('carga_em_massa'):
+                    banco.finalizar_carga_em_massa(engine)
+    finally:
+        segundos = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        medidor.restaurar()
+
+    with engine.connect() as connection:
+        linhas = connection.execute(text(f"SELECT COUNT(*) FROM {tabela_fato}")).scalar()
+    engine.dispose()
+
+    medidor.segundos['outros'] = max(0.0, segundos - sum(v for k, v in medidor.segundos.items() if k != 'outros'))
+    return {
+        'caminho': nome,
+        # Mesmo banco e mesmas configurações = números comparáveis com a baseline
+        'banco': {'nome': banco.nome, 'pragmas': banco.pragmas()},
+        'linhas': linhas,
+        'segundos': round(segundos, 3),
+        'linhas_por_segundo': round(linhas / segundos, 1) if segundos else 0.0,
+        'pico_memoria_mb': round(pico / 2 ** 20, 1),
+        'rss_max_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'etapas': {
+            etapa: {
+                'segundos': round(medidor.segundos[etapa], 3),
+                'chamadas': medidor.chamadas[etapa],
+                'queries': dict(medidor.queries.get(etapa, {})),
+            }
+            for etapa in sorted(set(medidor.segundos) | set(medidor.queries))
+        },
+    }
+
+#############################################################
+# TRANSFORMAÇÕES: VERSÃO ESCALAR x VETORIZADA
+#############################################################
+
+# Versões escalares (chamadas por linha) que existiam no loader, mantidas só como referência
+
+def _categoria_escalar(descricao):
+    if not descricao or descricao == 'NAN':
+        return 'NÃO INFORMADO'
+    descricao_upper = str(descricao).upper()
+    if 'FURTO' in descricao_upper:
+        return 'FURTO'
+    elif 'ROUBO' in descricao_upper:
+        return 'ROUBO'
+    elif 'LESÃO' in descricao_upper or 'LESAO' in descricao_upper:
+        return 'LESÃO CORPORAL'
+    elif 'DROGA' in descricao_upper or 'ENTORPECENTE' in descricao_upper:
+        return 'DROGAS'
+    elif 'TRÂNSITO' in descricao_upper or 'TRANSITO' in descricao_upper:
+        return 'TRÂNSITO'
+    elif 'AMEAÇA' in descricao_upper:
+        return 'AMEAÇA'
+    elif 'DANO' in descricao_upper:
+        return 'DANO AO PATRIMÔNIO'
+    elif 'HOMICÍDIO' in descricao_upper or 'HOMICIDIO' in descricao_upper:
+        return 'HOMICÍDIO'
+    return 'OUTROS'
+
+
+def _periodo_escalar(hora_str):
+    try:
+        hora = int(hora_str.split(':')[0]) if ':' in str(hora_str) else int(hora_str)
+        if 0 <= hora < 6:
+            return 'MADRUGADA'
+        elif 6 <= hora < 12:
+            return 'MANHÃ'
+        elif 12 <= hora < 18:
+            return 'TARDE'
+        return 'NOITE'
+    except Exception:
+        return 'NÃO INFORMADO'
+
+
+def _mes_escalar(mes_num):
+    try:
+        return coleta_mysql_v2.NOMES_MESES[int(mes_num)]
+    except Exception:
+        return 'NÃO INFORMADO'
+
+
+def medir_transformacoes(csv, encoding, repeticoes=3):
+
+    """Compara, sobre o arquivo inteiro, as funções escalares por linha com as vetorizadas do loader"""
+
+    df = pd.read_csv(csv, sep=';', encoding=encoding, dtype=str,
+                     usecols=['NATUREZA1_DESCRICAO', 'OCORRENCIA_HORA', 'OCORRENCIA_MES'])
+    casos = {
+        'categoria_crime': (
+            lambda: df['NATUREZA1_DESCRICAO'].map(_categoria_escalar),
+            lambda: coleta_mysql_v2.categorizar_crimes(df['NATUREZA1_DESCRICAO']),
+        ),
+        'periodo_dia': (
+            lambda: df['OCORRENCIA_HORA'].map(_periodo_escalar),
+            lambda: coleta_mysql_v2.classificar_periodos(df['OCORRENCIA_HORA']),
+        ),
+        'nome_mes': (
+            lambda: df['OCORRENCIA_MES'].map(_mes_escalar),
+            lambda: coleta_mysql_v2.nomes_meses(df['OCORRENCIA_MES']),
+        ),
+    }
+
+    resultados = {}
+    for nome, (escalar, vetorizada) in casos.items():
+        tempos = {}
+        for versao, funcao in (('escalar', escalar), ('vetorizada', vetorizada)):
+            melhor = float('inf')
+            for _ in range(repeticoes):
+                inicio = time.perf_counter()
+                saida = funcao()
+                melhor = min(melhor, time.perf_counter() - inicio)
+            tempos[versao] = (melhor, saida)
+        iguais = int((tempos['escalar'][1].to_numpy() == tempos['vetorizada'][1].to_numpy()).sum())
+        resultados[nome] = {
+            'linhas': len(df),
+            'escalar_s': round(tempos['escalar'][0], 4),
+            'vetorizada_s': round(tempos['vetorizada'][0], 4),
+            'ganho': round(tempos['escalar'][0] / tempos['vetorizada'][0], 1),
+            'divergencias': len(df) - iguais,
+        }
+    return resultados
+
+
+def imprimir_transformacoes(resultados):
+    print(f"\n🧮 Transformações ({next(iter(resultados.values()))['linhas']:,} linhas)")
+    print(f"   {'função':<16}{'escalar (s)':>13}{'vetorizada (s)':>16}{'ganho':>8}{'divergências':>14}")
+    for nome, r in resultados.items():
+        print(f"   {nome:<16}{r['escalar_s']:>13.4f}{r['vetorizada_s']:>16.4f}{r['ganho']:>7.1f}x{r['divergencias']:>14}")
+
+
+#############################################################
+# MEMÓRIA POR CHUNK: LEITURA SEM TIPOS x TIPOS COMPACTOS
+#############################################################
+
+def medir_memoria_chunk(csv, encoding, tamanho_chunk=coleta_mysql_v2.TAMANHO_CHUNK):
+
+    """Memória (deep) do primeiro chunk lido com cada esquema de tipos"""
+
+    esquemas = {
+        'object': {'dtype': object},
+        'dtype=str': {'dtype': str},
+        'TIPOS_LEITURA_CSV': {'dtype': coleta_mysql_v2.TIPOS_LEITURA_CSV},
+    }
+    resultados = {}
+    for nome, opcoes in esquemas.items():
+        with pd.read_csv(csv, sep=';', encoding=encoding, chunksize=tamanho_chunk,
+                         usecols=lambda col: col in coleta_mysql_v2.CSV_COLUMNS, **opcoes) as leitor:
+            chunk = next(iter(leitor))
+        resultados[nome] = round(chunk.memory_usage(deep=True).sum() / 2 ** 20, 2)
+    return resultados
+
+
+def imprimir_memoria_chunk(resultados):
+    referencia = resultados['TIPOS_LEITURA_CSV']
+    print("\n🧠 Memória do DataFrame por chunk")
+    for nome, mb in resultados.items():
+        print(f"   {nome:<20}{mb:>8.2f} MB{mb / referencia:>8.1f}x")
+
+
+#############################################################
+# CONSULTAS: TOP N COM IN/AUTO-JUNÇÃO x CTE COM JANELA
+#############################################################
+
+# Versões de consultas_uteis.sql antes da reescrita com CTE, mantidas só como referência
+# (o MySQL nem executa as quatro primeiras: LIMIT dentro de IN não é suportado).
+# A matriz juntava a view com ela mesma pelo bairro: cada ocorrência do tipo era contada
+# uma vez para cada ocorrência do bairro, ou seja, total antigo = total novo x total do bairro.
+_SUBCONSULTA_TOP_TIPOS = """
+    SELECT tipo_crime FROM vw_ocorrencias_completas
+    GROUP BY tipo_crime ORDER BY COUNT(*) DESC LIMIT 5
+"""
+
+CONSULTAS_ANTIGAS = {
+    'Evolução temporal por bairro (Top 5)': """
+        SELECT bairro_nome, ocorrencia_ano, COUNT(*) AS total_ocorrencias
+        FROM vw_ocorrencias_completas
+        WHERE bairro_nome IN (
+            SELECT bairro_nome FROM vw_ocorrencias_completas
+            GROUP BY bairro_nome ORDER BY COUNT(*) DESC LIMIT 5
+        )
+        GROUP BY bairro_nome, ocorrencia_ano
+        ORDER BY bairro_nome, ocorrencia_ano
+    """,
+    'Evolução dos principais crimes ao longo dos anos': f"""
+        SELECT ocorrencia_ano, tipo_crime, COUNT(*) AS total_ocorrencias
+        FROM vw_ocorrencias_completas
+        WHERE tipo_crime IN ({_SUBCONSULTA_TOP_TIPOS})
+        GROUP BY ocorrencia_ano, tipo_crime
+        ORDER BY tipo_crime, ocorrencia_ano
+    """,
+    'Crime por dia da semana (Top 5 crimes)': f"""
+        SELECT ocorrencia_dia_semana, tipo_crime, COUNT(*) AS total_ocorrencias
+        FROM vw_ocorrencias_completas
+        WHERE tipo_crime IN ({_SUBCONSULTA_TOP_TIPOS})
+        GROUP BY ocorrencia_dia_semana, tipo_crime
+        ORDER BY FIELD(ocorrencia_dia_semana, 'DOMINGO', 'SEGUNDA-FEIRA', 'TERÇA-FEIRA', 'QUARTA-FEIRA',
+                       'QUINTA-FEIRA', 'SEXTA-FEIRA', 'SÁBADO'), total_ocorrencias DESC
+    """,
+    'Crime por período do dia (Top 5 crimes)': f"""
+        SELECT periodo_dia, tipo_crime, COUNT(*) AS total_ocorrencias
+        FROM vw_ocorrencias_completas
+        WHERE tipo_crime IN ({_SUBCONSULTA_TOP_TIPOS})
+        GROUP BY periodo_dia, tipo_crime
+        ORDER BY FIELD(periodo_dia, 'MADRUGADA', 'MANHÃ', 'TARDE', 'NOITE'), total_ocorrencias DESC
+    """,
+    'Bairros mais perigosos por tipo de crime (matriz)': f"""
+        SELECT b.bairro_nome, c.tipo_crime, COUNT(*) AS total_ocorrencias
+        FROM vw_ocorrencias_completas b
+        JOIN vw_ocorrencias_completas c ON b.bairro_nome = c.bairro_nome
+        WHERE b.bairro_nome IN (
+            SELECT bairro_nome FROM vw_ocorrencias_completas
+            GROUP BY bairro_nome ORDER BY COUNT(*) DESC LIMIT 10
+        )
+        AND c.tipo_crime IN ({_SUBCONSULTA_TOP_TIPOS})
+        GROUP BY b.bairro_nome, c.tipo_crime
+        ORDER BY b.bairro_nome, total_ocorrencias DESC
+    """,
+}
+
+CONSULTA_MULTIPLICADA_POR_BAIRRO = 'Bairros mais perigosos por tipo de crime (matriz)'
+
+ANOS_CONSULTAS = range(2019, 2024)
+
+
+def montar_banco_consultas(caminho, linhas, linhas_por_ano=10000):
+
+    """
+    Banco com `linhas` ocorrências para medir as consultas: carrega com o loader v2 um CSV
+    sintético por ano (ANOS_CONSULTAS) e replica a tabela fato por SQL até chegar ao total
+    (as dimensões e as proporções entre bairros/tipos são as da base carregada). As cópias ficam
+    com chave_fato negativa, que não colide com as chaves calculadas pelo loader (sempre positivas).
+    """
+
+    engine = criar_banco_local(caminho)
+    linhas_por_ano = max(1, min(linhas_por_ano, linhas // len(ANOS_CONSULTAS)))
+    with tempfile.TemporaryDirectory() as diretorio, contextlib.redirect_stdout(io.StringIO()):
+        for ano in ANOS_CONSULTAS:
+            csv = gerar_csv_sigesguarda(os.path.join(diretorio, f'sigesguarda_{ano}.csv'), linhas_por_ano,
+                                        ano=ano, seed=ano)
+            coleta_mysql_v2.processar_csv_para_mysql(csv, engine)
+
+    with engine.begin() as connection:
+        base = connection.execute(text("SELECT MAX(ocorrencia_id) FROM FATO_OCORRENCIA")).scalar()
+        for atual in range(base, linhas, base):
+            connection.execute(text("""
+                INSERT INTO FATO_OCORRENCIA (tempo_id, natureza_id, local_id, hora_id, atendimento_numero, chave_fato)
+                SELECT tempo_id, natureza_id, local_id, hora_id, atendimento_numero, -(ocorrencia_id + :atual)
+                FROM FATO_OCORRENCIA WHERE ocorrencia_id <= :limite
+            """), {'limite': min(base, linhas - atual), 'atual': atual})
+    with contextlib.redirect_stdout(io.StringIO()):
+        coleta_mysql_v2.recalcular_agregados(engine)
+    return engine
+
+
+def _executar_com_limite(connection, sql, timeout):
+
+    """(segundos, linhas) ou (None, None) se a consulta passou de `timeout`"""
+
+    connection.info.get('reiniciar_relogio', lambda: None)()
+    inicio = time.perf_counter()
+    try:
+        linhas = connection.exec_driver_sql(sql).fetchall()
+    except Exception as e:
+        if 'interrupted' not in str(e):
+            raise
+        connection.rollback()
+        return None, None
+    return time.perf_counter() - inicio, linhas
+
+
+def _resultado_igual(nome, antigas, novas, totais_bairro):
+    normalizar = lambda linhas: sorted(tuple(linha) for linha in linhas)
+    if nome == CONSULTA_MULTIPLICADA_POR_BAIRRO:
+        novas = [(bairro, tipo, total * totais_bairro[bairro]) for bairro, tipo, total in novas]
+    return normalizar(antigas) == normalizar(novas)
+
+
+def medir_consultas(engine, timeout=60, repeticoes=3):
+
+    """
+    Executa cada par (consulta antiga, consulta de consultas_uteis.sql) e compara tempo e resultado.
+    Consultas que passam de `timeout` segundos são interrompidas e ficam sem tempo.
+    """
+
+    novas = {c['nome']: c['sql'] for c in harness_consultas.ler_consultas()}
+    resultados = {}
+    with engine.connect() as connection:
+        linhas_fato = connection.execute(text("SELECT COUNT(*) FROM FATO_OCORRENCIA")).scalar()
+        totais_bairro = dict(connection.execute(text(
+            "SELECT bairro_nome, COUNT(*) FROM vw_ocorrencias_completas GROUP BY bairro_nome"
+        )).fetchall())
+        harness_consultas.limitar_tempo(connection, timeout)
+
+        for nome, sql_antiga in CONSULTAS_ANTIGAS.items():
+            tempos = {}
+            for versao, sql in (('antiga', sql_antiga), ('cte', novas[nome])):
+                melhor, saida = None, None
+                for _ in range(repeticoes):
+                    segundos, saida = _executar_com_limite(connection, sql, timeout)
+                    if segundos is None:
+                        break
+                    melhor = segundos if melhor is None else min(melhor, segundos)
+                tempos[versao] = (melhor, saida)
+            (antiga_s, antigas), (nova_s, novas_linhas) = tempos['antiga'], tempos['cte']
+            resultados[nome] = {
+                'linhas_fato': linhas_fato,
+                'antiga_s': None if antiga_s is None else round(antiga_s, 3),
+                'cte_s': None if nova_s is None else round(nova_s, 3),
+                'ganho': round(antiga_s / nova_s, 1) if antiga_s and nova_s else None,
+                'linhas': None if novas_linhas is None else len(novas_linhas),
+                'iguais': (None if antigas is None or novas_linhas is None
+                           else _resultado_igual(nome, antigas, novas_linhas, totais_bairro)),
+            }
+    return resultados
+
+
+def imprimir_consultas(resultados, timeout):
+    print(f"\n🔎 Consultas Top N ({next(iter(resultados.values()))['linhas_fato']:,} ocorrências)")
+    print(f"   {'consulta':<52}{'antiga (s)':>12}{'cte (s)':>10}{'ganho':>8}{'resultado':>12}")
+    for nome, r in resultados.items():
+        antiga = f"> {timeout}" if r['antiga_s'] is None else f"{r['antiga_s']:.3f}"
+        nova = f"> {timeout}" if r['cte_s'] is None else f"{r['cte_s']:.3f}"
+        ganho = f"{r['ganho']}x" if r['ganho'] else '-'
+        iguais = {True: 'igual', False: 'DIFERENTE', None: '-'}[r['iguais']]
+        print(f"   {nome:<52}{antiga:>12}{nova:>10}{ganho:>8}{iguais:>12}")
+    if CONSULTA_MULTIPLICADA_POR_BAIRRO in resultados:
+        print("   (matriz: a versão antiga conta total x total do bairro; a comparação desconta esse fator)")
+
+#############################################################
+# RELATÓRIO
+#############################################################
+
+def imprimir_resultado(resultado, baseline=None):
+    print(f"\n⚡ {resultado['caminho']}: {resultado['linhas']:,} linhas em {resultado['segundos']:.2f}s "
+          f"({resultado['linhas_por_segundo']:,.0f} linhas/s), pico {resultado['pico_memoria_mb']} MB "
+          f"(RSS máx. {resultado['rss_max_mb']} MB)")
+    print(f"   banco: {resultado['banco']['nome']} "
+          f"({', '.join(f'{k}={v}' for k, v in resultado['banco']['pragmas'].items())})")
+    if baseline:
+        if baseline.get('banco') != resultado['banco']:
+            print(f"   ⚠️  a baseline foi medida com outra configuração de banco: {baseline.get('banco')}")
+        anterior = baseline['linhas_por_segundo']
+        if anterior:
+            print(f"   vs baseline: {anterior:,.0f} linhas/s -> {resultado['linhas_por_segundo'] / anterior:.2f}x")
+    print(f"   {'etapa':<16}{'segundos':>10}{'chamadas':>10}{'queries':>10}")
+    for etapa, dados in resultado['etapas'].items():
+        print(f"   {etapa:<16}{dados['segundos']:>10.3f}{dados['chamadas']:>10}"
+              f"{dados['queries'].get('_total', 0):>10}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do ETL com dados sintéticos do Sigesguarda")
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    gerar = sub.add_parser('gerar', help="Só gera um CSV sintético")
+    gerar.add_argument('caminho')
+    gerar.add_argument('--linhas', type=int, default=100000)
+    gerar.add_argument('--encoding', choices=('latin1', 'utf-8'), default='latin1')
+    gerar.add_argument('--ano', type=int, default=2019)
+    gerar.add_argument('--seed', type=int, default=42)
+
+    executar = sub.add_parser('executar', help="Gera os dados e mede os caminhos de carga")
+    executar.add_argument('--linhas', type=int, default=100000)
+    executar.add_argument('--encoding', choices=('latin1', 'utf-8'), default='latin1')
+    executar.add_argument('--csv', help="Usa um CSV existente em vez de gerar um novo")
+    executar.add_argument('--caminhos', nargs='+', choices=sorted(CAMINHOS), default=sorted(CAMINHOS))
+    executar.add_argument('--saida', help="Grava o resultado em JSON (para servir de baseline depois)")
+    executar.add_argument('--baseline', help="JSON de uma execução anterior para comparação")
+    executar.add_argument('--bulk', action='store_true',
+                          help="PRAGMAs de carga em massa (synchronous=OFF, foreign_keys=OFF) e índices da fato "
+                               "recriados no final, como o loader com --bulk")
+
+    memoria = sub.add_parser('memoria', help="Memória de um chunk lido sem tipos x com TIPOS_LEITURA_CSV")
+    memoria.add_argument('--linhas', type=int, default=100000)
+    memoria.add_argument('--encoding', choices=('latin1', 'utf-8'), default='latin1')
+    memoria.add_argument('--csv', help="Usa um CSV existente em vez de gerar um novo")
+
+    transformacoes = sub.add_parser('transformacoes',
+                                    help="Compara categoria/período/mês escalares x vetorizados")
+    transformacoes.add_argument('--linhas', type=int, default=400000, help="Padrão: cerca de um ano de dados")
+    transformacoes.add_argument('--encoding', choices=('latin1', 'utf-8'), default='latin1')
+    transformacoes.add_argument('--csv', help="Usa um CSV existente em vez de gerar um novo")
+
+    consultas = sub.add_parser('consultas',
+                               help="Compara as consultas Top N antigas (IN/auto-junção) com as versões CTE")
+    consultas.add_argument('--linhas', type=int, default=2000000, help="Ocorrências na tabela fato")
+    consultas.add_argument('--banco', help="Arquivo SQLite (reaproveitado se já existir)")
+    consultas.add_argument('--timeout', type=float, default=60, help="Segundos por execução")
+    consultas.add_argument('--repeticoes', type=int, default=3)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.comando == 'gerar':
+        inicio = time.perf_counter()
+        gerar_csv_sigesguarda(args.caminho, args.linhas, args.encoding, args.ano, args.seed)
+        print(f"✅ {args.linhas:,} linhas geradas em {args.caminho} ({time.perf_counter() - inicio:.1f}s)")
+        return
+
+    if args.comando == 'memoria':
+        with tempfile.TemporaryDirectory() as diretorio:
+            csv = args.csv or gerar_csv_sigesguarda(
+                os.path.join(diretorio, 'sigesguarda_sintetico.csv'), args.linhas, args.encoding
+            )
+            imprimir_memoria_chunk(medir_memoria_chunk(csv, args.encoding))
+        return
+
+    if args.comando == 'transformacoes':
+        with tempfile.TemporaryDirectory() as diretorio:
+            csv = args.csv or gerar_csv_sigesguarda(
+                os.path.join(diretorio, 'sigesguarda_sintetico.csv'), args.linhas, args.encoding
+            )
+            imprimir_transformacoes(medir_transformacoes(csv, args.encoding))
+        return
+
+    if args.comando == 'consultas':
+        with tempfile.TemporaryDirectory() as diretorio:
+            caminho = args.banco or os.path.join(diretorio, 'consultas.db')
+            if os.path.exists(caminho):
+                engine = conectar_banco_local(caminho)
+            else:
+                inicio = time.perf_counter()
+                os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+                engine = montar_banco_consultas(caminho, args.linhas)
+                print(f"🗄️  Banco {caminho} montado em {time.perf_counter() - inicio:.1f}s")
+            imprimir_consultas(medir_consultas(engine, args.timeout, args.repeticoes), args.timeout)
+            engine.dispose()
+        return
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = {r['caminho']: r for r in json.load(f)['resultados']}
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        csv = args.csv or gerar_csv_sigesguarda(
+            os.path.join(diretorio, 'sigesguarda_sintetico.csv'), args.linhas, args.encoding
+        )
+        print(f"📄 Arquivo: {csv} ({os.path.getsize(csv) / 2 ** 20:.1f} MB)")
+
+        resultados = []
+        for nome in args.caminhos:
+            resultado = medir_caminho(nome, csv, diretorio, args.bulk)
+            imprimir_resultado(resultado, baseline.get(nome))
+            resultados.append(resultado)
+
+    if args.saida:
+        os.makedirs(os.path.dirname(args.saida) or '.', exist_ok=True)
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump({'linhas': args.linhas, 'encoding': args.encoding, 'bulk': args.bulk,
+                       'resultados': resultados}, f, indent=2)
+        print(f"\n💾 Resultado gravado em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
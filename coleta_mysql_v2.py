@@ -9,19 +9,54 @@
 # Este script:
 # 1. Busca os links dos CSVs de ocorrências criminais (2016-2025)
 # 2. Baixa e processa os dados diretamente da internet
-# 3. Carrega no banco MySQL local seguindo modelo dimensional
+# 3. Carrega no banco MySQL local (ou num arquivo SQLite, --banco sqlite) seguindo modelo dimensional
+# 4. Pode ser rodado de novo: só as linhas novas ou alteradas são gravadas (chave_fato)
 #######################################################################
 
+from collections import Counter, OrderedDict
 from datetime import datetime
+import numpy as np
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+from urllib.parse import unquote, urljoin, urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import argparse
+import codecs
+import cProfile
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import pstats
+import queue
+import re
 import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 # Bibliotecas para o ETL Relacional
-from sqlalchemy import create_engine, text
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import DBAPIError, IntegrityError
+
+# Tempo por etapa, contadores e relatório JSON lines das cargas
+from metricas_etl import ARQUIVO_RELATORIO, METRICAS, imprimir_etapas, servir_http
+
+# Bancos de destino (MySQL ou SQLite) e carga em massa (--bulk)
+from bancos_etl import ARQUIVO_SQLITE, BANCOS, BancoMySQL, BancoSQLite
+
+# Staging em Parquet (opcional: sem pyarrow o loader lê direto do CSV)
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 
 ############3################################################
 # CONFIGURAÇÕES GLOBAIS
@@ -46,6 +81,37 @@ CSV_COLUMNS = [
     'NATUREZA2_DESCRICAO', 'TIPO_ENVOLVIMENTO', 'ATENDIMENTO_NUMERO'
 ]
 
+# Tipos de leitura do CSV: as colunas repetem muito dentro de um chunk e viram categóricas (códigos de
+# 1-2 bytes), inclusive ano/mês/código, que são convertidos para inteiros pequenos por valor distinto em
+# converter_tipos (assim uma linha suja não derruba a leitura). O número do atendimento, quase único
+# por linha, fica como string do Arrow.
+TIPO_TEXTO = 'string[pyarrow]' if pa is not None else 'string'
+TIPOS_LEITURA_CSV = {
+    'OCORRENCIA_DATA': 'category',
+    'OCORRENCIA_ANO': 'category',
+    'OCORRENCIA_MES': 'category',
+    'OCORRENCIA_HORA': 'category',
+    'OCORRENCIA_DIA_SEMANA': 'category',
+    'OCORRENCIA_PERIODO': 'category',
+    'ATENDIMENTO_BAIRRO_NOME': 'category',
+    'ATENDIMENTO_REGIONAL_NOME': 'category',
+    'ATENDIMENTO_LOGRADOURO_NOME': 'category',
+    'CLASSIFICACAO_BAIRRO_REGIONAL': 'category',
+    'NATUREZA1_CODIGO': 'category',
+    'NATUREZA1_DESCRICAO': 'category',
+    'NATUREZA2_DESCRICAO': 'category',
+    'TIPO_ENVOLVIMENTO': 'category',
+    'ATENDIMENTO_NUMERO': TIPO_TEXTO,
+}
+
+# Inteiros compactos depois da conversão
+TIPOS_INTEIROS = {
+    'OCORRENCIA_ANO': 'Int16',
+    'OCORRENCIA_MES': 'Int8',
+    'NATUREZA1_CODIGO': 'Int32',
+    'ATENDIMENTO_NUMERO': 'Int64',
+}
+
 # Configuração do banco MySQL LOCAL
 DB_CONFIG = {
     'host': '127.0.0.1',
@@ -55,6 +121,50 @@ DB_CONFIG = {
     'database': 'crimes_curitiba'
 }
 
+# Limite de entradas da DIM_LOCAL mantidas em memória (alta cardinalidade por causa do logradouro)
+# As demais dimensões são pequenas e ficam inteiras no cache
+LIMITE_CACHE_LOCAL = 200000
+
+# Quantidade de linhas lidas, resolvidas e gravadas por vez (uma transação por chunk)
+TAMANHO_CHUNK = 50000
+
+# Modo de gravação da tabela fato:
+#   'insert'    -> INSERT com executemany por chunk
+#   'load_data' -> arquivo TSV temporário + LOAD DATA LOCAL INFILE (exige local_infile=1 no servidor)
+MODO_CARGA = 'insert'
+MODOS_CARGA = ('insert', 'load_data')
+
+# Quantos avisos do LOAD DATA mostrar por arquivo
+MAX_AVISOS_LOAD_DATA = 10
+
+# Cache local dos CSVs baixados (não versionado)
+DIRETORIO_DOWNLOADS = os.path.join('data', 'raw')
+TAMANHO_BLOCO_DOWNLOAD = 1024 * 1024
+
+# Bytes iniciais usados para detectar o encoding de arquivos locais
+TAMANHO_AMOSTRA_ENCODING = 1024 * 1024
+
+# Staging colunar (Parquet particionado por ano) gerado a partir dos CSVs baixados
+DIRETORIO_STAGING = os.path.join('data', 'processed', 'parquet')
+
+# Como as chaves de DIM_NATUREZA e DIM_LOCAL são geradas (DIM_TEMPO e DIM_HORA são pré-geradas,
+# com tempo_id = aaaammdd e hora_id = minuto do dia + 1, nos dois modos):
+# 'auto_increment' -> INSERT + lastrowid para cada chave nova (serializado entre os workers)
+# 'hash'           -> natureza_id/local_id = hash de 63 bits da chave natural normalizada,
+#                     calculado sem ida ao banco
+# Use sempre o mesmo modo num banco: os ids dos dois modos não se misturam
+MODO_CHAVES = 'auto_increment'
+MODOS_CHAVES = ('auto_increment', 'hash')
+
+# Quantas vezes um chunk é refeito quando o MySQL desfaz a transação por deadlock (erro 1213),
+# com uma espera crescente (em segundos) entre as tentativas
+TENTATIVAS_DEADLOCK = 3
+ESPERA_DEADLOCK = 0.5
+
+# Anos do calendário pré-gerado na DIM_TEMPO (datas fora da faixa geram o ano inteiro quando aparecem)
+ANO_INICIAL_CALENDARIO = 2016
+ANO_FINAL_CALENDARIO = datetime.now().year
+
 ###########################################################
 # FUNÇÕES DE COLETA (Web Scraping)
 ###########################################################
@@ -64,7 +174,7 @@ def get_csv_links_antigos():
     # Fazemos um set chamado links e adicionamos os links encontrados
     links = set()
     try:
-        response = requests.get(URL_PORTAL_ANTIGO, headers=HEADERS)
+        response = get_sessao().get(URL_PORTAL_ANTIGO, timeout=60)
         response.raise_for_status()
         soup = BeautifulSoup(response.text, 'html.parser')
        
@@ -115,829 +225,2886 @@ def get_csv_links_2025():
 '''
 
 # ============================================================
-# FUNÇÕES AUXILIARES PARA DIMENSÕES
+# CACHE LOCAL DE DOWNLOADS
 # ============================================================
 
-def classificar_periodo_dia(hora_str):
+_SESSAO = None
+
+# Quantas vezes o corpo de cada URL foi baixado neste processo (deve ser no máximo 1 por execução)
+CONTADOR_DOWNLOADS = Counter()
+
+
+def get_sessao():
+
+    """Sessão HTTP única por processo, com pool de conexões e retentativas"""
+
+    global _SESSAO
+    if _SESSAO is None:
+        _SESSAO = requests.Session()
+        _SESSAO.headers.update(HEADERS)
+        adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                                max_retries=Retry(total=3, backoff_factor=1, status_forcelist=(502, 503, 504)))
+        _SESSAO.mount('http://', adaptador)
+        _SESSAO.mount('https://', adaptador)
+    return _SESSAO
+
+
+def _caminho_metadados(caminho):
+    return caminho + '.meta.json'
 
-    """Classifica o período do dia baseado na hora"""
 
+def ler_metadados(caminho):
     try:
+        with open(_caminho_metadados(caminho), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
 
-        hora = int(hora_str.split(':')[0]) if ':' in str(hora_str) else int(hora_str)
 
-        if 0 <= hora < 6:
+def salvar_metadados(caminho, metadados):
+    with open(_caminho_metadados(caminho), 'w', encoding='utf-8') as f:
+        json.dump(metadados, f, indent=2)
 
-            return 'MADRUGADA'
 
-        elif 6 <= hora < 12:
+def sha256_arquivo(caminho):
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(TAMANHO_BLOCO_DOWNLOAD), b''):
+            h.update(bloco)
+    return h.hexdigest()
 
-            return 'MANHÃ'
 
-        elif 12 <= hora < 18:
+class DetectorEncoding:
 
-            return 'TARDE'
+    """
+    Decide entre utf-8 e latin1 olhando os bytes na ordem em que chegam.
+    A decisão sai dos primeiros bytes; se depois aparecer um byte que não é utf-8 válido,
+    o arquivo passa a ser latin1 (que aceita qualquer byte). Nada é lido duas vezes.
+    """
 
-        else:
+    def __init__(self):
+        self.encoding = None
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def alimentar(self, bloco):
+        if self.encoding is None:
+            self.encoding = 'utf-8-sig' if bloco.startswith(codecs.BOM_UTF8) else 'utf-8'
+        if self.encoding == 'latin1':
+            return
+        try:
+            self._decoder.decode(bloco, final=False)
+        except UnicodeDecodeError:
+            self.encoding = 'latin1'
 
-            return 'NOITE'
+    def resultado(self):
+        if self.encoding not in (None, 'latin1'):
+            try:
+                self._decoder.decode(b'', final=True)
+            except UnicodeDecodeError:
+                self.encoding = 'latin1'
+        return self.encoding or 'utf-8'
 
-    except:
 
-        return 'NÃO INFORMADO'
+def detectar_encoding(caminho, tamanho_amostra=TAMANHO_AMOSTRA_ENCODING):
 
+    """Detecta o encoding de um arquivo local a partir dos primeiros bytes"""
 
-def extrair_categoria_crime(descricao):
+    with open(caminho, 'rb') as f:
+        amostra = f.read(tamanho_amostra)
+    detector = DetectorEncoding()
+    # A amostra pode terminar no meio de um caractere multibyte: não chamamos resultado() com final=True
+    detector.alimentar(amostra)
+    return detector.encoding or 'utf-8'
 
-    """Extrai categoria principal do crime"""
 
-    if not descricao or descricao == 'NAN':
+def caminho_download(origem, diretorio=DIRETORIO_DOWNLOADS):
 
-        return 'NÃO INFORMADO'
+    """Onde a cópia local de uma URL fica no cache de downloads"""
+
+    return os.path.join(diretorio, unquote(urlparse(origem).path.split('/')[-1]))
 
-   
 
-    descricao_upper = str(descricao).upper()
+@METRICAS.medir('download')
+def baixar_csv(origem, diretorio=DIRETORIO_DOWNLOADS, offline=False):
 
-   
+    """
+    Garante uma cópia local do CSV, baixando o conteúdo no máximo uma vez.
+    Usa GET condicional (ETag / Last-Modified) e guarda o SHA-256 e o encoding de cada arquivo
+    em um .meta.json; hash e encoding são calculados nos mesmos blocos gravados em disco.
+    O hash é comparado com o CARGA_MANIFESTO para decidir se o arquivo precisa ser carregado.
+    Caminhos locais são usados direto, sem cache.
+    Com offline=True usa a cópia do cache sem ir à rede (FileNotFoundError se ela não existe).
+    Retorna {'caminho', 'sha256', 'encoding', 'baixado'}.
+    """
 
-    if 'FURTO' in descricao_upper:
+    if os.path.exists(origem):
+        return {'caminho': origem, 'sha256': sha256_arquivo(origem), 'encoding': detectar_encoding(origem),
+                'baixado': False}
+
+    os.makedirs(diretorio, exist_ok=True)
+    caminho = caminho_download(origem, diretorio)
+    metadados = ler_metadados(caminho) if os.path.exists(caminho) else {}
+
+    if offline:
+        if not metadados.get('sha256'):
+            raise FileNotFoundError(f"{caminho} ainda não foi baixado (rode antes com --etapa baixar)")
+        return {'caminho': caminho, 'sha256': metadados['sha256'],
+                'encoding': metadados.get('encoding') or detectar_encoding(caminho), 'baixado': False}
+
+    cabecalhos = {}
+    if metadados.get('etag'):
+        cabecalhos['If-None-Match'] = metadados['etag']
+    if metadados.get('last_modified'):
+        cabecalhos['If-Modified-Since'] = metadados['last_modified']
+
+    with get_sessao().get(origem, headers=cabecalhos, stream=True, timeout=60) as response:
+        if response.status_code == 304:
+            baixado = False
+        else:
+            response.raise_for_status()
+            CONTADOR_DOWNLOADS[origem] += 1
+            h = hashlib.sha256()
+            detector = DetectorEncoding()
+            temporario = caminho + '.part'
+            with open(temporario, 'wb') as f:
+                for bloco in response.iter_content(TAMANHO_BLOCO_DOWNLOAD):
+                    h.update(bloco)
+                    detector.alimentar(bloco)
+                    f.write(bloco)
+                    METRICAS.contar('bytes_baixados', len(bloco))
+            os.replace(temporario, caminho)
+            baixado = True
+            metadados.update(
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+                sha256=h.hexdigest(),
+                encoding=detector.resultado(),
+            )
+            salvar_metadados(caminho, metadados)
 
-        return 'FURTO'
+    # Metadados gravados antes da detecção de encoding existir
+    if not metadados.get('encoding'):
+        metadados['encoding'] = detectar_encoding(caminho)
+        salvar_metadados(caminho, metadados)
 
-    elif 'ROUBO' in descricao_upper:
+    return {'caminho': caminho, 'sha256': metadados['sha256'], 'encoding': metadados['encoding'],
+            'baixado': baixado}
 
-        return 'ROUBO'
 
-    elif 'LESÃO' in descricao_upper or 'LESAO' in descricao_upper:
+# ============================================================
+# MANIFESTO DE CARGA (retomada após falha)
+# ============================================================
 
-        return 'LESÃO CORPORAL'
+# Uma linha por arquivo (URL): o sha256 do conteúdo carregado e o status (EM_ANDAMENTO / COMPLETO).
+# Um arquivo EM_ANDAMENTO é retomado relendo desde a primeira linha: as linhas já confirmadas são
+# puladas pelo filtro de chave_fato, sem ir ao banco. linhas_lidas e ultimo_chunk são só informativos
+# (até onde a carga interrompida chegou) e não definem o ponto de partida.
 
-    elif 'DROGA' in descricao_upper or 'ENTORPECENTE' in descricao_upper:
+SQL_CRIAR_MANIFESTO = """
+    CREATE TABLE IF NOT EXISTS CARGA_MANIFESTO (
+        url VARCHAR(500) NOT NULL PRIMARY KEY,
+        sha256 CHAR(64) NOT NULL,
+        linhas_lidas BIGINT NOT NULL DEFAULT 0,
+        linhas_inseridas BIGINT NOT NULL DEFAULT 0,
+        linhas_erro BIGINT NOT NULL DEFAULT 0,
+        ultimo_chunk INT NOT NULL DEFAULT 0,
+        status VARCHAR(20) NOT NULL,
+        atualizado_em DATETIME
+    )
+"""
 
-        return 'DROGAS'
 
-    elif 'TRÂNSITO' in descricao_upper or 'TRANSITO' in descricao_upper:
+# Versão dos dados: uma linha só, incrementada em cada commit que grava linhas na tabela fato.
+# O cache de resultados do consultas_crimes.py usa a versão na chave
+SQL_CRIAR_VERSAO = """
+    CREATE TABLE IF NOT EXISTS CARGA_VERSAO (
+        id INT NOT NULL PRIMARY KEY,
+        versao BIGINT NOT NULL,
+        atualizado_em DATETIME
+    )
+"""
 
-        return 'TRÂNSITO'
 
-    elif 'AMEAÇA' in descricao_upper:
+def garantir_tabela_manifesto(engine):
+    with engine.begin() as connection:
+        connection.execute(text(SQL_CRIAR_MANIFESTO))
+        connection.execute(text(SQL_CRIAR_VERSAO))
 
-        return 'AMEAÇA'
 
-    elif 'DANO' in descricao_upper:
+def incrementar_versao_dados(connection):
 
-        return 'DANO AO PATRIMÔNIO'
+    """Incrementa a versão dos dados. Deve rodar na mesma transação que altera a tabela fato."""
 
-    elif 'HOMICÍDIO' in descricao_upper or 'HOMICIDIO' in descricao_upper:
+    agora = datetime.now().replace(microsecond=0)
+    result = connection.execute(text(
+        "UPDATE CARGA_VERSAO SET versao = versao + 1, atualizado_em = :agora WHERE id = 1"
+    ), {'agora': agora})
+    if result.rowcount == 0:
+        connection.execute(text("INSERT INTO CARGA_VERSAO (id, versao, atualizado_em) VALUES (1, 1, :agora)"),
+                           {'agora': agora})
 
-        return 'HOMICÍDIO'
 
-    else:
+def ler_versao_dados(connection):
 
-        return 'OUTROS'
+    """Versão atual dos dados (0 antes da primeira carga)"""
 
+    return connection.execute(text("SELECT versao FROM CARGA_VERSAO WHERE id = 1")).scalar() or 0
 
-def get_nome_mes(mes_num):
 
-    """Retorna nome do mês"""
+def ler_manifesto(connection, url):
 
-    meses = ['', 'JANEIRO', 'FEVEREIRO', 'MARÇO', 'ABRIL', 'MAIO', 'JUNHO',
+    """Retorna a linha do manifesto do arquivo (como dicionário) ou None"""
 
-             'JULHO', 'AGOSTO', 'SETEMBRO', 'OUTUBRO', 'NOVEMBRO', 'DEZEMBRO']
+    linha = connection.execute(text("""
+        SELECT url, sha256, linhas_lidas, linhas_inseridas, linhas_erro, ultimo_chunk, status
+        FROM CARGA_MANIFESTO WHERE url = :url
+    """), {'url': url}).mappings().fetchone()
+    return dict(linha) if linha else None
 
-    try:
 
-        return meses[int(mes_num)]
+def gravar_manifesto(connection, url, sha256, linhas_lidas, linhas_inseridas, linhas_erro, ultimo_chunk, status):
 
-    except:
+    """Atualiza (ou cria) a linha do manifesto. Deve rodar na mesma transação do chunk."""
 
-        return 'NÃO INFORMADO'
+    dados = {
+        'url': url, 'sha256': sha256, 'linhas_lidas': linhas_lidas, 'linhas_inseridas': linhas_inseridas,
+        'linhas_erro': linhas_erro, 'ultimo_chunk': ultimo_chunk, 'status': status,
+        'atualizado_em': datetime.now().replace(microsecond=0),
+    }
+    result = connection.execute(text("""
+        UPDATE CARGA_MANIFESTO
+        SET sha256 = :sha256, linhas_lidas = :linhas_lidas, linhas_inseridas = :linhas_inseridas,
+            linhas_erro = :linhas_erro, ultimo_chunk = :ultimo_chunk, status = :status,
+            atualizado_em = :atualizado_em
+        WHERE url = :url
+    """), dados)
+    if result.rowcount == 0:
+        connection.execute(text("""
+            INSERT INTO CARGA_MANIFESTO
+            (url, sha256, linhas_lidas, linhas_inseridas, linhas_erro, ultimo_chunk, status, atualizado_em)
+            VALUES (:url, :sha256, :linhas_lidas, :linhas_inseridas, :linhas_erro, :ultimo_chunk, :status,
+                    :atualizado_em)
+        """), dados)
 
 
 # ============================================================
-# FUNÇÕES DE INSERÇÃO NO BANCO
+# STAGING EM PARQUET (particionado por OCORRENCIA_ANO)
 # ============================================================
 
-def get_or_create_tempo(connection, data_completa, ano, mes, dia_semana, periodo):
+# Colunas de texto com poucos valores distintos ficam dicionarizadas no Parquet
+COLUNAS_DICIONARIO = [
+    'OCORRENCIA_HORA', 'OCORRENCIA_DIA_SEMANA', 'OCORRENCIA_PERIODO', 'ATENDIMENTO_BAIRRO_NOME',
+    'ATENDIMENTO_REGIONAL_NOME', 'CLASSIFICACAO_BAIRRO_REGIONAL', 'NATUREZA1_DESCRICAO',
+    'NATUREZA2_DESCRICAO', 'TIPO_ENVOLVIMENTO'
+]
+
+if pa is not None:
+    # OCORRENCIA_ANO não entra no arquivo: fica no nome da partição (OCORRENCIA_ANO=2019/)
+    SCHEMA_STAGING = pa.schema(
+        [('OCORRENCIA_DATA', pa.date32()), ('OCORRENCIA_MES', pa.int8())]
+        + [(col, pa.dictionary(pa.int32(), pa.string())) for col in COLUNAS_DICIONARIO]
+        + [('ATENDIMENTO_LOGRADOURO_NOME', pa.string()), ('NATUREZA1_CODIGO', pa.int32()),
+           ('ATENDIMENTO_NUMERO', pa.int64())]
+    )
+    PARTICAO_STAGING = ds.partitioning(pa.schema([('OCORRENCIA_ANO', pa.int16())]), flavor='hive')
+
+    # Inteiros do Parquet voltam como inteiros anuláveis do pandas (e não float)
+    TIPOS_PANDAS_STAGING = {
+        pa.int8(): pd.Int8Dtype(), pa.int16(): pd.Int16Dtype(),
+        pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype(),
+    }.get
 
-    """Busca ou cria registro na DIM_TEMPO"""
 
+def staging_disponivel():
+    return pa is not None
+
+
+def _caminho_controle_staging(nome_arquivo, diretorio=DIRETORIO_STAGING):
+    return os.path.join(diretorio, '_fontes', nome_arquivo + '.json')
+
+
+def arquivos_staging(nome_arquivo, diretorio=DIRETORIO_STAGING):
+
+    """Arquivos Parquet de uma fonte, em ordem de partição (ano)"""
+
+    return sorted(glob.glob(os.path.join(diretorio, 'OCORRENCIA_ANO=*', nome_arquivo + '.parquet')))
+
+
+def tipar_chunk_staging(chunk):
+
+    """Converte um chunk lido do CSV para os tipos do staging (datas, inteiros pequenos, textos)"""
+
+    df = pd.DataFrame(index=chunk.index)
+    for col in CSV_COLUMNS:
+        df[col] = chunk[col] if col in chunk.columns else None
+
+    df['OCORRENCIA_DATA'] = pd.to_datetime(df['OCORRENCIA_DATA'], format='%d/%m/%Y', errors='coerce')
+    df['OCORRENCIA_ANO'] = pd.to_numeric(df['OCORRENCIA_ANO'], errors='coerce').astype('Int16')
+    df['OCORRENCIA_MES'] = pd.to_numeric(df['OCORRENCIA_MES'], errors='coerce').astype('Int8')
+    df['NATUREZA1_CODIGO'] = pd.to_numeric(df['NATUREZA1_CODIGO'], errors='coerce').astype('Int32')
+    df['ATENDIMENTO_NUMERO'] = pd.to_numeric(df['ATENDIMENTO_NUMERO'], errors='coerce').astype('Int64')
+    for col in COLUNAS_DICIONARIO + ['ATENDIMENTO_LOGRADOURO_NOME']:
+        df[col] = df[col].astype(object).where(df[col].notna(), None).map(lambda v: v if v is None else str(v))
+    return df
+
+
+@METRICAS.medir('staging')
+def converter_para_staging(caminho_csv, sha256, encoding=None, diretorio=DIRETORIO_STAGING,
+                           tamanho_chunk=TAMANHO_CHUNK):
+
+    """
+    Converte o CSV (uma única vez por conteúdo) em Parquet zstd particionado por OCORRENCIA_ANO,
+    só com as colunas de CSV_COLUMNS. Se o staging já corresponde ao mesmo sha256, não faz nada.
+    Retorna a quantidade de linhas no staging.
+    """
+
+    nome_arquivo = os.path.basename(caminho_csv)
+    controle = _caminho_controle_staging(nome_arquivo, diretorio)
+    try:
+        with open(controle, encoding='utf-8') as f:
+            info = json.load(f)
+        if info.get('sha256') == sha256 and arquivos_staging(nome_arquivo, diretorio):
+            return info['linhas']
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    print(f"   🗂️  Convertendo {nome_arquivo} para Parquet...")
+    for antigo in arquivos_staging(nome_arquivo, diretorio):
+        os.remove(antigo)
+
+    escritores = {}
+    linhas = 0
     try:
+        for chunk in ler_chunks_csv(caminho_csv, tamanho_chunk, encoding=encoding):
+            df = tipar_chunk_staging(chunk)
+            linhas += len(df)
+            for ano, grupo in df.groupby('OCORRENCIA_ANO', dropna=False, sort=False):
+                particao = '__HIVE_DEFAULT_PARTITION__' if pd.isna(ano) else str(int(ano))
+                if particao not in escritores:
+                    pasta = os.path.join(diretorio, f'OCORRENCIA_ANO={particao}')
+                    os.makedirs(pasta, exist_ok=True)
+                    escritores[particao] = pq.ParquetWriter(
+                        os.path.join(pasta, nome_arquivo + '.parquet'), SCHEMA_STAGING, compression='zstd'
+                    )
+                tabela = pa.Table.from_pandas(
+                    grupo.drop(columns='OCORRENCIA_ANO'), preserve_index=False
+                ).select(SCHEMA_STAGING.names).cast(SCHEMA_STAGING)
+                escritores[particao].write_table(tabela)
+    finally:
+        for escritor in escritores.values():
+            escritor.close()
+
+    os.makedirs(os.path.dirname(controle), exist_ok=True)
+    with open(controle, 'w', encoding='utf-8') as f:
+        json.dump({'sha256': sha256, 'linhas': linhas, 'anos': sorted(escritores)}, f, indent=2)
+    print(f"   🗂️  {linhas} linhas gravadas em {len(escritores)} partições")
+    return linhas
+
+
+def _particao_para_coluna(tabela, caminho):
+
+    """Recoloca OCORRENCIA_ANO (que está no nome da pasta) como coluna"""
+
+    valor = os.path.basename(os.path.dirname(caminho)).split('=', 1)[1]
+    ano = None if valor == '__HIVE_DEFAULT_PARTITION__' else int(valor)
+    return tabela.append_column('OCORRENCIA_ANO', pa.array([ano] * tabela.num_rows, pa.int16()))
+
+
+def ler_chunks_staging(nome_arquivo, tamanho_chunk=TAMANHO_CHUNK, diretorio=DIRETORIO_STAGING):
 
-        # Buscar ID existente
+    """
+    Gerador equivalente ao ler_chunks_csv, mas lendo o staging Parquet de uma fonte.
+    A ordem das linhas é determinística (partições em ordem de ano), então a ordem das linhas
+    repetidas na chave_fato é a mesma a cada carga.
+    """
 
-        sql_select = text("""
+    caminhos = arquivos_staging(nome_arquivo, diretorio)
+    if not caminhos:
+        raise FileNotFoundError(f"Staging de {nome_arquivo} não encontrado em {diretorio}")
+
+    pendentes = []
+    linhas_pendentes = 0
+    for caminho in caminhos:
+        arquivo = pq.ParquetFile(caminho)
+        for lote in arquivo.iter_batches(batch_size=tamanho_chunk):
+            pendentes.append(_particao_para_coluna(pa.Table.from_batches([lote]), caminho))
+            linhas_pendentes += lote.num_rows
+            while linhas_pendentes >= tamanho_chunk:
+                tabela = pa.concat_tables(pendentes)
+                yield tabela.slice(0, tamanho_chunk).to_pandas(date_as_object=False, types_mapper=TIPOS_PANDAS_STAGING)
+                resto = tabela.slice(tamanho_chunk)
+                pendentes = [resto] if resto.num_rows else []
+                linhas_pendentes = resto.num_rows
+    if linhas_pendentes:
+        yield pa.concat_tables(pendentes).to_pandas(date_as_object=False, types_mapper=TIPOS_PANDAS_STAGING)
+
+
+def ler_staging(anos=None, colunas=None, filtro=None, diretorio=DIRETORIO_STAGING):
 
-            SELECT tempo_id FROM DIM_TEMPO
+    """
+    Lê o staging inteiro (todas as fontes) para análise, com projeção de colunas e filtro.
+    Ex.: ler_staging(anos=[2019], colunas=['OCORRENCIA_DATA', 'ATENDIMENTO_BAIRRO_NOME'])
+    Só as partições dos anos pedidos são abertas.
+    """
 
-            WHERE data_completa = :data_completa
+    dataset = ds.dataset(diretorio, format='parquet', partitioning=PARTICAO_STAGING,
+                         exclude_invalid_files=True, ignore_prefixes=['_', '.'])
+    expressao = filtro
+    if anos is not None:
+        filtro_anos = ds.field('OCORRENCIA_ANO').isin(list(anos))
+        expressao = filtro_anos if expressao is None else expressao & filtro_anos
+    tabela = dataset.to_table(columns=colunas, filter=expressao)
+    return tabela.to_pandas(date_as_object=False, types_mapper=TIPOS_PANDAS_STAGING)
 
-        """)
 
-        result = connection.execute(sql_select, {'data_completa': data_completa}).fetchone()
+# ============================================================
+# FUNÇÕES AUXILIARES PARA DIMENSÕES
+# ============================================================
 
-       
+# Categorias em ordem de prioridade: uma descrição com mais de uma palavra-chave
+# fica com a primeira categoria da lista (ex.: 'ROUBO E FURTO' -> FURTO)
+CATEGORIAS_CRIME = [
+    ('FURTO', 'FURTO'),
+    ('ROUBO', 'ROUBO'),
+    ('LESÃO CORPORAL', 'LES[ÃA]O'),
+    ('DROGAS', 'DROGA|ENTORPECENTE'),
+    ('TRÂNSITO', 'TR[ÂA]NSITO'),
+    ('AMEAÇA', 'AMEAÇA'),
+    ('DANO AO PATRIMÔNIO', 'DANO'),
+    ('HOMICÍDIO', 'HOMIC[ÍI]DIO'),
+]
+# Um grupo por categoria: o número do grupo que casou indica a categoria
+PADRAO_CATEGORIA_CRIME = re.compile('|'.join(f'({padrao})' for _, padrao in CATEGORIAS_CRIME))
 
-        if result:
+NOMES_MESES = ['', 'JANEIRO', 'FEVEREIRO', 'MARÇO', 'ABRIL', 'MAIO', 'JUNHO',
+               'JULHO', 'AGOSTO', 'SETEMBRO', 'OUTUBRO', 'NOVEMBRO', 'DEZEMBRO']
 
-            return result[0]
 
-       
+def por_distinto(serie, funcao):
 
-        # Inserir novo
+    """
+    Aplica `funcao` (que recebe e devolve uma Series) só aos valores distintos de `serie`
+    e espalha o resultado para todas as linhas com factorize. Nulos recebem funcao([None]).
+    """
 
-        data_obj = datetime.strptime(data_completa, '%Y-%m-%d')
+    codigos, distintos = pd.factorize(serie)
+    resultado = funcao(pd.Series(distintos, dtype=object)).to_numpy(dtype=object)
+    valor_nulo = funcao(pd.Series([None], dtype=object)).iloc[0]
+    # Código -1 (nulo) aponta para o último elemento
+    return pd.Series(np.append(resultado, valor_nulo)[codigos], index=serie.index)
 
-       
 
-        sql_insert = text("""
+def _categoria_crime(descricao):
+    if descricao in ('', 'NAN'):
+        return 'NÃO INFORMADO'
+    grupos = [m.lastindex for m in PADRAO_CATEGORIA_CRIME.finditer(descricao)]
+    return CATEGORIAS_CRIME[min(grupos) - 1][0] if grupos else 'OUTROS'
 
-            INSERT INTO DIM_TEMPO
 
-            (data_completa, ocorrencia_ano, ocorrencia_mes, ocorrencia_dia,
+def categorizar_crimes(descricoes):
 
-             ocorrencia_dia_semana, ocorrencia_periodo, nome_mes, trimestre, semestre)
+    """
+    Categoria principal de cada descrição. A regex roda uma vez por descrição distinta;
+    vazio/NaN vira 'NÃO INFORMADO'.
+    """
 
-            VALUES
+    return por_distinto(descricoes, lambda distintos: pd.Series(
+        ['NÃO INFORMADO' if pd.isna(d) else _categoria_crime(str(d).upper()) for d in distintos], dtype=object
+    ))
 
-            (:data_completa, :ano, :mes, :dia, :dia_semana, :periodo,
 
-             :nome_mes, :trimestre, :semestre)
+def classificar_periodos(horas):
 
-        """)
+    """Período do dia (MADRUGADA/MANHÃ/TARDE/NOITE) de cada horário; inválidos viram 'NÃO INFORMADO'"""
 
-       
+    def classificar(distintos):
+        hora = (minutos_do_dia(distintos) // 60).astype('float64').to_numpy()
+        return pd.Series(np.select([hora < 6, hora < 12, hora < 18, hora < 24],
+                                   ['MADRUGADA', 'MANHÃ', 'TARDE', 'NOITE'], 'NÃO INFORMADO'))
 
-        trimestre = (int(mes) - 1) // 3 + 1
+    return por_distinto(horas, classificar)
 
-        semestre = 1 if int(mes) <= 6 else 2
 
-       
+def nomes_meses(meses):
 
-        result = connection.execute(sql_insert, {
+    """Nome de cada mês (1-12); fora da faixa vira 'NÃO INFORMADO'"""
 
-            'data_completa': data_completa,
+    def nomear(distintos):
+        mes = pd.to_numeric(distintos, errors='coerce')
+        validos = mes.between(1, 12)
+        nomes = np.array(NOMES_MESES, dtype=object)[mes.where(validos, 0).astype(int)]
+        return pd.Series(np.where(validos, nomes, 'NÃO INFORMADO'))
 
-            'ano': ano,
+    return por_distinto(pd.Series(meses), nomear)
 
-            'mes': mes,
 
-            'dia': data_obj.day,
+# ============================================================
+# FUNÇÕES DE INSERÇÃO NO BANCO
+# ============================================================
 
-            'dia_semana': dia_semana,
+def _igual_ou_nulo(connection):
 
-            'periodo': periodo,
+    """
+    Igualdade que também casa NULL com NULL e continua usando os índices de busca das dimensões
+    (COALESCE(coluna, '') = ... obrigava a ler o índice inteiro): <=> no MySQL, IS no SQLite
+    """
 
-            'nome_mes': get_nome_mes(mes),
+    return '<=>' if connection.dialect.name == 'mysql' else 'IS'
 
-            'trimestre': trimestre,
 
-            'semestre': semestre
+def inserir_natureza(connection, nat1_codigo, nat1_desc, nat2_desc, tipo_envolvimento, categoria):
 
-        })
+    """Cria um registro na DIM_NATUREZA (a categoria vem calculada do chunk por categorizar_crimes)"""
 
-       
+    result = connection.execute(text("""
+        INSERT INTO DIM_NATUREZA
+        (natureza1_codigo, natureza1_descricao, natureza2_descricao, tipo_envolvimento, categoria_crime)
+        VALUES (:codigo, :nat1, :nat2, :tipo_env, :categoria)
+    """), {
+        'codigo': nat1_codigo,
+        'nat1': nat1_desc,
+        'nat2': nat2_desc,
+        'tipo_env': tipo_envolvimento,
+        'categoria': categoria
+    })
+    return result.lastrowid
 
-        return result.lastrowid
 
-       
+def get_or_create_natureza(connection, nat1_codigo, nat1_desc, nat2_desc, tipo_envolvimento, categoria):
 
-    except IntegrityError:
+    """Busca ou cria registro na DIM_NATUREZA"""
 
-        # Caso de concorrência, busca novamente
+    igual = _igual_ou_nulo(connection)
+    sql_select = text(f"""
+        SELECT natureza_id FROM DIM_NATUREZA
+        WHERE natureza1_descricao {igual} :nat1_desc
+        AND natureza2_descricao {igual} :nat2_desc
+        AND tipo_envolvimento {igual} :tipo_env
+    """)
+    parametros = {'nat1_desc': nat1_desc, 'nat2_desc': nat2_desc, 'tipo_env': tipo_envolvimento}
 
-        result = connection.execute(sql_select, {'data_completa': data_completa}).fetchone()
+    result = connection.execute(sql_select, parametros).fetchone()
+    if result:
+        return result[0]
 
+    try:
+        return inserir_natureza(connection, nat1_codigo, nat1_desc, nat2_desc, tipo_envolvimento, categoria)
+    except IntegrityError:
+        result = connection.execute(sql_select, parametros).fetchone()
         return result[0] if result else None
 
 
-def get_or_create_natureza(connection, nat1_codigo, nat1_desc, nat2_desc, tipo_envolvimento):
+def inserir_local(connection, bairro, regional, logradouro, classificacao):
 
-    """Busca ou cria registro na DIM_NATUREZA"""
+    """Cria um registro na DIM_LOCAL"""
+
+    result = connection.execute(text("""
+        INSERT INTO DIM_LOCAL
+        (bairro_nome, regional_nome, logradouro_nome, classificacao_bairro_regional)
+        VALUES (:bairro, :regional, :logradouro, :classificacao)
+    """), {
+        'bairro': bairro,
+        'regional': regional,
+        'logradouro': logradouro,
+        'classificacao': classificacao
+    })
+    return result.lastrowid
+
+
+def get_or_create_local(connection, bairro, regional, logradouro, classificacao):
+
+    """Busca ou cria registro na DIM_LOCAL"""
+
+    igual = _igual_ou_nulo(connection)
+    sql_select = text(f"""
+        SELECT local_id FROM DIM_LOCAL
+        WHERE bairro_nome {igual} :bairro
+        AND regional_nome {igual} :regional
+        AND logradouro_nome {igual} :logradouro
+    """)
+    parametros = {'bairro': bairro, 'regional': regional, 'logradouro': logradouro}
+
+    result = connection.execute(sql_select, parametros).fetchone()
+    if result:
+        return result[0]
 
     try:
+        return inserir_local(connection, bairro, regional, logradouro, classificacao)
+    except IntegrityError:
+        result = connection.execute(sql_select, parametros).fetchone()
+        return result[0] if result else None
 
-        sql_select = text("""
 
-            SELECT natureza_id FROM DIM_NATUREZA
+# ============================================================
+# DIMENSÕES PRÉ-GERADAS (DIM_TEMPO E DIM_HORA)
+# ============================================================
 
-            WHERE COALESCE(natureza1_descricao, '') = COALESCE(:nat1_desc, '')
+# Calendário e relógio são conhecidos de antemão: são gerados inteiros numa etapa de setup
+# com ids determinísticos (tempo_id = aaaammdd, hora_id = minuto do dia + 1), então a carga
+# só faz consultas em memória para essas duas dimensões
 
-            AND COALESCE(natureza2_descricao, '') = COALESCE(:nat2_desc, '')
+DIAS_SEMANA = ['SEGUNDA-FEIRA', 'TERÇA-FEIRA', 'QUARTA-FEIRA', 'QUINTA-FEIRA', 'SEXTA-FEIRA', 'SÁBADO', 'DOMINGO']
 
-            AND COALESCE(tipo_envolvimento, '') = COALESCE(:tipo_env, '')
 
-        """)
+def gerar_dim_tempo(ano_inicial, ano_final):
 
-       
+    """Gera todas as datas de ano_inicial a ano_final (inclusive) no formato da DIM_TEMPO"""
 
-        result = connection.execute(sql_select, {
+    datas = pd.date_range(f'{ano_inicial}-01-01', f'{ano_final}-12-31', freq='D')
+    mes = datas.month.to_numpy()
+    return pd.DataFrame({
+        'tempo_id': datas.year * 10000 + mes * 100 + datas.day,
+        'data_completa': datas.strftime('%Y-%m-%d'),
+        'ocorrencia_ano': datas.year,
+        'ocorrencia_mes': mes,
+        'ocorrencia_dia': datas.day,
+        'ocorrencia_dia_semana': np.array(DIAS_SEMANA)[datas.dayofweek],
+        # O período depende do horário da ocorrência, não da data: fica na DIM_HORA (periodo_dia)
+        'ocorrencia_periodo': None,
+        'nome_mes': nomes_meses(mes).to_numpy(),
+        'trimestre': (mes - 1) // 3 + 1,
+        'semestre': np.where(mes <= 6, 1, 2),
+    })
 
-            'nat1_desc': nat1_desc,
 
-            'nat2_desc': nat2_desc,
+def gerar_dim_hora():
 
-            'tipo_env': tipo_envolvimento
+    """Gera os 1.440 minutos do dia no formato da DIM_HORA ('HH:MM')"""
 
-        }).fetchone()
+    minutos = np.arange(24 * 60)
+    hora_completa = pd.Series([f"{h:02d}:{m:02d}" for h, m in zip(minutos // 60, minutos % 60)])
+    return pd.DataFrame({
+        'hora_id': minutos + 1,
+        'hora_completa': hora_completa,
+        'hora': minutos // 60,
+        'minuto': minutos % 60,
+        'periodo_dia': classificar_periodos(hora_completa),
+    })
 
-       
 
-        if result:
+def minutos_do_dia(horas):
 
-            return result[0]
+    """Converte 'HH:MM', 'HH:MM:SS' ou 'HH' em minuto do dia (0-1439); inválidos viram NA"""
 
-       
+    partes = horas.astype('string').str.extract(r'^\s*(\d{1,2})(?::(\d{1,2}))?')
+    hora = pd.to_numeric(partes[0], errors='coerce')
+    minuto = pd.to_numeric(partes[1], errors='coerce').fillna(0)
+    validos = hora.between(0, 23) & minuto.between(0, 59)
+    return (hora * 60 + minuto).where(validos).astype('Int64')
 
-        # Inserir novo
 
-        categoria = extrair_categoria_crime(nat1_desc)
+def normalizar_horas(horas):
 
-       
+    """Normaliza os horários para 'HH:MM' (chave da DIM_HORA); inválidos viram NA"""
 
-        sql_insert = text("""
+    minutos = minutos_do_dia(horas)
+    return ((minutos // 60).astype('string').str.zfill(2) + ':'
+            + (minutos % 60).astype('string').str.zfill(2))
 
-            INSERT INTO DIM_NATUREZA
 
-            (natureza1_codigo, natureza1_descricao, natureza2_descricao,
+def _gravar_dimensao_fixa(connection, tabela, df):
+    registros = df.astype(object).where(df.notna(), None).to_dict('records')
+    connection.execute(_sql_inserir_ignorando(connection, tabela, list(df.columns)), registros)
 
-             tipo_envolvimento, categoria_crime)
 
-            VALUES (:codigo, :nat1, :nat2, :tipo_env, :categoria)
+def preparar_dimensoes_fixas(engine, ano_inicial=ANO_INICIAL_CALENDARIO, ano_final=ANO_FINAL_CALENDARIO):
 
-        """)
+    """
+    Etapa de setup: grava o calendário completo na DIM_TEMPO e os 1.440 minutos na DIM_HORA.
+    Pode ser executada a cada carga: linhas já existentes são ignoradas.
+    """
 
-       
+    with engine.begin() as connection:
+        _gravar_dimensao_fixa(connection, 'DIM_TEMPO', gerar_dim_tempo(ano_inicial, ano_final))
+        _gravar_dimensao_fixa(connection, 'DIM_HORA', gerar_dim_hora())
 
-        result = connection.execute(sql_insert, {
 
-            'codigo': nat1_codigo,
+# ============================================================
+# CHAVES DETERMINÍSTICAS (--chaves hash)
+# ============================================================
 
-            'nat1': nat1_desc,
+class ColisaoChaveHash(Exception):
 
-            'nat2': nat2_desc,
+    """Duas chaves naturais diferentes geraram o mesmo id no modo 'hash'"""
 
-            'tipo_env': tipo_envolvimento,
 
-            'categoria': categoria
+def chave_hash(*partes):
 
-        })
+    """Hash estável de 63 bits (positivo, cabe num BIGINT) da chave natural normalizada"""
 
-       
+    texto = '\x1f'.join(_chave_texto(parte) for parte in partes)
+    valor = int.from_bytes(hashlib.blake2b(texto.encode('utf-8'), digest_size=8).digest(), 'big') >> 1
+    return valor or 1
 
-        return result.lastrowid
 
-       
+def _marcador_driver(connection):
 
-    except IntegrityError:
+    """Marcador de parâmetro posicional do driver, para o exec_driver_sql ('?' no SQLite, '%s' no PyMySQL)"""
 
-        result = connection.execute(sql_select, {
+    return '?' if connection.dialect.paramstyle == 'qmark' else '%s'
 
-            'nat1_desc': nat1_desc,
 
-            'nat2_desc': nat2_desc,
+def _sql_inserir_ignorando(connection, tabela, colunas, posicional=False):
 
-            'tipo_env': tipo_envolvimento
+    """
+    INSERT que ignora chaves já existentes (outro worker pode ter gravado a mesma chave).
+    Com posicional=True devolve o SQL em texto, com os marcadores do driver (exec_driver_sql).
+    """
 
-        }).fetchone()
+    nomes = ', '.join(colunas)
+    if posicional:
+        valores = ', '.join([_marcador_driver(connection)] * len(colunas))
+    else:
+        valores = ', '.join(f':{c}' for c in colunas)
+    dialeto = connection.dialect.name
+    if dialeto == 'mysql':
+        sql = f"INSERT IGNORE INTO {tabela} ({nomes}) VALUES ({valores})"
+    elif dialeto == 'sqlite':
+        sql = f"INSERT OR IGNORE INTO {tabela} ({nomes}) VALUES ({valores})"
+    else:
+        sql = f"INSERT INTO {tabela} ({nomes}) VALUES ({valores}) ON CONFLICT DO NOTHING"
+    return sql if posicional else text(sql)
 
-        return result[0] if result else None
 
-    except Exception as e:
+def verificar_colisoes(connection, tabela, coluna_id, colunas_chave, esperados, tamanho_lote=1000):
 
-        print(f"   DEBUG get_or_create_natureza: {e}")
+    """
+    Confere no banco se cada id novo ficou com a chave natural esperada.
+    `esperados` é {id: chave normalizada}. Uma diferença é colisão do hash (ou mistura com ids
+    do modo auto_increment) e interrompe o chunk com ColisaoChaveHash.
+    """
 
-        return None
+    sql = text(
+        f"SELECT {coluna_id}, {', '.join(colunas_chave)} FROM {tabela} WHERE {coluna_id} IN :ids"
+    ).bindparams(bindparam('ids', expanding=True))
 
+    ids = list(esperados)
+    for inicio in range(0, len(ids), tamanho_lote):
+        for linha in connection.execute(sql, {'ids': ids[inicio:inicio + tamanho_lote]}):
+            gravada = tuple(_chave_texto(v) for v in linha[1:])
+            if gravada != esperados[linha[0]]:
+                raise ColisaoChaveHash(
+                    f"{tabela}.{coluna_id}={linha[0]}: chave {esperados[linha[0]]} colide com {gravada}"
+                )
 
-def get_or_create_local(connection, bairro, regional, logradouro, classificacao):
 
-    """Busca ou cria registro na DIM_LOCAL"""
+def _garantir_dimensao_hash(connection, cache, dimensao, distintos, coluna_id, colunas_chave, tabela,
+                            colunas_tabela, montar_registro):
 
-    try:
+    """
+    Grava no banco as chaves de `distintos` que ainda não estão no cache (INSERT ignorando
+    existentes) e confere colisões.
+    """
 
-        sql_select = text("""
+    memoria = getattr(cache, dimensao)
+    novos = {}
+    registros = []
+    for linha in distintos.itertuples(index=False):
+        linha = linha._asdict()
+        chave = tuple(_chave_texto(linha[c]) for c in colunas_chave)
+        if chave in memoria:
+            cache.hits[dimensao] += 1
+            if dimensao == 'local':
+                memoria.move_to_end(chave)
+            continue
+        cache.misses[dimensao] += 1
+        novos[chave] = int(linha[coluna_id])
+        registros.append(montar_registro(linha))
+
+    if not registros:
+        return
 
-            SELECT local_id FROM DIM_LOCAL
+    # Todos os workers travam as chaves na mesma ordem (a do id), sem deadlock entre chunks
+    # que têm chaves em comum
+    registros.sort(key=lambda registro: registro[coluna_id])
+    connection.execute(_sql_inserir_ignorando(connection, tabela, colunas_tabela), registros)
+    verificar_colisoes(
+        connection, tabela, coluna_id, colunas_tabela[1:1 + len(colunas_chave)],
+        {id_: chave for chave, id_ in novos.items()}
+    )
+
+    for chave, id_ in novos.items():
+        if dimensao == 'local':
+            cache._guardar_local(chave, id_)
+        else:
+            memoria[chave] = id_
 
-            WHERE COALESCE(bairro_nome, '') = COALESCE(:bairro, '')
 
-            AND COALESCE(regional_nome, '') = COALESCE(:regional, '')
+def _e_deadlock(erro):
 
-            AND COALESCE(logradouro_nome, '') = COALESCE(:logradouro, '')
+    """True para o erro 1213 do MySQL (transação desfeita por deadlock, pode ser refeita)"""
 
-        """)
+    return (isinstance(erro, DBAPIError) and erro.orig is not None and bool(erro.orig.args)
+            and erro.orig.args[0] == 1213)
 
-       
 
-        result = connection.execute(sql_select, {
+def resolver_chaves_hash(connection, df, cache):
 
-            'bairro': bairro,
+    """
+    Versão de resolver_chaves_chunk para o modo 'hash': os ids são calculados a partir das
+    chaves naturais (sem SELECT nem lastrowid) e o banco só recebe as linhas de dimensão
+    que o cache ainda não conhece, com conferência de colisão.
+    """
 
-            'regional': regional,
+    df = df[df['OCORRENCIA_DATA'].notna()].reset_index(drop=True)
+    tempo, hora = resolver_tempo_hora(connection, df, cache)
+
+    # DIM_NATUREZA
+    cols_natureza = ['NATUREZA1_DESCRICAO', 'NATUREZA2_DESCRICAO', 'TIPO_ENVOLVIMENTO']
+    natureza = df[cols_natureza + ['NATUREZA1_CODIGO']].drop_duplicates(cols_natureza)
+    natureza['categoria_crime'] = categorizar_crimes(natureza['NATUREZA1_DESCRICAO'])
+    natureza['natureza_id'] = [chave_hash(*chave) for chave in natureza[cols_natureza].itertuples(index=False)]
+    if natureza['natureza_id'].duplicated().any():
+        raise ColisaoChaveHash("DIM_NATUREZA: duas chaves do mesmo chunk geraram o mesmo natureza_id")
+
+    _garantir_dimensao_hash(
+        connection, cache, 'natureza', natureza, 'natureza_id', cols_natureza, 'DIM_NATUREZA',
+        ['natureza_id', 'natureza1_descricao', 'natureza2_descricao', 'tipo_envolvimento',
+         'natureza1_codigo', 'categoria_crime'],
+        lambda linha: {
+            'natureza_id': int(linha['natureza_id']), 'natureza1_descricao': _sem_nan(linha['NATUREZA1_DESCRICAO']),
+            'natureza2_descricao': _sem_nan(linha['NATUREZA2_DESCRICAO']),
+            'tipo_envolvimento': _sem_nan(linha['TIPO_ENVOLVIMENTO']),
+            'natureza1_codigo': _sem_nan(linha['NATUREZA1_CODIGO']),
+            'categoria_crime': linha['categoria_crime'],
+        }
+    )
+
+    # DIM_LOCAL
+    cols_local = ['ATENDIMENTO_BAIRRO_NOME', 'ATENDIMENTO_REGIONAL_NOME', 'ATENDIMENTO_LOGRADOURO_NOME']
+    local = df[cols_local + ['CLASSIFICACAO_BAIRRO_REGIONAL']].drop_duplicates(cols_local)
+    local['local_id'] = [chave_hash(*chave) for chave in local[cols_local].itertuples(index=False)]
+    if local['local_id'].duplicated().any():
+        raise ColisaoChaveHash("DIM_LOCAL: duas chaves do mesmo chunk geraram o mesmo local_id")
+
+    _garantir_dimensao_hash(
+        connection, cache, 'local', local, 'local_id', cols_local, 'DIM_LOCAL',
+        ['local_id', 'bairro_nome', 'regional_nome', 'logradouro_nome', 'classificacao_bairro_regional'],
+        lambda linha: {
+            'local_id': int(linha['local_id']), 'bairro_nome': _sem_nan(linha['ATENDIMENTO_BAIRRO_NOME']),
+            'regional_nome': _sem_nan(linha['ATENDIMENTO_REGIONAL_NOME']),
+            'logradouro_nome': _sem_nan(linha['ATENDIMENTO_LOGRADOURO_NOME']),
+            'classificacao_bairro_regional': _sem_nan(linha['CLASSIFICACAO_BAIRRO_REGIONAL']),
+        }
+    )
+
+    fatos = pd.DataFrame({
+        'tempo_id': _mapear_ids(df, tempo, ['OCORRENCIA_DATA'], 'tempo_id'),
+        'natureza_id': _mapear_ids(df, natureza, cols_natureza, 'natureza_id'),
+        'local_id': _mapear_ids(df, local, cols_local, 'local_id'),
+        'hora_id': _mapear_ids(df, hora, ['OCORRENCIA_HORA'], 'hora_id'),
+        'atendimento': df['ATENDIMENTO_NUMERO'].to_numpy(),
+    })
+
+    ok = fatos['tempo_id'].notna()
+    fatos = fatos[ok].astype({'tempo_id': 'int64', 'natureza_id': 'int64', 'local_id': 'int64',
+                              'hora_id': 'Int64', 'atendimento': 'Int64'})
+
+    return fatos, int((~ok).sum())
 
-            'logradouro': logradouro
 
-        }).fetchone()
+# ============================================================
+# CACHE DAS DIMENSÕES EM MEMÓRIA
+# ============================================================
 
-       
+def _chave_texto(valor):
 
-        if result:
+    """Normaliza um valor da chave natural para as chaves do cache (NULL/NaN viram '')"""
 
-            return result[0]
+    if valor is None or pd.isna(valor):
+        return ''
+    return str(valor)
 
-       
 
-        # Inserir novo
+def _contem_ordenado(ordenado, valores):
 
-        sql_insert = text("""
+    """Máscara de quais `valores` estão no array `ordenado` (busca binária, sem montar um set)"""
 
-            INSERT INTO DIM_LOCAL
+    if not len(ordenado):
+        return np.zeros(len(valores), dtype=bool)
+    posicoes = np.searchsorted(ordenado, valores)
+    return ordenado[np.minimum(posicoes, len(ordenado) - 1)] == valores
 
-            (bairro_nome, regional_nome, logradouro_nome, classificacao_bairro_regional)
 
-            VALUES (:bairro, :regional, :logradouro, :classificacao)
+class CacheDimensoes:
 
-        """)
+    """
+    Mantém em memória o mapeamento chave natural -> id das dimensões.
+    Só vai ao banco (inserir_* / get_or_create_*) quando a chave realmente não está no cache.
+    Guarda também as chaves já gravadas na FATO_OCORRENCIA (filtro da carga idempotente).
+    """
 
-       
+    DIMENSOES = ('tempo', 'natureza', 'local', 'hora')
 
-        result = connection.execute(sql_insert, {
+    def __init__(self, limite_local=LIMITE_CACHE_LOCAL, lock=None, modo_chaves=MODO_CHAVES):
+        self.tempo = {}
+        self.natureza = {}
+        self.hora = {}
+        # DIM_LOCAL pode crescer muito: usamos LRU com tamanho limitado
+        self.local = OrderedDict()
+        self.limite_local = limite_local
+        # Enquanto a DIM_LOCAL inteira couber no LRU (nada descartado), um miss também é um local novo
+        self.local_completo = False
+        self.hits = dict.fromkeys(self.DIMENSOES, 0)
+        self.misses = dict.fromkeys(self.DIMENSOES, 0)
+        self.descartes_local = 0
+        # Com vários processos carregando ao mesmo tempo, os misses passam por um lock
+        # compartilhado e são gravados numa transação própria, já confirmada
+        self.lock = lock
+        # No modo 'hash' os ids não dependem do banco e o lock não é usado (ver resolver_chaves_hash)
+        self.modo_chaves = modo_chaves
+        # chave_fato de todas as linhas da fato, ordenadas: 8 bytes por linha (cerca de 24 MB para
+        # 3 milhões), contra mais de 100 bytes por chave num set do Python
+        self.chaves_fato = np.empty(0, dtype=np.int64)
+        self.fatos_ja_gravados = 0
 
-            'bairro': bairro,
+    def _criar(self, connection, criar, *args):
 
-            'regional': regional,
+        """Executa o inserir_* / get_or_create_* de um miss, serializado entre processos quando há lock"""
 
-            'logradouro': logradouro,
+        if self.lock is None:
+            return criar(connection, *args)
 
-            'classificacao': classificacao
+        with self.lock:
+            with connection.engine.begin() as conn_dimensao:
+                return criar(conn_dimensao, *args)
 
-        })
+    def carregar(self, connection):
 
-       
+        """Pré-carrega as dimensões existentes no banco (uma vez por execução)"""
 
-        return result.lastrowid
+        self._carregar_tempo(connection)
+        self._carregar_hora(connection)
+        self._carregar_chaves_fato(connection)
 
-       
+        for nat1, nat2, tipo_env, natureza_id in connection.execute(text(
+            "SELECT natureza1_descricao, natureza2_descricao, tipo_envolvimento, natureza_id FROM DIM_NATUREZA"
+        )):
+            self.natureza[(_chave_texto(nat1), _chave_texto(nat2), _chave_texto(tipo_env))] = natureza_id
 
-    except IntegrityError:
+        # Para DIM_LOCAL carregamos só os registros mais recentes até o limite do cache
+        for bairro, regional, logradouro, local_id in connection.execute(text(
+            "SELECT bairro_nome, regional_nome, logradouro_nome, local_id FROM DIM_LOCAL "
+            "ORDER BY local_id DESC LIMIT :limite"
+        ), {'limite': self.limite_local}):
+            self.local[(_chave_texto(bairro), _chave_texto(regional), _chave_texto(logradouro))] = local_id
+        # Os mais recentes ficam no fim da fila do LRU
+        for chave in reversed(list(self.local)):
+            self.local.move_to_end(chave)
+        self.local_completo = len(self.local) < self.limite_local
 
-        result = connection.execute(sql_select, {
+    def _carregar_tempo(self, connection):
+        for data_completa, tempo_id in connection.execute(text(
+            "SELECT data_completa, tempo_id FROM DIM_TEMPO"
+        )):
+            self.tempo[str(data_completa)] = tempo_id
 
-            'bairro': bairro,
+    def _carregar_hora(self, connection):
+        for hora_completa, hora_id in connection.execute(text(
+            "SELECT hora_completa, hora_id FROM DIM_HORA"
+        )):
+            self.hora[str(hora_completa)] = hora_id
 
-            'regional': regional,
+    def _carregar_chaves_fato(self, connection):
+        chaves = connection.execute(text("SELECT chave_fato FROM FATO_OCORRENCIA")).scalars()
+        self.chaves_fato = np.sort(np.fromiter(chaves, dtype=np.int64))
 
-            'logradouro': logradouro
+    def fatos_gravados(self, chaves):
 
-        }).fetchone()
+        """Máscara das chave_fato que já estão no banco"""
 
-        return result[0] if result else None
+        return _contem_ordenado(self.chaves_fato, chaves)
 
-    except Exception as e:
+    def registrar_chaves_fato(self, chaves):
 
-        print(f"   DEBUG get_or_create_local: {e}")
+        """Acrescenta chaves recém-gravadas ao filtro, mantendo a ordem (uma cópia do array, sem ordenar tudo)"""
 
-        return None
+        chaves = np.unique(chaves)
+        self.chaves_fato = np.insert(self.chaves_fato, np.searchsorted(self.chaves_fato, chaves), chaves)
 
+    def descartar_chaves_fato(self, chaves):
 
-def get_or_create_hora(connection, hora_str):
+        """Tira do filtro chaves removidas do banco (ver remover_fatos_substituidos)"""
 
-    """Busca ou cria registro na DIM_HORA"""
+        self.chaves_fato = self.chaves_fato[~_contem_ordenado(np.sort(chaves), self.chaves_fato)]
 
-    try:
+    def recarregar(self, connection):
 
-        if not hora_str or pd.isna(hora_str):
+        """Descarta o conteúdo atual (ex.: após rollback) e lê as dimensões e as chaves da fato de novo"""
 
-            return None
+        self.tempo.clear()
+        self.natureza.clear()
+        self.hora.clear()
+        self.local.clear()
+        self.carregar(connection)
+
+    def _guardar_local(self, chave, local_id):
+        self.local[chave] = local_id
+        self.local.move_to_end(chave)
+        while len(self.local) > self.limite_local:
+            self.local.popitem(last=False)
+            self.descartes_local += 1
+            self.local_completo = False
 
-           
+    def garantir_tempo(self, connection, datas):
 
-        sql_select = text("""
+        """
+        Confere se as datas estão no calendário em memória. Datas fora da faixa pré-gerada
+        fazem o(s) ano(s) inteiro(s) ser(em) gerado(s) de uma vez, sem insert por data.
+        """
 
-            SELECT hora_id FROM DIM_HORA
+        faltantes = [data for data in datas if data not in self.tempo]
+        self.hits['tempo'] += len(datas) - len(faltantes)
+        if not faltantes:
+            return
 
-            WHERE hora_completa = :hora_completa
+        self.misses['tempo'] += len(faltantes)
+        anos = sorted({int(data[:4]) for data in faltantes})
+        _gravar_dimensao_fixa(connection, 'DIM_TEMPO', gerar_dim_tempo(anos[0], anos[-1]))
+        self._carregar_tempo(connection)
 
-        """)
+    def garantir_hora(self, connection, horas):
 
-       
+        """Confere se os horários ('HH:MM') estão em memória; se faltar algum, grava a DIM_HORA completa"""
 
-        result = connection.execute(sql_select, {'hora_completa': hora_str}).fetchone()
+        faltantes = [hora for hora in horas if hora not in self.hora]
+        self.hits['hora'] += len(horas) - len(faltantes)
+        if not faltantes:
+            return
 
-       
+        self.misses['hora'] += len(faltantes)
+        _gravar_dimensao_fixa(connection, 'DIM_HORA', gerar_dim_hora())
+        self._carregar_hora(connection)
+
+    def natureza_id(self, connection, nat1_codigo, nat1_desc, nat2_desc, tipo_envolvimento, categoria):
+
+        """Busca o natureza_id no cache ou no banco"""
+
+        chave = (_chave_texto(nat1_desc), _chave_texto(nat2_desc), _chave_texto(tipo_envolvimento))
+        if chave in self.natureza:
+            self.hits['natureza'] += 1
+            return self.natureza[chave]
+
+        # A DIM_NATUREZA inteira está no cache: sem outros processos gravando, um miss é uma natureza nova
+        self.misses['natureza'] += 1
+        criar = inserir_natureza if self.lock is None else get_or_create_natureza
+        natureza_id = self._criar(connection, criar, nat1_codigo, nat1_desc, nat2_desc, tipo_envolvimento, categoria)
+        if natureza_id is not None:
+            self.natureza[chave] = natureza_id
+        return natureza_id
+
+    def local_id(self, connection, bairro, regional, logradouro, classificacao):
+
+        """Busca o local_id no cache (LRU) ou no banco"""
+
+        chave = (_chave_texto(bairro), _chave_texto(regional), _chave_texto(logradouro))
+        if chave in self.local:
+            self.hits['local'] += 1
+            self.local.move_to_end(chave)
+            return self.local[chave]
+
+        self.misses['local'] += 1
+        criar = inserir_local if self.local_completo and self.lock is None else get_or_create_local
+        local_id = self._criar(connection, criar, bairro, regional, logradouro, classificacao)
+        if local_id is not None:
+            self._guardar_local(chave, local_id)
+        return local_id
+
+    def estatisticas(self):
+
+        """Retorna hits, misses, tamanho e taxa de acerto de cada dimensão"""
+
+        stats = {}
+        for dim in self.DIMENSOES:
+            consultas = self.hits[dim] + self.misses[dim]
+            stats[dim] = {
+                'hits': self.hits[dim],
+                'misses': self.misses[dim],
+                'tamanho': len(getattr(self, dim)),
+                'taxa_acerto': round(self.hits[dim] / consultas, 4) if consultas else 0.0,
+            }
+        stats['local']['descartes'] = self.descartes_local
+        return stats
+
+    def imprimir_estatisticas(self):
+        print("\n📦 Cache de dimensões:")
+        for dim, s in self.estatisticas().items():
+            print(f"   {dim:<9} hits={s['hits']:,} misses={s['misses']:,} "
+                  f"tamanho={s['tamanho']:,} acerto={s['taxa_acerto']:.1%}")
+        if self.descartes_local:
+            print(f"   local: {self.descartes_local:,} entradas descartadas pelo LRU")
+        print(f"   fato      {len(self.chaves_fato):,} chaves em memória, "
+              f"{self.fatos_ja_gravados:,} linhas já gravadas puladas")
 
-        if result:
 
-            return result[0]
+# ============================================================
+# TABELAS AGREGADAS (relatórios padrão)
+# ============================================================
 
-       
+# Contagens somadas na mesma transação de cada chunk: tabela -> colunas da chave.
+# Textos ausentes são gravados como '' (a chave não aceita NULL); as views devolvem NULL
+AGREGADOS = {
+    'AGG_CRIMES_ANO': ['ocorrencia_ano'],
+    'AGG_CRIMES_MES': ['ocorrencia_ano', 'ocorrencia_mes'],
+    'AGG_CRIMES_BAIRRO': ['bairro_nome', 'regional_nome'],
+    'AGG_CRIMES_TIPO': ['tipo_crime'],
+    'AGG_CRIMES_CATEGORIA': ['categoria_crime'],
+    'AGG_CRIMES_PERIODO': ['periodo_dia'],
+}
 
-        # Inserir novo
+# Mesmas contagens calculadas a partir da tabela fato (recalcular_agregados)
+SQL_RECALCULO_AGREGADOS = {
+    'AGG_CRIMES_ANO': """
+        SELECT t.ocorrencia_ano, COUNT(*) FROM FATO_OCORRENCIA f
+        JOIN DIM_TEMPO t ON f.tempo_id = t.tempo_id
+        GROUP BY t.ocorrencia_ano""",
+    'AGG_CRIMES_MES': """
+        SELECT t.ocorrencia_ano, t.ocorrencia_mes, t.nome_mes, COUNT(*) FROM FATO_OCORRENCIA f
+        JOIN DIM_TEMPO t ON f.tempo_id = t.tempo_id
+        GROUP BY t.ocorrencia_ano, t.ocorrencia_mes, t.nome_mes""",
+    'AGG_CRIMES_BAIRRO': """
+        SELECT COALESCE(l.bairro_nome, ''), COALESCE(l.regional_nome, ''), COUNT(*) FROM FATO_OCORRENCIA f
+        JOIN DIM_LOCAL l ON f.local_id = l.local_id
+        GROUP BY COALESCE(l.bairro_nome, ''), COALESCE(l.regional_nome, '')""",
+    'AGG_CRIMES_TIPO': """
+        SELECT COALESCE(n.natureza1_descricao, ''), COUNT(*) FROM FATO_OCORRENCIA f
+        JOIN DIM_NATUREZA n ON f.natureza_id = n.natureza_id
+        GROUP BY COALESCE(n.natureza1_descricao, '')""",
+    'AGG_CRIMES_CATEGORIA': """
+        SELECT COALESCE(n.categoria_crime, ''), COUNT(*) FROM FATO_OCORRENCIA f
+        JOIN DIM_NATUREZA n ON f.natureza_id = n.natureza_id
+        GROUP BY COALESCE(n.categoria_crime, '')""",
+    'AGG_CRIMES_PERIODO': """
+        SELECT h.periodo_dia, COUNT(*) FROM FATO_OCORRENCIA f
+        JOIN DIM_HORA h ON f.hora_id = h.hora_id
+        GROUP BY h.periodo_dia""",
+}
 
-        try:
+COLUNAS_AGREGADOS = {
+    tabela: chaves + (['nome_mes'] if tabela == 'AGG_CRIMES_MES' else []) + ['total']
+    for tabela, chaves in AGREGADOS.items()
+}
 
-            hora_parts = str(hora_str).split(':')
 
-            hora_num = int(float(hora_parts[0])) if len(hora_parts) > 0 else 0
+def contar_agregados(df, fatos):
 
-            minuto_num = int(float(hora_parts[1])) if len(hora_parts) > 1 else 0
+    """
+    Contagens do chunk para cada tabela de AGREGADOS, só das linhas que entraram em `fatos`
+    (o índice de `fatos` aponta para as linhas com data, como em resolver_chaves_chunk).
+    Ano e mês saem do tempo_id (aaaammdd) e o período só conta linhas com hora_id, como nas views.
+    Retorna tabela -> DataFrame com as colunas de COLUNAS_AGREGADOS.
+    """
 
-        except:
+    linhas = df[df['OCORRENCIA_DATA'].notna()].reset_index(drop=True).loc[fatos.index]
 
-            hora_num = 0
+    def texto(col):
+        return linhas[col].astype('string').fillna('')
 
-            minuto_num = 0
+    base = pd.DataFrame({
+        'ocorrencia_ano': fatos['tempo_id'] // 10000,
+        'ocorrencia_mes': fatos['tempo_id'] // 100 % 100,
+        'bairro_nome': texto('ATENDIMENTO_BAIRRO_NOME'),
+        'regional_nome': texto('ATENDIMENTO_REGIONAL_NOME'),
+        'tipo_crime': texto('NATUREZA1_DESCRICAO'),
+        'categoria_crime': categorizar_crimes(linhas['NATUREZA1_DESCRICAO']),
+        'periodo_dia': classificar_periodos(linhas['OCORRENCIA_HORA']).where(fatos['hora_id'].notna()),
+    }, index=fatos.index)
 
-           
+    return agrupar_agregados(base)
 
-        periodo = classificar_periodo_dia(hora_str)
 
-       
+def agrupar_agregados(base):
 
-        sql_insert = text("""
+    """
+    Contagens de cada tabela de AGREGADOS a partir de uma linha por fato com as colunas das chaves
+    (chaves nulas não são contadas). Retorna tabela -> DataFrame com as colunas de COLUNAS_AGREGADOS.
+    """
 
-            INSERT INTO DIM_HORA
+    agregados = {}
+    for tabela, chaves in AGREGADOS.items():
+        contagens = base.groupby(chaves).size().reset_index(name='total')
+        if tabela == 'AGG_CRIMES_MES':
+            contagens.insert(2, 'nome_mes', nomes_meses(contagens['ocorrencia_mes']))
+        agregados[tabela] = contagens
+    return agregados
 
-            (hora_completa, hora, minuto, periodo_dia)
 
-            VALUES (:hora_completa, :hora, :minuto, :periodo)
+def _sql_somar_agregado(connection, tabela):
 
-        """)
+    """Upsert que soma o total do chunk ao total já gravado para a mesma chave"""
 
-       
+    colunas = COLUNAS_AGREGADOS[tabela]
+    sql = (f"INSERT INTO {tabela} ({', '.join(colunas)}) "
+           f"VALUES ({', '.join(f':{c}' for c in colunas)})")
+    if connection.dialect.name == 'mysql':
+        return text(sql + " ON DUPLICATE KEY UPDATE total = total + VALUES(total)")
+    return text(sql + f" ON CONFLICT ({', '.join(AGREGADOS[tabela])}) "
+                      f"DO UPDATE SET total = {tabela}.total + excluded.total")
 
-        result = connection.execute(sql_insert, {
 
-            'hora_completa': hora_str,
+@METRICAS.medir('agregados')
+def atualizar_agregados(connection, agregados):
 
-            'hora': hora_num,
+    """
+    Soma as contagens do chunk nas tabelas agregadas.
+    Tabelas e chaves vão sempre na mesma ordem, para os workers não se travarem (deadlock).
+    """
 
-            'minuto': minuto_num,
+    for tabela, contagens in agregados.items():
+        if not contagens.empty:
+            connection.execute(_sql_somar_agregado(connection, tabela), contagens.astype(object).to_dict('records'))
 
-            'periodo': periodo
 
-        })
+def recalcular_agregados(engine):
 
-       
+    """
+    Reconstrói as tabelas agregadas a partir da FATO_OCORRENCIA (bancos carregados antes delas
+    existirem ou alterados fora do loader)
+    """
 
-        return result.lastrowid
+    with engine.begin() as connection:
+        for tabela, select in SQL_RECALCULO_AGREGADOS.items():
+            connection.execute(text(f"DELETE FROM {tabela}"))
+            connection.execute(text(f"INSERT INTO {tabela} ({', '.join(COLUNAS_AGREGADOS[tabela])}) {select}"))
+        incrementar_versao_dados(connection)
+    print("📊 Tabelas agregadas recalculadas a partir da FATO_OCORRENCIA")
 
-       
+# ============================================================
+# CARGA IDEMPOTENTE (chave_fato)
+# ============================================================
 
-    except IntegrityError:
+# Colunas gravadas na FATO_OCORRENCIA (nomes do DataFrame de fatos e da tabela)
+COLUNAS_FATO = ['tempo_id', 'natureza_id', 'local_id', 'hora_id', 'atendimento', 'chave_fato', 'arquivo_id']
+COLUNAS_TABELA_FATO = ['tempo_id', 'natureza_id', 'local_id', 'hora_id', 'atendimento_numero', 'chave_fato',
+                       'arquivo_id']
 
-        result = connection.execute(sql_select, {'hora_completa': hora_str}).fetchone()
+# Chave natural de uma linha da fato: o atendimento e as chaves das dimensões. Dentro de um banco
+# cada id de dimensão corresponde a uma única chave natural, e hashear os ids sai bem mais barato
+# que hashear os textos
+COLUNAS_CHAVE_FATO = ['atendimento', 'tempo_id', 'natureza_id', 'local_id', 'hora_id']
 
-        return result[0] if result else None
+# Chaves por consulta ao procurar linhas da fato pela chave_fato
+TAMANHO_LOTE_SUBSTITUICAO = 1000
 
-    except Exception as e:
 
-        print(f"   DEBUG get_or_create_hora: {e}")
+def id_arquivo(caminho):
 
-        return None
+    """
+    arquivo_id gravado nas linhas da fato: hash do nome do arquivo de origem (o mesmo para a URL
+    e para a cópia baixada). Os números de atendimento se repetem entre os arquivos anuais, então
+    é o arquivo_id que diz quais linhas uma recarga pode substituir.
+    """
+
+    return chave_hash(os.path.basename(caminho))
+
+
+def _hash_linhas(df):
+
+    """Hash de 64 bits de cada linha (o mesmo em qualquer execução: a chave do hash é fixa)"""
+
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+@METRICAS.medir('chaves')
+def calcular_chaves_fato(fatos, ocorrencias):
+
+    """
+    chave_fato de cada linha: hash de 63 bits (positivo, cabe num BIGINT) de COLUNAS_CHAVE_FATO e da
+    ordem da linha entre as iguais já lidas do arquivo. A ordem separa linhas com o mesmo atendimento
+    e as mesmas dimensões (ex.: dois envolvidos do mesmo tipo), que continuam contando como duas.
+    `ocorrencias` (chave natural -> linhas vistas) é atualizado, para a contagem seguir no próximo chunk.
+    """
+
+    naturais = pd.Series(_hash_linhas(fatos[COLUNAS_CHAVE_FATO].fillna(-1).astype('int64')))
+    contagens = naturais.value_counts(sort=False)
+    anteriores = pd.Series([ocorrencias.get(chave, 0) for chave in contagens.index.tolist()],
+                           index=contagens.index, dtype='int64')
+    ordem = naturais.groupby(naturais, sort=False).cumcount() + naturais.map(anteriores)
+    ocorrencias.update(zip(contagens.index.tolist(), (anteriores + contagens).tolist()))
+
+    chaves = _hash_linhas(pd.DataFrame({'natural': naturais, 'ordem': ordem}))
+    return (chaves >> np.uint64(1)).astype(np.int64)
+
+
+def _executar_por_chaves(connection, sql, chaves, **parametros):
+
+    """Executa `sql` (com o parâmetro expandido :chaves) em lotes de chave_fato e junta as linhas retornadas"""
+
+    sql = text(sql).bindparams(bindparam('chaves', expanding=True))
+    chaves = [int(chave) for chave in chaves]
+    linhas = []
+    for inicio in range(0, len(chaves), TAMANHO_LOTE_SUBSTITUICAO):
+        lote = chaves[inicio:inicio + TAMANHO_LOTE_SUBSTITUICAO]
+        resultado = connection.execute(sql, {'chaves': lote, **parametros})
+        if resultado.returns_rows:
+            linhas.extend(resultado.all())
+    return linhas
+
+
+def chaves_inseridas(connection, fatos, arquivo_id):
+
+    """
+    Máscara das linhas de `fatos` que o banco aceitou, quando o INSERT IGNORE / LOAD DATA rejeitou
+    parte delas. A chave_fato de cada linha é única e as linhas gravadas antes com o mesmo
+    arquivo_id já estavam no filtro do cache (um arquivo nunca é gravado por dois processos ao
+    mesmo tempo), então só as desta carga aparecem com o arquivo_id.
+    """
+
+    gravadas = _executar_por_chaves(
+        connection, "SELECT chave_fato FROM FATO_OCORRENCIA WHERE arquivo_id = :arquivo AND chave_fato IN :chaves",
+        fatos['chave_fato'].tolist(), arquivo=arquivo_id
+    )
+    return _contem_ordenado(np.sort(np.array([chave for chave, in gravadas], dtype=np.int64)),
+                            fatos['chave_fato'].to_numpy())
+
+
+@METRICAS.medir('substituicao')
+def remover_fatos_substituidos(connection, arquivo_id, chaves):
+
+    """
+    Fim da carga de um arquivo lido inteiro: remove da fato as linhas gravadas com o arquivo_id
+    cuja chave não veio no arquivo (versões antigas de linhas alteradas ou que saíram do arquivo)
+    e desconta essas linhas das tabelas agregadas. Linhas de outros arquivos não são tocadas.
+    Linhas sem arquivo_id (gravadas antes da coluna existir) com chave no arquivo passam a ser dele.
+    `chaves` tem a chave_fato de todas as linhas do arquivo. Retorna as chave_fato removidas.
+    """
+
+    atuais = np.sort(chaves)
+
+    sem_arquivo = connection.execute(text(
+        "SELECT 1 FROM FATO_OCORRENCIA WHERE arquivo_id IS NULL LIMIT 1"
+    )).first()
+    if sem_arquivo:
+        _executar_por_chaves(connection, "UPDATE FATO_OCORRENCIA SET arquivo_id = :arquivo "
+                                         "WHERE arquivo_id IS NULL AND chave_fato IN :chaves",
+                             atuais, arquivo=arquivo_id)
+
+    # Pares (ocorrencia_id, chave_fato) gravados para o arquivo e sem chave na carga nova
+    gravadas = np.array(connection.execute(text(
+        "SELECT ocorrencia_id, chave_fato FROM FATO_OCORRENCIA WHERE arquivo_id = :arquivo"
+    ), {'arquivo': arquivo_id}).all(), dtype=np.int64).reshape(-1, 2)
+    removidas = gravadas[~_contem_ordenado(atuais, gravadas[:, 1])]
+    if not len(removidas):
+        return removidas[:, 1]
+
+    # Contagens das linhas removidas, com os mesmos valores que contar_agregados usou ao gravá-las
+    sql_linhas = text("""
+        SELECT ocorrencia_ano, ocorrencia_mes, bairro_nome, regional_nome, tipo_crime, categoria_crime, periodo_dia
+        FROM vw_ocorrencias_completas WHERE ocorrencia_id IN :ids
+    """).bindparams(bindparam('ids', expanding=True))
+    sql_remover = text("DELETE FROM FATO_OCORRENCIA WHERE ocorrencia_id IN :ids").bindparams(
+        bindparam('ids', expanding=True))
+
+    ids = removidas[:, 0].tolist()
+    linhas = []
+    for inicio in range(0, len(ids), TAMANHO_LOTE_SUBSTITUICAO):
+        lote = ids[inicio:inicio + TAMANHO_LOTE_SUBSTITUICAO]
+        linhas.extend(connection.execute(sql_linhas, {'ids': lote}).all())
+        connection.execute(sql_remover, {'ids': lote})
+
+    base = pd.DataFrame(linhas, columns=['ocorrencia_ano', 'ocorrencia_mes', 'bairro_nome', 'regional_nome',
+                                         'tipo_crime', 'categoria_crime', 'periodo_dia'])
+    for coluna in ('bairro_nome', 'regional_nome', 'tipo_crime', 'categoria_crime'):
+        base[coluna] = base[coluna].fillna('')
+    for tabela, contagens in agrupar_agregados(base).items():
+        if contagens.empty:
+            continue
+        contagens['total'] = -contagens['total']
+        connection.execute(_sql_somar_agregado(connection, tabela), contagens.astype(object).to_dict('records'))
+        connection.execute(text(f"DELETE FROM {tabela} WHERE total <= 0"))
+
+    return removidas[:, 1]
+
+
+def _tem_coluna_fato(engine, coluna):
+    with engine.connect() as connection:
+        try:
+            connection.execute(text(f"SELECT {coluna} FROM FATO_OCORRENCIA WHERE 1 = 0"))
+            return True
+        except DBAPIError:
+            return False
+
+
+def garantir_chave_fato(engine):
+
+    """
+    Bancos criados antes da chave_fato: adiciona a coluna, calcula a chave das linhas já gravadas
+    (na ordem de gravação, como o loader faria) e cria os índices da carga idempotente.
+    As linhas antigas ficam sem arquivo_id; na primeira recarga de cada arquivo as que têm chave no
+    arquivo passam a ser dele. As demais (ex.: duplicadas por recargas antigas) não são removidas
+    pelas recargas: para limpá-las, esvazie a fato e carregue de novo.
+    """
+
+    if not _tem_coluna_fato(engine, 'chave_fato'):
+        print("🔑 FATO_OCORRENCIA sem chave_fato: calculando a chave das linhas já gravadas...")
+        inicio = time.perf_counter()
+        with engine.begin() as connection:
+            connection.execute(text("ALTER TABLE FATO_OCORRENCIA ADD COLUMN chave_fato BIGINT"))
+            connection.execute(text(
+                "CREATE TEMPORARY TABLE CHAVES_FATO_MIGRACAO "
+                "(ocorrencia_id BIGINT PRIMARY KEY, chave_fato BIGINT NOT NULL)"
+            ))
+            marcador = _marcador_driver(connection)
+            ocorrencias = {}
+            linhas = pd.read_sql(text(
+                "SELECT ocorrencia_id, tempo_id, natureza_id, local_id, hora_id, atendimento_numero AS atendimento "
+                "FROM FATO_OCORRENCIA ORDER BY ocorrencia_id"
+            ), connection, chunksize=TAMANHO_CHUNK)
+            for lote in linhas:
+                lote['chave_fato'] = calcular_chaves_fato(lote, ocorrencias)
+                connection.exec_driver_sql(
+                    f"INSERT INTO CHAVES_FATO_MIGRACAO (ocorrencia_id, chave_fato) "
+                    f"VALUES ({marcador}, {marcador})",
+                    list(lote[['ocorrencia_id', 'chave_fato']].itertuples(index=False, name=None))
+                )
+            connection.execute(text("""
+                UPDATE FATO_OCORRENCIA SET chave_fato = (
+                    SELECT c.chave_fato FROM CHAVES_FATO_MIGRACAO c
+                    WHERE c.ocorrencia_id = FATO_OCORRENCIA.ocorrencia_id
+                )
+            """))
+            connection.execute(text("DROP TABLE CHAVES_FATO_MIGRACAO"))
+            if connection.dialect.name == 'mysql':
+                connection.execute(text(
+                    "ALTER TABLE FATO_OCORRENCIA MODIFY chave_fato BIGINT NOT NULL, "
+                    "ADD UNIQUE KEY uk_fato_chave (chave_fato)"
+                ))
+            else:
+                connection.execute(text("CREATE UNIQUE INDEX uk_fato_chave ON FATO_OCORRENCIA (chave_fato)"))
+        print(f"🔑 chave_fato criada em {time.perf_counter() - inicio:.1f}s")
+
+    tem_arquivo = _tem_coluna_fato(engine, 'arquivo_id')
+    with engine.begin() as connection:
+        if connection.dialect.name == 'mysql':
+            if not tem_arquivo:
+                connection.execute(text(
+                    "ALTER TABLE FATO_OCORRENCIA ADD COLUMN arquivo_id BIGINT NULL, "
+                    "ADD INDEX idx_fato_arquivo (arquivo_id, chave_fato)"
+                ))
+        else:
+            if not tem_arquivo:
+                connection.execute(text("ALTER TABLE FATO_OCORRENCIA ADD COLUMN arquivo_id BIGINT"))
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS idx_fato_arquivo ON FATO_OCORRENCIA (arquivo_id, chave_fato)"
+            ))
+    if not tem_arquivo:
+        print("🔑 arquivo_id criado na FATO_OCORRENCIA (linhas antigas ficam sem arquivo)")
 
 
 # ============================================================
 # FUNÇÃO PRINCIPAL DE PROCESSAMENTO
 # ============================================================
 
-def processar_csv_para_mysql(csv_url, engine):
+@METRICAS.medir('conversao')
+def converter_tipos(df):
+
+    """Converte as colunas para os tipos esperados pelo banco (sem limpeza/tratamento)"""
+
+    # O pipeline já converte os chunks na etapa de leitura
+    if df.attrs.get('convertido'):
+        return df
+
+    # Converter OCORRENCIA_DATA para 'YYYY-MM-DD' (no staging Parquet ela já vem como data)
+    if 'OCORRENCIA_DATA' in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df['OCORRENCIA_DATA']):
+            df['OCORRENCIA_DATA'] = df['OCORRENCIA_DATA'].dt.strftime('%Y-%m-%d')
+        else:
+            # Um arquivo tem no máximo 366 datas: a conversão roda só nos valores distintos
+            df['OCORRENCIA_DATA'] = por_distinto(df['OCORRENCIA_DATA'], lambda datas: pd.to_datetime(
+                datas, format='%d/%m/%Y', errors='coerce'
+            ).dt.strftime('%Y-%m-%d'))
+
+    # Converter colunas numéricas para inteiros compactos (valores inválidos viram NULL)
+    for col, tipo in TIPOS_INTEIROS.items():
+        if col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                numeros = por_distinto(df[col], lambda valores: pd.to_numeric(valores, errors='coerce'))
+            else:
+                numeros = pd.to_numeric(df[col], errors='coerce')
+            df[col] = numeros.astype('float64').astype(tipo)
+
+    # Garante que todas as colunas esperadas existem (valores ausentes viram NULL)
+    for col in CSV_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+
+    df.attrs['convertido'] = True
+    return df
+
+
+def _sem_nan(valor):
+
+    """NaN/NA viram None e escalares do numpy viram tipos nativos (o driver do banco não conhece numpy)"""
+
+    if pd.isna(valor):
+        return None
+    return valor.item() if hasattr(valor, 'item') else valor
+
 
+def _mapear_ids(df, distintos, colunas, nome_id):
+
+    """Junta ao chunk os ids resolvidos para cada combinação distinta das colunas"""
+
+    return df.merge(distintos[colunas + [nome_id]], on=colunas, how='left')[nome_id].to_numpy()
+
+
+def resolver_tempo_hora(connection, df, cache):
+
+    """
+    Resolve tempo_id e hora_id das datas e horários distintos do chunk só com consultas em
+    memória (as duas dimensões são pré-geradas). Horários são normalizados para 'HH:MM'.
+    Retorna os DataFrames (data -> tempo_id) e (horário original -> hora_id) para o merge.
     """
 
-    Lê CSV, visualiza dados, converte tipos e carrega no MySQL
+    tempo = df[['OCORRENCIA_DATA']].drop_duplicates()
+    cache.garantir_tempo(connection, tempo['OCORRENCIA_DATA'].tolist())
+    tempo['tempo_id'] = tempo['OCORRENCIA_DATA'].map(cache.tempo)
 
-    SEM fazer tratamento dos dados - apenas conversão de tipos
+    hora = df[['OCORRENCIA_HORA']].drop_duplicates()
+    normalizadas = normalizar_horas(hora['OCORRENCIA_HORA'])
+    cache.garantir_hora(connection, normalizadas.dropna().unique().tolist())
+    hora['hora_id'] = normalizadas.map(cache.hora).astype('Int64')
+
+    return tempo, hora
+
+
+@METRICAS.medir('dimensoes')
+def resolver_chaves_chunk(connection, df, cache):
+
+    """
+    Resolve as chaves das dimensões de um chunk já convertido.
+    Cada combinação distinta de chave natural é resolvida uma única vez (cache/banco)
+    e o resultado é espalhado para as linhas com merge.
+    Retorna (DataFrame com as colunas da tabela fato, quantidade de linhas descartadas).
+    """
+
+    if cache.modo_chaves == 'hash':
+        return resolver_chaves_hash(connection, df, cache)
+
+    # Linhas sem data não entram na tabela fato
+    df = df[df['OCORRENCIA_DATA'].notna()].reset_index(drop=True)
+    tempo, hora = resolver_tempo_hora(connection, df, cache)
+
+    # DIM_NATUREZA
+    cols_natureza = ['NATUREZA1_DESCRICAO', 'NATUREZA2_DESCRICAO', 'TIPO_ENVOLVIMENTO']
+    natureza = df[cols_natureza + ['NATUREZA1_CODIGO']].drop_duplicates(cols_natureza)
+    natureza['categoria_crime'] = categorizar_crimes(natureza['NATUREZA1_DESCRICAO'])
+    natureza['natureza_id'] = [
+        cache.natureza_id(connection, _sem_nan(codigo), _sem_nan(nat1), _sem_nan(nat2), _sem_nan(tipo_env), categoria)
+        for nat1, nat2, tipo_env, codigo, categoria in natureza.itertuples(index=False)
+    ]
+
+    # DIM_LOCAL
+    cols_local = ['ATENDIMENTO_BAIRRO_NOME', 'ATENDIMENTO_REGIONAL_NOME', 'ATENDIMENTO_LOGRADOURO_NOME']
+    local = df[cols_local + ['CLASSIFICACAO_BAIRRO_REGIONAL']].drop_duplicates(cols_local)
+    local['local_id'] = [
+        cache.local_id(connection, _sem_nan(bairro), _sem_nan(regional), _sem_nan(logradouro), _sem_nan(classificacao))
+        for bairro, regional, logradouro, classificacao in local.itertuples(index=False)
+    ]
+
+    fatos = pd.DataFrame({
+        'tempo_id': _mapear_ids(df, tempo, ['OCORRENCIA_DATA'], 'tempo_id'),
+        'natureza_id': _mapear_ids(df, natureza, cols_natureza, 'natureza_id'),
+        'local_id': _mapear_ids(df, local, cols_local, 'local_id'),
+        'hora_id': _mapear_ids(df, hora, ['OCORRENCIA_HORA'], 'hora_id'),
+        'atendimento': df['ATENDIMENTO_NUMERO'].to_numpy(),
+    })
+
+    # Dimensões que não puderam ser resolvidas descartam a linha
+    ok = fatos[['tempo_id', 'natureza_id', 'local_id']].notna().all(axis=1)
+    fatos = fatos[ok].astype({'tempo_id': 'int64', 'natureza_id': 'int64', 'local_id': 'int64',
+                              'hora_id': 'Int64', 'atendimento': 'Int64'})
+
+    return fatos, int((~ok).sum())
+
+
+@METRICAS.medir('fatos')
+def inserir_fatos(connection, fatos):
 
     """
+    Insere as linhas da tabela fato com um único executemany, em tuplas direto no driver:
+    sem a conversão de parâmetros nomeados do SQLAlchemy (cerca de 3x mais rápido no SQLite;
+    o PyMySQL junta o lote em INSERTs de várias linhas). Linhas com chave_fato já gravada
+    são ignoradas pelo banco. Retorna quantas linhas entraram.
+    """
+
+    if fatos.empty:
+        return 0
+
+    colunas = fatos[COLUNAS_FATO]
+    registros = list(colunas.astype(object).where(colunas.notna(), None).itertuples(index=False, name=None))
+
+    resultado = connection.exec_driver_sql(
+        _sql_inserir_ignorando(connection, 'FATO_OCORRENCIA', COLUNAS_TABELA_FATO, posicional=True), registros
+    )
+    return resultado.rowcount
 
-    print(f"\n📥 Processando: {csv_url.split('/')[-1]}")
 
-   
+@METRICAS.medir('fatos')
+def carregar_fatos_load_data(connection, fatos):
 
+    """
+    Grava as linhas da tabela fato em um TSV temporário e carrega com LOAD DATA LOCAL INFILE.
+    Linhas com chave_fato já gravada são ignoradas (contam como rejeitadas, com aviso de duplicata).
+    Retorna (linhas carregadas, linhas rejeitadas, lista de avisos do MySQL).
+    """
+
+    if fatos.empty:
+        return 0, 0, []
+
+    arquivo = tempfile.NamedTemporaryFile(mode='w', suffix='.tsv', delete=False, encoding='utf-8', newline='')
     try:
+        with arquivo:
+            fatos[COLUNAS_FATO].to_csv(
+                arquivo, sep='\t', header=False, index=False, na_rep='\\N', lineterminator='\n'
+            )
 
-        # Ler o CSV
+        # Mesma ordem das colunas do TSV: um campo a mais no arquivo seria descartado sem erro
+        sql_load = text(f"""
+            LOAD DATA LOCAL INFILE :arquivo
+            IGNORE INTO TABLE FATO_OCORRENCIA
+            CHARACTER SET utf8mb4
+            FIELDS TERMINATED BY '\\t'
+            LINES TERMINATED BY '\\n'
+            ({', '.join(COLUNAS_TABELA_FATO)})
+        """)
+        result = connection.execute(sql_load, {'arquivo': arquivo.name.replace('\\', '/')})
 
-        try:
+        carregadas = result.rowcount
+        total_avisos = connection.execute(text("SHOW COUNT(*) WARNINGS")).scalar() or 0
+        avisos = []
+        if total_avisos:
+            avisos = [
+                f"{nivel} {codigo}: {mensagem}"
+                for nivel, codigo, mensagem in connection.execute(
+                    text(f"SHOW WARNINGS LIMIT {MAX_AVISOS_LOAD_DATA}")
+                )
+            ]
+            if total_avisos > len(avisos):
+                avisos.append(f"... mais {total_avisos - len(avisos)} avisos")
 
-            df = pd.read_csv(
+        return carregadas, len(fatos) - carregadas, avisos
 
-                csv_url,
+    finally:
+        os.remove(arquivo.name)
 
-                sep=";",
 
-                encoding="utf-8",
+def ler_chunks_csv(origem, tamanho_chunk=TAMANHO_CHUNK, encoding=None):
 
-                low_memory=False,
+    """
+    Gerador que lê o CSV em chunks de tamanho_chunk linhas, só com as colunas de CSV_COLUMNS
+    e com os tipos compactos de TIPOS_LEITURA_CSV.
+    O arquivo é decodificado uma única vez com o encoding detectado (ver DetectorEncoding).
+    """
 
-                usecols=lambda col: col in CSV_COLUMNS
+    if encoding is None:
+        encoding = detectar_encoding(origem)
 
-            )
+    with pd.read_csv(
+        origem,
+        sep=";",
+        encoding=encoding,
+        usecols=lambda col: col in CSV_COLUMNS,
+        dtype=TIPOS_LEITURA_CSV,
+        chunksize=tamanho_chunk
+    ) as leitor:
+        yield from leitor
 
-        except UnicodeDecodeError:
 
-            df = pd.read_csv(
+def ler_chunks_arquivo(caminho, usar_staging, tamanho_chunk=TAMANHO_CHUNK, encoding=None):
 
-                csv_url,
+    """Chunks de um arquivo: do staging Parquet ou direto do CSV"""
 
-                sep=";",
+    if usar_staging:
+        return ler_chunks_staging(os.path.basename(caminho), tamanho_chunk)
+    return ler_chunks_csv(caminho, tamanho_chunk, encoding=encoding)
 
-                encoding="latin1",
 
-                low_memory=False,
+def carregar_chunk(connection, chunk, cache, modo_carga=MODO_CARGA, ocorrencias=None, arquivo_id=None):
 
-                usecols=lambda col: col in CSV_COLUMNS
+    """
+    Converte tipos, resolve as dimensões, grava a tabela fato de um chunk, soma o chunk nas
+    tabelas agregadas e incrementa a versão dos dados. Linhas com chave_fato já gravada
+    (filtro do cache) não são enviadas ao banco, e só as linhas que o banco aceitou são somadas
+    nos agregados. `ocorrencias` vem de calcular_chaves_fato e acompanha o arquivo inteiro;
+    `arquivo_id` (ver id_arquivo) é gravado em cada linha.
+    Retorna um dicionário com os contadores do chunk e as chaves de todas as suas linhas.
+    """
 
-            )
+    df = converter_tipos(chunk)
+    fatos, descartados = resolver_chaves_chunk(connection, df, cache)
+    fatos['chave_fato'] = calcular_chaves_fato(fatos, {} if ocorrencias is None else ocorrencias)
+    fatos['arquivo_id'] = arquivo_id
+    gravadas = cache.fatos_gravados(fatos['chave_fato'].to_numpy())
+    cache.fatos_ja_gravados += int(gravadas.sum())
+    novos = fatos[~gravadas]
+    resultado = {'inseridos': 0, 'erros': descartados, 'rejeitados': 0, 'ja_gravados': int(gravadas.sum()),
+                 'avisos': [], 'chaves': fatos['chave_fato'].to_numpy()}
+
+    if modo_carga == 'load_data':
+        carregadas, rejeitadas, avisos = carregar_fatos_load_data(connection, novos)
+        resultado.update(inseridos=carregadas, rejeitados=rejeitadas, avisos=avisos)
+    else:
+        resultado['inseridos'] = inserir_fatos(connection, novos)
+        # Chave gravada por outro processo depois que o filtro foi carregado
+        resultado['rejeitados'] = len(novos) - resultado['inseridos']
+    cache.registrar_chaves_fato(novos['chave_fato'].to_numpy())
+    if resultado['rejeitados']:
+        novos = novos[chaves_inseridas(connection, novos, arquivo_id)]
 
-        except ValueError:
+    # Por último na transação: as linhas das tabelas agregadas e da versão ficam travadas o mínimo possível
+    atualizar_agregados(connection, contar_agregados(df, novos))
+    if resultado['inseridos']:
+        incrementar_versao_dados(connection)
 
-            print(f"   ⚠️  Colunas não encontradas. Pulando arquivo.")
+    return resultado
 
-            return
 
-       
+def processar_csv_para_mysql(csv_url, engine, cache=None, modo_carga=MODO_CARGA, tamanho_chunk=TAMANHO_CHUNK,
+                             manifesto=None, encoding=None, usar_staging=False, chunks=None):
 
-        print(f"   📊 {len(df)} registros encontrados")
+    """
+    Lê CSV em chunks, converte tipos e carrega no MySQL
+    SEM fazer tratamento dos dados - apenas conversão de tipos
+    As chaves das dimensões são resolvidas pelo CacheDimensoes (criado aqui se não for passado)
+    e os fatos são gravados por chunk: executemany (modo 'insert') ou LOAD DATA LOCAL INFILE
+    (modo 'load_data'). Cada chunk é uma transação, então a memória fica limitada ao tamanho do chunk.
+    Se `manifesto` (linha do CARGA_MANIFESTO) for passado, o progresso é gravado no manifesto dentro
+    da transação de cada chunk. Um chunk desfeito por deadlock (workers gravando as mesmas chaves) é
+    refeito até TENTATIVAS_DEADLOCK vezes; outro erro interrompe o arquivo, e a próxima execução relê o
+    arquivo desde o início (a ordem das linhas repetidas entra na chave_fato) e as linhas já
+    confirmadas são puladas pelo filtro de chaves, sem ir ao banco.
+    Linhas que já estão no banco (mesma chave_fato) são puladas e, com o arquivo lido inteiro, as
+    linhas do mesmo arquivo (arquivo_id) que não estão mais nele são removidas no final.
+    Com usar_staging=True as linhas vêm do staging Parquet do arquivo (ver converter_para_staging).
+    `chunks` permite receber os chunks já lidos por outra etapa (ver processar_em_pipeline).
+    Retorna um dicionário com o resumo do arquivo (com as métricas por etapa em 'metricas').
+    """
 
-        print(f"   📋 Colunas: {list(df.columns)}")
+    nome_arquivo = csv_url.split('/')[-1]
+    print(f"\n📥 Processando: {nome_arquivo}")
+    inicio = time.perf_counter()
 
-        print(f"\n   Primeiros registros:")
+    if cache is None:
+        cache = CacheDimensoes()
+        with engine.connect() as connection:
+            cache.carregar(connection)
+
+    registros_inseridos = 0
+    registros_erro = 0
+    registros_rejeitados = 0
+    registros_ja_gravados = 0
+    registros_substituidos = 0
+    avisos_load_data = []
+    chunks_com_erro = 0
+    erro_arquivo = None
+    memoria_max_chunk = 0.0
+
+    # O arquivo é sempre lido desde o início: a ordem das linhas repetidas (calcular_chaves_fato)
+    # depende das linhas anteriores, e as chaves de todas as linhas mostram no final o que saiu dele
+    linhas_lidas = 0
+    ultimo_chunk = 0
+    if manifesto and manifesto['linhas_lidas']:
+        print(f"   ↪️  Retomando: as {manifesto['linhas_lidas']} linhas já confirmadas são relidas e puladas")
+    arquivo_id = id_arquivo(csv_url)
+    ocorrencias = {}
+    chaves_arquivo = []
 
-        print(df.head(3).to_string())
+    try:
+        with METRICAS.arquivo(csv_url), engine.connect() as connection:
+            if chunks is None:
+                chunks = METRICAS.medir_iterador(
+                    ler_chunks_arquivo(csv_url, usar_staging, tamanho_chunk, encoding=encoding), 'leitura'
+                )
+            for i, chunk in enumerate(chunks, 1):
+                # Memória do DataFrame do chunk (com os tipos compactos)
+                memoria_chunk = chunk.memory_usage(deep=True).sum() / 2 ** 20
+                memoria_max_chunk = max(memoria_max_chunk, memoria_chunk)
+                for tentativa in range(1, TENTATIVAS_DEADLOCK + 1):
+                    # Ordem das linhas repetidas no início do chunk, para refazê-lo depois de um deadlock
+                    vistas = dict(ocorrencias)
+                    transaction = connection.begin()
+                    try:
+                        resultado = carregar_chunk(connection, chunk, cache, modo_carga, ocorrencias, arquivo_id)
+                        if manifesto:
+                            # As linhas relidas numa retomada não são gravadas de novo, mas os erros são contados
+                            gravar_manifesto(
+                                connection, manifesto['url'], manifesto['sha256'],
+                                linhas_lidas + len(chunk),
+                                manifesto['linhas_inseridas'] + registros_inseridos + resultado['inseridos'],
+                                registros_erro + resultado['erros'],
+                                i, 'EM_ANDAMENTO'
+                            )
+                        with METRICAS.etapa('commit'):
+                            transaction.commit()
+                        break
+                    except Exception as e:
+                        transaction.rollback()
+                        # Ids criados nessa transação não existem mais no banco
+                        cache.recarregar(connection)
+                        # Fecha a transação aberta pela leitura, para o begin() da próxima tentativa
+                        connection.rollback()
+                        ocorrencias.clear()
+                        ocorrencias.update(vistas)
+                        if _e_deadlock(e) and tentativa < TENTATIVAS_DEADLOCK:
+                            METRICAS.contar('deadlocks')
+                            print(f"   🔁 Deadlock no chunk {i}, refazendo (tentativa {tentativa + 1}"
+                                  f"/{TENTATIVAS_DEADLOCK})")
+                            time.sleep(ESPERA_DEADLOCK * tentativa)
+                            continue
+                        chunks_com_erro += 1
+                        erro_arquivo = f"chunk {i}: {e}"
+                        print(f"   ❌ Erro no chunk {i}. Rollback realizado, a próxima execução retoma o arquivo: {e}")
+                        break
+                if chunks_com_erro:
+                    break
+
+                linhas_lidas += len(chunk)
+                ultimo_chunk = i
+                registros_inseridos += resultado['inseridos']
+                registros_erro += resultado['erros']
+                registros_rejeitados += resultado['rejeitados']
+                registros_ja_gravados += resultado['ja_gravados']
+                avisos_load_data.extend(resultado['avisos'])
+                chaves_arquivo.append(resultado['chaves'])
+                METRICAS.contar('chunks')
+                METRICAS.contar('linhas_lidas', len(chunk))
+                METRICAS.contar('inseridos', resultado['inseridos'])
+                METRICAS.contar('ja_gravados', resultado['ja_gravados'])
+                print(f"   ⏳ Chunk {i}: {registros_inseridos} registros processados... "
+                      f"({len(chunk)} linhas, {memoria_chunk:.1f} MB)")
+
+            if manifesto and not chunks_com_erro:
+                removidas = np.empty(0, dtype=np.int64)
+                with connection.begin():
+                    removidas = remover_fatos_substituidos(connection, arquivo_id, np.concatenate(
+                        chaves_arquivo + [np.empty(0, dtype=np.int64)]
+                    ))
+                    if len(removidas):
+                        incrementar_versao_dados(connection)
+                    gravar_manifesto(
+                        connection, manifesto['url'], manifesto['sha256'], linhas_lidas,
+                        manifesto['linhas_inseridas'] + registros_inseridos,
+                        registros_erro,
+                        ultimo_chunk, 'COMPLETO'
+                    )
+                cache.descartar_chaves_fato(removidas)
+                registros_substituidos = len(removidas)
 
-        print()
+    except Exception as e:
+        erro_arquivo = str(e)
+        print(f"   ❌ Erro ao processar CSV: {e}")
 
-       
+    print(f"   ✅ {registros_inseridos} registros inseridos com sucesso!")
+    if registros_erro > 0:
+        print(f"   ⚠️  {registros_erro} registros com erro (pulados)")
+    if registros_ja_gravados:
+        print(f"   ⏭️  {registros_ja_gravados} registros já estavam na FATO_OCORRENCIA (mesma chave_fato)")
+    if registros_substituidos:
+        print(f"   ♻️  {registros_substituidos} registros antigos removidos (linhas alteradas ou fora do arquivo)")
+    if chunks_com_erro:
+        print(f"   ⚠️  Carga interrompida no chunk com erro (arquivo fica EM_ANDAMENTO no manifesto)")
+    if modo_carga == 'load_data':
+        print(f"   📦 LOAD DATA: {registros_rejeitados} linhas rejeitadas, "
+              f"{len(avisos_load_data)} avisos")
+        for aviso in avisos_load_data[:MAX_AVISOS_LOAD_DATA]:
+            print(f"      • {aviso}")
+
+    segundos = time.perf_counter() - inicio
+    return {
+        'arquivo': nome_arquivo,
+        'inseridos': registros_inseridos,
+        'erros': registros_erro,
+        'rejeitados': registros_rejeitados,
+        'ja_gravados': registros_ja_gravados,
+        'substituidos': registros_substituidos,
+        'avisos': len(avisos_load_data),
+        'chunks_com_erro': chunks_com_erro,
+        'erro': erro_arquivo,
+        'segundos': round(segundos, 2),
+        'memoria_chunk_mb': round(memoria_max_chunk, 1),
+        'metricas': METRICAS.fechar_arquivo(csv_url, linhas_lidas, segundos),
+    }
+
+
+def _resumo_vazio(nome_arquivo, status, erro=None):
+    return {'arquivo': nome_arquivo, 'inseridos': 0, 'erros': 0, 'rejeitados': 0, 'ja_gravados': 0,
+            'substituidos': 0, 'avisos': 0,
+            'chunks_com_erro': 0, 'erro': erro, 'segundos': 0.0, 'memoria_chunk_mb': 0.0, 'status': status}
+
+
+def planejar_carga(url, engine, download, forcar=False, usar_staging=True, tamanho_chunk=TAMANHO_CHUNK):
 
-        # Conversão de tipos (sem limpeza/tratamento)
+    """
+    Decide o que fazer com um arquivo já baixado, consultando o CARGA_MANIFESTO: arquivos
+    COMPLETO com o mesmo hash são pulados e arquivos EM_ANDAMENTO são retomados (as linhas já
+    confirmadas são puladas pela chave_fato). Prepara o staging Parquet quando disponível.
+    Retorna {'resumo': ...} se o arquivo deve ser pulado, senão {'manifesto': ..., 'usar_staging': ...}.
+    """
 
-        # Apenas converter para os tipos esperados pelo banco
+    nome_arquivo = url.split('/')[-1]
+    with engine.connect() as connection:
+        anterior = ler_manifesto(connection, url)
 
-       
+    mesmo_conteudo = anterior is not None and anterior['sha256'] == download['sha256']
+    if mesmo_conteudo and anterior['status'] == 'COMPLETO' and not forcar:
+        print(f"\n⏭️  {nome_arquivo}: já carregado (sha256 {download['sha256'][:12]})")
+        resumo = _resumo_vazio(nome_arquivo, 'já carregado')
+        resumo['downloads'] = CONTADOR_DOWNLOADS[url]
+        return {'resumo': resumo}
 
-        # Converter OCORRENCIA_DATA para formato correto
+    if mesmo_conteudo and anterior['status'] == 'EM_ANDAMENTO' and not forcar:
+        manifesto = anterior
+    else:
+        if anterior is not None:
+            print(f"\n♻️  {nome_arquivo}: conteúdo mudou ou recarga forçada; só as linhas novas ou alteradas "
+                  f"são gravadas e as versões antigas, removidas")
+        manifesto = {'url': url, 'sha256': download['sha256'], 'linhas_lidas': 0, 'linhas_inseridas': 0,
+                     'linhas_erro': 0, 'ultimo_chunk': 0, 'status': 'EM_ANDAMENTO'}
 
-        if 'OCORRENCIA_DATA' in df.columns:
+    # O CSV é convertido para Parquet uma vez por conteúdo; as cargas seguintes leem o staging
+    usar_staging = usar_staging and staging_disponivel()
+    if usar_staging:
+        converter_para_staging(download['caminho'], download['sha256'], download['encoding'],
+                               tamanho_chunk=tamanho_chunk)
 
-            df['OCORRENCIA_DATA'] = pd.to_datetime(
+    return {'manifesto': manifesto, 'usar_staging': usar_staging}
 
-                df['OCORRENCIA_DATA'],
 
-                format='%d/%m/%Y',
+def _completar_resumo(resumo, url, download, manifesto):
+    resumo['status'] = 'baixado' if download['baixado'] else 'cache local'
+    resumo['encoding'] = download['encoding']
+    resumo['downloads'] = CONTADOR_DOWNLOADS[url]
+    if manifesto['linhas_lidas']:
+        resumo['status'] += ', retomado'
+    return resumo
 
-                errors='coerce'
 
-            ).dt.strftime('%Y-%m-%d')
+def processar_arquivo(url, engine, cache, modo_carga=MODO_CARGA, tamanho_chunk=TAMANHO_CHUNK, forcar=False,
+                      usar_staging=True, offline=False):
 
-       
+    """Baixa (ou reaproveita do cache local) e carrega um arquivo, seguindo o plano de planejar_carga"""
 
-        # Converter colunas numéricas
+    nome_arquivo = url.split('/')[-1]
+    try:
+        with METRICAS.arquivo(url):
+            download = baixar_csv(url, offline=offline)
+            plano = planejar_carga(url, engine, download, forcar, usar_staging, tamanho_chunk)
+    except (requests.exceptions.RequestException, FileNotFoundError) as e:
+        print(f"\n   ❌ Erro ao baixar {nome_arquivo}: {e}")
+        resumo = _resumo_vazio(nome_arquivo, 'erro no download', str(e))
+        resumo['metricas'] = METRICAS.fechar_arquivo(url, 0, 0.0)
+        return resumo
 
-        numeric_cols = ['NATUREZA1_CODIGO', 'ATENDIMENTO_NUMERO']
+    if 'resumo' in plano:
+        plano['resumo']['metricas'] = METRICAS.fechar_arquivo(url, 0, 0.0)
+        return plano['resumo']
 
-        for col in numeric_cols:
+    resumo = processar_csv_para_mysql(download['caminho'], engine, cache, modo_carga, tamanho_chunk,
+                                      plano['manifesto'], download['encoding'], plano['usar_staging'])
+    return _completar_resumo(resumo, url, download, plano['manifesto'])
 
-            if col in df.columns:
 
-                df[col] = pd.to_numeric(df[col], errors='coerce')
+# ============================================================
+# PROCESSAMENTO PARALELO (--workers)
+# ============================================================
 
-       
+# Lock compartilhado entre os processos do pool (definido no initializer)
+_LOCK_DIMENSOES = None
 
-        # Processar linha por linha - inserir no banco
 
-        registros_inseridos = 0
+def _inicializar_worker(lock):
+    global _LOCK_DIMENSOES
+    _LOCK_DIMENSOES = lock
 
-        registros_erro = 0
 
-       
+def _processar_arquivo_worker(csv_url, banco, modo_carga, tamanho_chunk, forcar, usar_staging,
+                              modo_chaves=MODO_CHAVES, offline=False):
+
+    """Executado em cada processo do pool: cria engine e cache próprios e carrega um arquivo"""
 
+    engine = banco.criar_engine()
+    METRICAS.observar(engine)
+    try:
+        cache = CacheDimensoes(lock=_LOCK_DIMENSOES, modo_chaves=modo_chaves)
         with engine.connect() as connection:
+            cache.carregar(connection)
+        resumo = processar_arquivo(csv_url, engine, cache, modo_carga, tamanho_chunk, forcar, usar_staging,
+                                   offline)
+        resumo['cache'] = cache.estatisticas()
+        return resumo
+    finally:
+        engine.dispose()
 
-            transaction = connection.begin()
 
-           
+def processar_em_paralelo(links, banco, workers, modo_carga, tamanho_chunk, forcar=False, usar_staging=True,
+                          modo_chaves=MODO_CHAVES, offline=False):
+
+    """
+    Distribui os arquivos entre `workers` processos. No modo 'auto_increment' a criação de chaves
+    nas dimensões é serializada por um lock entre os processos, então nenhum DIM_* é duplicado;
+    no modo 'hash' os ids são calculados em cada processo e nada é serializado.
+    """
 
+    lock = multiprocessing.Lock()
+    resultados = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_inicializar_worker, initargs=(lock,)) as pool:
+        futuros = {
+            pool.submit(_processar_arquivo_worker, url, banco, modo_carga, tamanho_chunk, forcar,
+                        usar_staging, modo_chaves, offline): url
+            for url in links
+        }
+        for futuro in as_completed(futuros):
+            url = futuros[futuro]
             try:
+                resultados.append(futuro.result())
+            except Exception as e:
+                resultados.append(_resumo_vazio(url.split('/')[-1], 'erro', str(e)))
+            # As métricas de cada worker entram nos totais deste processo e no relatório
+            METRICAS.registrar_arquivo(resultados[-1])
+    # Mantém a ordem original dos links no resumo
+    ordem = {url.split('/')[-1]: i for i, url in enumerate(links)}
+    return sorted(resultados, key=lambda r: ordem.get(r['arquivo'], 0))
 
-                for index, row in df.iterrows():
 
-                    try:
+# ============================================================
+# PIPELINE: DOWNLOAD -> LEITURA -> GRAVAÇÃO
+# ============================================================
 
-                        # Validar se data existe
+# Downloads em várias threads, leitura/conversão dos chunks em uma thread e gravação no banco
+# na thread principal. As filas limitadas seguram a memória: a etapa mais rápida espera a seguinte
+THREADS_DOWNLOAD = 4
+TAMANHO_FILA_DOWNLOADS = 2
+TAMANHO_FILA_CHUNKS = 4
+INTERVALO_RELATORIO_FILAS = 30
 
-                        data_completa = row.get('OCORRENCIA_DATA')
 
-                        if not data_completa or pd.isna(data_completa):
+class PipelineInterrompido(Exception):
 
-                            registros_erro += 1
+    """A gravação terminou (ou falhou) e as outras etapas devem parar"""
 
-                            continue
 
-                       
+class FilaMedida:
+
+    """
+    Fila limitada que registra a profundidade a cada operação, o tempo que quem produz ficou
+    bloqueado (fila cheia) e o tempo que quem consome ficou esperando (fila vazia).
+    Fila quase sempre cheia = a etapa seguinte é o gargalo; quase sempre vazia = a anterior.
+    """
+
+    def __init__(self, nome, tamanho, parar):
+        self.nome = nome
+        self.tamanho = tamanho
+        self.parar = parar
+        self._fila = queue.Queue(maxsize=tamanho)
+        self._trava = threading.Lock()
+        self.amostras = 0
+        self.soma_profundidade = 0
+        self.max_profundidade = 0
+        self.bloqueio_produtor = 0.0
+        self.espera_consumidor = 0.0
+
+    def _registrar(self, atributo, segundos):
+        profundidade = self._fila.qsize()
+        with self._trava:
+            setattr(self, atributo, getattr(self, atributo) + segundos)
+            self.amostras += 1
+            self.soma_profundidade += profundidade
+            self.max_profundidade = max(self.max_profundidade, profundidade)
+
+    def put(self, item):
+        inicio = time.perf_counter()
+        while True:
+            try:
+                self._fila.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                if self.parar.is_set():
+                    raise PipelineInterrompido()
+        self._registrar('bloqueio_produtor', time.perf_counter() - inicio)
+
+    def get(self):
+        inicio = time.perf_counter()
+        while True:
+            try:
+                item = self._fila.get(timeout=0.5)
+                break
+            except queue.Empty:
+                if self.parar.is_set():
+                    raise PipelineInterrompido()
+        self._registrar('espera_consumidor', time.perf_counter() - inicio)
+        return item
+
+    def profundidade(self):
+        return self._fila.qsize()
 
-                        # Buscar/criar dimensões
+    def estatisticas(self):
+        return {
+            'tamanho': self.tamanho,
+            'media': round(self.soma_profundidade / self.amostras, 2) if self.amostras else 0.0,
+            'maxima': self.max_profundidade,
+            'bloqueio_produtor_s': round(self.bloqueio_produtor, 2),
+            'espera_consumidor_s': round(self.espera_consumidor, 2),
+        }
 
-                        tempo_id = get_or_create_tempo(
 
-                            connection,
+def _etapa_download(urls, saida, offline=False):
 
-                            data_completa,
+    """Thread de download: baixa as URLs pendentes e entrega o resultado (ou o erro) para a leitura"""
 
-                            row.get('OCORRENCIA_ANO'),
+    try:
+        while True:
+            try:
+                url = urls.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                with METRICAS.arquivo(url):
+                    download = baixar_csv(url, offline=offline)
+                saida.put(('baixado', url, download))
+            except PipelineInterrompido:
+                raise
+            except Exception as e:
+                saida.put(('erro', url, str(e)))
+    except PipelineInterrompido:
+        pass
 
-                            row.get('OCORRENCIA_MES'),
 
-                            row.get('OCORRENCIA_DIA_SEMANA'),
+def _etapa_leitura(total, entrada, saida, engine, tamanho_chunk, forcar, usar_staging, cancelados):
 
-                            row.get('OCORRENCIA_PERIODO')
+    """
+    Thread de leitura: para cada arquivo baixado consulta o manifesto, prepara o staging e
+    entrega os chunks já convertidos, entre as marcas ('arquivo', ...) e ('fim', ...).
+    """
 
-                        )
+    try:
+        for _ in range(total):
+            tipo, url, download = entrada.get()
+            nome_arquivo = url.split('/')[-1]
+            if tipo == 'erro':
+                print(f"\n   ❌ Erro ao baixar {nome_arquivo}: {download}")
+                saida.put(('resumo', url, _resumo_vazio(nome_arquivo, 'erro no download', download)))
+                continue
 
-                       
+            try:
+                with METRICAS.arquivo(url):
+                    plano = planejar_carga(url, engine, download, forcar, usar_staging, tamanho_chunk)
+            except Exception as e:
+                saida.put(('resumo', url, _resumo_vazio(nome_arquivo, 'erro', str(e))))
+                continue
+            if 'resumo' in plano:
+                saida.put(('resumo', url, plano['resumo']))
+                continue
 
-                        natureza_id = get_or_create_natureza(
+            saida.put(('arquivo', url, (download, plano)))
+            try:
+                with METRICAS.arquivo(url):
+                    chunks = METRICAS.medir_iterador(ler_chunks_arquivo(
+                        download['caminho'], plano['usar_staging'], tamanho_chunk, encoding=download['encoding']
+                    ), 'leitura')
+                    for chunk in chunks:
+                        # A gravação desistiu do arquivo (chunk com erro): não adianta continuar lendo
+                        if url in cancelados:
+                            break
+                        saida.put(('chunk', url, converter_tipos(chunk)))
+            except PipelineInterrompido:
+                raise
+            except Exception as e:
+                saida.put(('falha', url, e))
+            saida.put(('fim', url, None))
+    except PipelineInterrompido:
+        pass
 
-                            connection,
 
-                            row.get('NATUREZA1_CODIGO'),
+def _chunks_da_fila(fila, estado):
 
-                            row.get('NATUREZA1_DESCRICAO'),
+    """Entrega para processar_csv_para_mysql os chunks de um arquivo que chegam pela fila"""
 
-                            row.get('NATUREZA2_DESCRICAO'),
+    while True:
+        tipo, _, dado = fila.get()
+        if tipo == 'chunk':
+            yield dado
+        elif tipo == 'falha':
+            raise dado
+        else:
+            estado['fim'] = True
+            return
 
-                            row.get('TIPO_ENVOLVIMENTO')
 
-                        )
+def _monitorar_filas(filas, parar):
+    while not parar.wait(INTERVALO_RELATORIO_FILAS):
+        print("   📊 Filas: " + ", ".join(f"{f.nome} {f.profundidade()}/{f.tamanho}" for f in filas))
 
-                       
 
-                        local_id = get_or_create_local(
+def processar_em_pipeline(links, engine, cache, modo_carga=MODO_CARGA, tamanho_chunk=TAMANHO_CHUNK, forcar=False,
+                          usar_staging=True, threads_download=THREADS_DOWNLOAD, offline=False):
 
-                            connection,
+    """
+    Carrega os arquivos em três etapas sobrepostas: downloads concorrentes, leitura/conversão
+    dos chunks e gravação no banco (nesta thread, com as mesmas transações por chunk e o mesmo
+    manifesto de processar_csv_para_mysql). Ao final imprime a profundidade das filas.
+    Com offline=True os "downloads" só reaproveitam as cópias já baixadas (--etapa carregar).
+    """
 
-                            row.get('ATENDIMENTO_BAIRRO_NOME'),
+    # A sessão HTTP é compartilhada pelas threads de download: criada antes de elas começarem
+    get_sessao()
+    parar = threading.Event()
+    cancelados = set()
+    urls = queue.Queue()
+    for url in links:
+        urls.put(url)
+    fila_downloads = FilaMedida('downloads', TAMANHO_FILA_DOWNLOADS, parar)
+    fila_chunks = FilaMedida('chunks', TAMANHO_FILA_CHUNKS, parar)
+
+    threads = [
+        threading.Thread(target=_etapa_download, args=(urls, fila_downloads, offline), daemon=True)
+        for _ in range(max(1, min(threads_download, len(links))))
+    ]
+    threads.append(threading.Thread(
+        target=_etapa_leitura, daemon=True,
+        args=(len(links), fila_downloads, fila_chunks, engine, tamanho_chunk, forcar, usar_staging, cancelados)
+    ))
+    threads.append(threading.Thread(target=_monitorar_filas, args=([fila_downloads, fila_chunks], parar),
+                                    daemon=True))
+    for thread in threads:
+        thread.start()
+
+    resultados = []
+    try:
+        for _ in range(len(links)):
+            tipo, url, dado = fila_chunks.get()
+            if tipo == 'resumo':
+                resultados.append(dado)
+                METRICAS.registrar_arquivo(dado)
+                continue
+
+            download, plano = dado
+            estado = {'fim': False}
+            resumo = processar_csv_para_mysql(
+                download['caminho'], engine, cache, modo_carga, tamanho_chunk, plano['manifesto'],
+                download['encoding'], plano['usar_staging'], chunks=_chunks_da_fila(fila_chunks, estado)
+            )
+            if not estado['fim']:
+                # Carga interrompida no meio do arquivo: descarta o que a leitura já tinha enfileirado
+                cancelados.add(url)
+                while fila_chunks.get()[0] != 'fim':
+                    pass
+            resultados.append(_completar_resumo(resumo, url, download, plano['manifesto']))
+            METRICAS.registrar_arquivo(resultados[-1])
+    finally:
+        parar.set()
+        for thread in threads:
+            thread.join()
+
+    imprimir_filas({f.nome: f.estatisticas() for f in (fila_downloads, fila_chunks)})
+    return resultados
+
+
+def imprimir_filas(estatisticas):
+    print("\n📊 Filas do pipeline:")
+    for nome, e in estatisticas.items():
+        print(f"   {nome:<10} profundidade média {e['media']:.1f}/{e['tamanho']} (máx. {e['maxima']}), "
+              f"produtores bloqueados {e['bloqueio_produtor_s']:.1f}s, "
+              f"consumidor esperando {e['espera_consumidor_s']:.1f}s")
+
+
+def imprimir_resumo(resultados):
+    print("\n📋 Resumo por arquivo:")
+    for r in resultados:
+        status = f"❌ {r['erro']}" if r['erro'] else "✅"
+        metricas = r.get('metricas') or {}
+        print(f"   {r['arquivo']} [{r.get('status', '')}]: {r['inseridos']:,} inseridos, {r['erros']:,} erros, "
+              f"{r['rejeitados']:,} rejeitados, {r.get('ja_gravados', 0):,} já gravados, "
+              f"{r.get('substituidos', 0):,} substituídos em {r['segundos']:.1f}s "
+              f"({metricas.get('linhas_por_segundo', 0):,.0f} linhas/s, {metricas.get('queries', 0):,} queries), "
+              f"{r.get('downloads', 0)} download(s), "
+              f"encoding {r.get('encoding', '-')}, chunk de até {r.get('memoria_chunk_mb', 0):.1f} MB {status}")
+    total = sum(r['inseridos'] for r in resultados)
+    print(f"   Total: {total:,} registros inseridos")
 
-                            row.get('ATENDIMENTO_REGIONAL_NOME'),
+# ============================================================
+# SELEÇÃO DE ARQUIVOS, ETAPAS E SIMULAÇÃO (--anos, --filtro, --arquivos, --etapa, --dry-run)
+# ============================================================
 
-                            row.get('ATENDIMENTO_LOGRADOURO_NOME'),
+# 'tudo' = baixar + transformar + carregar; as demais rodam só a etapa (baixar e transformar
+# não abrem conexão com o banco)
+ETAPAS_CARGA = ('tudo', 'baixar', 'transformar', 'carregar')
 
-                            row.get('CLASSIFICACAO_BAIRRO_REGIONAL')
+# Bytes lidos do início de um arquivo remoto para estimar o tamanho médio da linha (--dry-run)
+TAMANHO_AMOSTRA_ESTIMATIVA = 1024 * 1024
 
-                        )
+# Ano no nome dos arquivos (ex.: 2019-03-01_sigesguarda_-_base_de_dados.csv)
+PADRAO_ANO_ARQUIVO = re.compile(r'(?<!\d)((?:19|20)\d{2})(?!\d)')
 
-                       
 
-                        hora_id = get_or_create_hora(
+def faixa_anos(valor):
 
-                            connection,
+    """'2019' -> (2019, 2019), '2019-2021' -> (2019, 2021), '2019-' e '-2021' deixam a ponta aberta"""
 
-                            row.get('OCORRENCIA_HORA')
+    inicio, separador, fim = valor.partition('-')
+    try:
+        inicio = int(inicio) if inicio else None
+        fim = int(fim) if fim else (None if separador else inicio)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"faixa de anos inválida: '{valor}' (use 2019, 2019-2021 ou 2019-)")
+    if inicio is not None and fim is not None and inicio > fim:
+        raise argparse.ArgumentTypeError(f"faixa de anos invertida: '{valor}'")
+    return inicio, fim
 
-                        )
 
-                       
+def ano_do_arquivo(origem):
 
-                        # Inserir na tabela fato
+    """Ano no nome do arquivo (URL ou caminho) ou None"""
 
-                        sql_fato = text("""
+    encontrado = PADRAO_ANO_ARQUIVO.search(unquote(origem.replace('\\', '/').split('/')[-1]))
+    return int(encontrado.group(1)) if encontrado else None
 
-                            INSERT INTO FATO_OCORRENCIA
 
-                            (tempo_id, natureza_id, local_id, hora_id, atendimento_numero)
+def listar_arquivos_locais(padroes):
 
-                            VALUES (:tempo_id, :natureza_id, :local_id, :hora_id, :atendimento)
+    """Caminhos locais (aceita curingas, ex.: 'dados/*.csv'), na ordem dos nomes e sem repetição"""
 
-                        """)
+    caminhos = []
+    for padrao in padroes:
+        encontrados = sorted(glob.glob(padrao)) or ([padrao] if os.path.exists(padrao) else [])
+        if not encontrados:
+            print(f"⚠️  Nenhum arquivo local corresponde a '{padrao}'")
+        caminhos.extend(c for c in encontrados if c not in caminhos)
+    return caminhos
 
-                       
 
-                        connection.execute(sql_fato, {
+def filtrar_arquivos(links, anos=None, filtros=None):
 
-                            'tempo_id': tempo_id,
+    """
+    Mantém os links cujo ano (do nome do arquivo) está na faixa `anos` e cuja URL ou nome casa com
+    pelo menos uma das expressões regulares de `filtros`. Com faixa de anos, arquivos sem ano no
+    nome ficam de fora.
+    """
 
-                            'natureza_id': natureza_id,
+    inicio, fim = anos or (None, None)
+    expressoes = [re.compile(f, re.IGNORECASE) for f in filtros or []]
+    selecionados = []
+    for url in links:
+        ano = ano_do_arquivo(url)
+        if (inicio is not None or fim is not None) and ano is None:
+            continue
+        if (inicio is not None and ano < inicio) or (fim is not None and ano > fim):
+            continue
+        if expressoes and not any(e.search(url) or e.search(unquote(url)) for e in expressoes):
+            continue
+        selecionados.append(url)
+    return selecionados
 
-                            'local_id': local_id,
 
-                            'hora_id': hora_id,
+def executar_etapa(links, etapa, threads_download=THREADS_DOWNLOAD, tamanho_chunk=TAMANHO_CHUNK):
 
-                            'atendimento': row.get('ATENDIMENTO_NUMERO')
+    """
+    Roda só uma etapa anterior à carga, sem banco:
+    'baixar'      -> garante a cópia local de cada arquivo (downloads concorrentes, GET condicional)
+    'transformar' -> converte as cópias já baixadas para o staging Parquet, sem ir à rede
+    Retorna um resumo por arquivo, no formato de imprimir_resumo.
+    """
 
-                        })
+    def executar(url):
+        nome_arquivo = url.split('/')[-1]
+        inicio = time.perf_counter()
+        linhas = 0
+        try:
+            with METRICAS.arquivo(url):
+                download = baixar_csv(url, offline=etapa == 'transformar')
+                if etapa == 'transformar':
+                    linhas = converter_para_staging(download['caminho'], download['sha256'], download['encoding'],
+                                                    tamanho_chunk=tamanho_chunk)
+            status = 'baixado' if download['baixado'] else 'cache local'
+            resumo = _resumo_vazio(nome_arquivo, f"staging, {linhas:,} linhas" if etapa == 'transformar' else status)
+            resumo['encoding'] = download['encoding']
+        except (requests.exceptions.RequestException, FileNotFoundError) as e:
+            print(f"\n   ❌ {nome_arquivo}: {e}")
+            resumo = _resumo_vazio(nome_arquivo, 'erro no download', str(e))
+        resumo['segundos'] = time.perf_counter() - inicio
+        resumo['downloads'] = CONTADOR_DOWNLOADS[url]
+        resumo['metricas'] = METRICAS.fechar_arquivo(url, linhas, resumo['segundos'])
+        return resumo
+
+    get_sessao()
+    # A conversão usa CPU e memória: um arquivo por vez
+    threads = max(1, min(threads_download, len(links))) if etapa == 'baixar' else 1
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        resultados = list(pool.map(executar, links))
+    for resumo in resultados:
+        METRICAS.registrar_arquivo(resumo)
+    return resultados
+
+
+def contar_linhas_csv(caminho):
+
+    """Linhas de dados de um CSV local (quebras de linha menos o cabeçalho), lendo em blocos"""
+
+    quebras, ultimo = 0, b'\n'
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(TAMANHO_BLOCO_DOWNLOAD), b''):
+            quebras += bloco.count(b'\n')
+            ultimo = bloco[-1:]
+    # A última linha pode não terminar com quebra
+    return max(0, quebras + (ultimo != b'\n') - 1)
+
+
+def estimar_linhas_remotas(url):
 
-                       
+    """
+    Estima as linhas de um CSV remoto sem baixá-lo: lê só os primeiros TAMANHO_AMOSTRA_ESTIMATIVA
+    bytes (Range) e divide o tamanho total pelo tamanho médio das linhas da amostra.
+    Retorna (linhas, tamanho em bytes); (None, None) se o servidor não informa o tamanho.
+    """
 
-                        registros_inseridos += 1
+    cabecalhos = {'Range': f'bytes=0-{TAMANHO_AMOSTRA_ESTIMATIVA - 1}'}
+    with get_sessao().get(url, headers=cabecalhos, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        if response.status_code == 206:
+            tamanho = response.headers.get('Content-Range', '').rpartition('/')[2]
+        else:
+            # Servidor sem suporte a Range: lê só o começo do corpo e fecha a conexão
+            tamanho = response.headers.get('Content-Length', '')
+        amostra = b''
+        for bloco in response.iter_content(TAMANHO_BLOCO_DOWNLOAD):
+            amostra += bloco
+            if len(amostra) >= TAMANHO_AMOSTRA_ESTIMATIVA:
+                break
+    if not tamanho.isdigit():
+        return None, None
+    tamanho = int(tamanho)
+    amostra = amostra[:TAMANHO_AMOSTRA_ESTIMATIVA]
+    fim_cabecalho = amostra.find(b'\n') + 1
+    corpo = amostra[fim_cabecalho:amostra.rfind(b'\n') + 1]
+    if not fim_cabecalho or not corpo:
+        return 0, tamanho
+    if len(amostra) >= tamanho:
+        return corpo.count(b'\n') + (not amostra.endswith(b'\n')), tamanho
+    return round((tamanho - fim_cabecalho) * corpo.count(b'\n') / len(corpo)), tamanho
+
+
+def estimar_carga(links, engine=None, forcar=False):
 
-                       
+    """
+    --dry-run: quantas linhas cada arquivo tem e quantas seriam carregadas, sem baixar nem gravar.
+    A contagem vem do staging (exata), da cópia local (quebras de linha) ou de uma amostra do arquivo
+    remoto (estimativa). Com `engine`, o CARGA_MANIFESTO diz o que já foi carregado ou será retomado;
+    o manifesto só é comparado pelo sha256 quando há cópia local.
+    """
 
-                        if registros_inseridos % 1000 == 0:
+    manifestos = {}
+    if engine is not None:
+        try:
+            with engine.connect() as connection:
+                manifestos = {url: ler_manifesto(connection, url) for url in links}
+        except Exception as e:
+            print(f"⚠️  Manifesto indisponível ({e.__class__.__name__}): estimando sem ele")
+
+    estimativas = []
+    for url in links:
+        nome = unquote(url.split('/')[-1])
+        local = url if os.path.exists(url) else caminho_download(url)
+        estimativa = {'arquivo': nome, 'ano': ano_do_arquivo(url), 'origem': 'local', 'bytes': None,
+                      'linhas': None, 'exato': False, 'manifesto': '-', 'a_carregar': None, 'erro': None}
+        sha256 = None
+        try:
+            if os.path.exists(local):
+                estimativa['bytes'] = os.path.getsize(local)
+                sha256 = ler_metadados(local).get('sha256') if local != url else None
+                controle = _caminho_controle_staging(os.path.basename(local))
+                info = {}
+                if sha256 and os.path.exists(controle):
+                    with open(controle, encoding='utf-8') as f:
+                        info = json.load(f)
+                if info.get('sha256') == sha256 and 'linhas' in info:
+                    estimativa.update(origem='staging', linhas=info['linhas'], exato=True)
+                else:
+                    estimativa.update(linhas=contar_linhas_csv(local), exato=True)
+            else:
+                linhas, tamanho = estimar_linhas_remotas(url)
+                estimativa.update(origem='remoto', linhas=linhas, bytes=tamanho)
+        except (requests.exceptions.RequestException, OSError, json.JSONDecodeError) as e:
+            estimativa['erro'] = str(e)
+
+        linhas = estimativa['linhas']
+        anterior = manifestos.get(url)
+        if anterior is None or forcar:
+            estimativa['a_carregar'] = linhas
+        elif sha256 and anterior['sha256'] != sha256:
+            estimativa.update(manifesto='conteúdo mudou', a_carregar=linhas)
+        elif anterior['status'] == 'COMPLETO':
+            estimativa.update(manifesto='COMPLETO', a_carregar=0)
+        else:
+            # A retomada relê o arquivo inteiro; só as linhas já confirmadas deixam de ir ao banco
+            estimativa.update(manifesto=f"retomar: relê tudo, pula {anterior['linhas_lidas']:,} já confirmadas",
+                              a_carregar=linhas)
+        estimativas.append(estimativa)
+    return estimativas
+
+
+def imprimir_estimativa(estimativas):
+    print("\n🔎 Simulação (--dry-run): nada foi baixado nem gravado")
+    print(f"   {'arquivo':<45}{'ano':>6}  {'origem':<8}{'MB':>9}{'linhas':>13}{'a carregar':>13}  manifesto")
+    for e in estimativas:
+        linhas = '?' if e['linhas'] is None else f"{'' if e['exato'] else '~'}{e['linhas']:,}"
+        a_carregar = '?' if e['a_carregar'] is None else f"{'' if e['exato'] else '~'}{e['a_carregar']:,}"
+        megabytes = '?' if e['bytes'] is None else f"{e['bytes'] / 2 ** 20:.1f}"
+        situacao = f"❌ {e['erro']}" if e['erro'] else e['manifesto']
+        print(f"   {e['arquivo'][:44]:<45}{e['ano'] or '-':>6}  {e['origem']:<8}{megabytes:>9}{linhas:>13}"
+              f"{a_carregar:>13}  {situacao}")
+    total = sum(e['a_carregar'] or 0 for e in estimativas)
+    print(f"   Total: {len(estimativas)} arquivo(s), ~{total:,} linhas a carregar (~ = estimativa por amostra)")
 
-                            print(f"   ⏳ {registros_inseridos} registros processados...")
 
-                       
+# ============================================================
+# PERFIL DE UMA CARGA (--profile)
+# ============================================================
 
-                    except Exception as e_row:
+# Um arquivo carregado na thread principal (sem pipeline: o cProfile só enxerga a thread
+# em que foi ligado) sob cProfile e tracemalloc
+DIRETORIO_PERFIL = os.path.join('data', 'profile')
+PERFIL_TOP_FUNCOES = 40
+PERFIL_TOP_ALOCACOES = 25
+# Profundidade das pilhas guardadas pelo tracemalloc (mais frames = mais lento)
+PERFIL_FRAMES_ALOCACAO = 5
+# A memória é amostrada nesse intervalo; um snapshot novo é tirado quando ela passa
+# PERFIL_CRESCIMENTO_SNAPSHOT x o maior valor já registrado
+PERFIL_INTERVALO_MEMORIA = 0.5
+PERFIL_CRESCIMENTO_SNAPSHOT = 1.1
 
-                        registros_erro += 1
+FILTROS_TRACEMALLOC = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+)
 
-                        if registros_erro < 5:
 
-                            print(f"   ⚠️  Erro na linha {index}: {e_row}")
+def selecionar_arquivo_perfil(selecao, links):
 
-               
+    """Caminho local existente ou o primeiro link cujo nome contém `selecao` (ex.: '2019')"""
 
-                transaction.commit()
+    if os.path.exists(selecao):
+        return selecao
+    candidatos = [url for url in links if selecao in unquote(url.split('/')[-1])]
+    if not candidatos:
+        raise ValueError(f"nenhum arquivo corresponde a '{selecao}'")
+    if len(candidatos) > 1:
+        print(f"⚠️  {len(candidatos)} arquivos correspondem a '{selecao}'; usando {candidatos[0].split('/')[-1]}")
+    return candidatos[0]
 
-                print(f"   ✅ {registros_inseridos} registros inseridos com sucesso!")
 
-                if registros_erro > 0:
+def _amostrar_memoria(estado, parar):
 
-                    print(f"   ⚠️  {registros_erro} registros com erro (pulados)")
+    """Guarda o snapshot do tracemalloc perto do pico de memória da carga"""
 
-               
+    while not parar.wait(PERFIL_INTERVALO_MEMORIA):
+        atual, _ = tracemalloc.get_traced_memory()
+        if atual > estado['memoria'] * PERFIL_CRESCIMENTO_SNAPSHOT:
+            estado.update(memoria=atual, snapshot=tracemalloc.take_snapshot())
 
-            except Exception as e:
 
-                transaction.rollback()
+def _linhas_alocacoes(estatisticas, limite):
+    linhas = []
+    for estatistica in estatisticas[:limite]:
+        frame = estatistica.traceback[0]
+        tamanho = getattr(estatistica, 'size_diff', estatistica.size)
+        linhas.append(f"{tamanho / 2 ** 20:>10.2f} MB {estatistica.count:>10} blocos  "
+                      f"{frame.filename}:{frame.lineno}")
+    return linhas
 
-                print(f"   ❌ Erro fatal. Rollback realizado: {e}")
 
-               
+def perfilar_carga(url, engine, cache, modo_carga=MODO_CARGA, tamanho_chunk=TAMANHO_CHUNK, forcar=False,
+                   usar_staging=True, diretorio=DIRETORIO_PERFIL, offline=False):
 
-    except Exception as e:
+    """
+    Carrega um arquivo com processar_arquivo sob cProfile e tracemalloc e grava em `diretorio`:
+    <arquivo>-<data>.prof (abrir com snakeviz) e <arquivo>-<data>.txt (funções mais caras por
+    tempo acumulado e próprio, alocações no pico de memória e memória retida ao final).
+    Retorna o resumo do arquivo.
+    """
 
-        print(f"   ❌ Erro ao processar CSV: {e}")
+    nome = unquote(url.split('/')[-1])
+    os.makedirs(diretorio, exist_ok=True)
+    base = os.path.join(diretorio, f"{os.path.splitext(nome)[0]}-{datetime.now():%Y%m%d-%H%M%S}")
+    print(f"\n🔬 Perfil da carga de {nome} (cProfile + tracemalloc, bem mais lento que a carga normal)")
+
+    tracemalloc.start(PERFIL_FRAMES_ALOCACAO)
+    inicial = tracemalloc.take_snapshot()
+    estado = {'memoria': tracemalloc.get_traced_memory()[0], 'snapshot': inicial}
+    parar = threading.Event()
+    amostrador = threading.Thread(target=_amostrar_memoria, args=(estado, parar), daemon=True)
+    amostrador.start()
+    perfil = cProfile.Profile()
+    perfil.enable()
+    try:
+        resumo = processar_arquivo(url, engine, cache, modo_carga, tamanho_chunk, forcar, usar_staging, offline)
+    finally:
+        perfil.disable()
+        parar.set()
+        amostrador.join()
+        final = tracemalloc.take_snapshot()
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    if resumo.get('status') == 'já carregado':
+        print("⚠️  O arquivo já estava carregado e foi pulado: use --forcar para medir a carga")
+
+    perfil.dump_stats(base + '.prof')
+    no_pico = estado['snapshot'].filter_traces(FILTROS_TRACEMALLOC).statistics('lineno')
+    retida = final.filter_traces(FILTROS_TRACEMALLOC).compare_to(inicial.filter_traces(FILTROS_TRACEMALLOC),
+                                                                 'lineno')
+    with open(base + '.txt', 'w', encoding='utf-8') as f:
+        f.write(f"Perfil da carga de {nome} em {datetime.now():%Y-%m-%d %H:%M:%S}\n")
+        f.write(f"{resumo['inseridos']:,} inseridos em {resumo['segundos']:.1f}s (com o profiler), "
+                f"pico de memória rastreada {pico / 2 ** 20:.1f} MB\n")
+        for ordem, titulo in (('cumulative', 'TEMPO ACUMULADO'), ('tottime', 'TEMPO PRÓPRIO')):
+            f.write(f"\n{'=' * 70}\nFUNÇÕES POR {titulo}\n{'=' * 70}\n")
+            pstats.Stats(perfil, stream=f).strip_dirs().sort_stats(ordem).print_stats(PERFIL_TOP_FUNCOES)
+        f.write(f"\n{'=' * 70}\nALOCAÇÕES NO PICO ({estado['memoria'] / 2 ** 20:.1f} MB)\n{'=' * 70}\n")
+        f.write('\n'.join(_linhas_alocacoes(no_pico, PERFIL_TOP_ALOCACOES)) + '\n')
+        f.write(f"\n{'=' * 70}\nMEMÓRIA RETIDA AO FINAL (crescimento desde o início)\n{'=' * 70}\n")
+        f.write('\n'.join(_linhas_alocacoes(retida, PERFIL_TOP_ALOCACOES)) + '\n')
+
+    print("\n🔥 Funções mais caras (tempo próprio):")
+    for (arquivo, linha, funcao), (_, chamadas, proprio, acumulado, _) in sorted(
+            pstats.Stats(perfil).stats.items(), key=lambda item: item[1][2], reverse=True)[:15]:
+        print(f"   {proprio:>8.2f}s próprio {acumulado:>8.2f}s acumulado {chamadas:>10} chamadas  "
+              f"{funcao} ({os.path.basename(arquivo)}:{linha})")
+    print(f"\n🧠 Alocações no pico ({estado['memoria'] / 2 ** 20:.1f} MB; pico rastreado {pico / 2 ** 20:.1f} MB):")
+    for linha in _linhas_alocacoes(no_pico, 10):
+        print(f"   {linha}")
+    print(f"\n💾 Perfil salvo em {base}.prof (snakeviz {base}.prof) e relatório em {base}.txt")
+    return resumo
 
 ###########################################################################
 # FUNÇÃO PRINCIPAL
 ###########################################################################
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Coleta e carga dos CSVs do Sigesguarda no MySQL ou no SQLite")
+    parser.add_argument('--banco', choices=sorted(BANCOS), default='mysql',
+                        help="Banco de destino: MySQL (DB_CONFIG) ou um arquivo SQLite com o mesmo modelo estrela")
+    parser.add_argument('--sqlite', default=ARQUIVO_SQLITE, metavar='ARQUIVO',
+                        help="Arquivo do banco com --banco sqlite (criado se não existir)")
+    selecao = parser.add_argument_group("seleção de arquivos e etapas")
+    selecao.add_argument('--anos', type=faixa_anos, metavar='FAIXA',
+                         help="Só os arquivos com ano (no nome) na faixa: 2019, 2019-2021, 2019- ou -2021")
+    selecao.add_argument('--filtro', action='append', metavar='REGEX',
+                         help="Só os arquivos cuja URL ou nome casa com a expressão (pode repetir: basta casar "
+                              "com uma)")
+    selecao.add_argument('--arquivos', nargs='+', metavar='CAMINHO',
+                         help="CSVs locais (aceita curingas) em vez dos links do portal")
+    selecao.add_argument('--etapa', choices=ETAPAS_CARGA, default='tudo',
+                         help="baixar: só atualiza data/raw; transformar: só gera o staging Parquet a partir "
+                              "de data/raw (sem rede); carregar: grava no banco a partir de data/raw e do "
+                              "staging, sem rede")
+    selecao.add_argument('--dry-run', action='store_true',
+                         help="Lista os arquivos selecionados e estima as linhas a carregar, sem baixar nem gravar")
+    parser.add_argument('--modo-carga', choices=MODOS_CARGA, default=MODO_CARGA,
+                        help="Como gravar a FATO_OCORRENCIA: INSERT em lote ou LOAD DATA LOCAL INFILE")
+    parser.add_argument('--chunk-size', type=int, default=TAMANHO_CHUNK,
+                        help="Linhas lidas e gravadas por transação (controla o pico de memória)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Quantidade de processos para processar os arquivos em paralelo")
+    parser.add_argument('--downloads', type=int, default=THREADS_DOWNLOAD,
+                        help="Downloads simultâneos no pipeline (sem --workers): baixa os próximos arquivos "
+                             "enquanto o atual é gravado")
+    parser.add_argument('--sem-staging', action='store_true',
+                        help="Lê direto do CSV em vez do staging Parquet em data/processed/parquet")
+    parser.add_argument('--chaves', choices=MODOS_CHAVES, default=MODO_CHAVES,
+                        help="Ids das dimensões: AUTO_INCREMENT ou derivados da chave natural (hash, "
+                             "sem idas ao banco; use num banco vazio, sem misturar os modos)")
+    parser.add_argument('--bulk', action='store_true',
+                        help="Carga em massa: desliga foreign_key_checks (no SQLite, synchronous e "
+                             "foreign_keys), remove FKs e índices secundários da FATO_OCORRENCIA e recria/valida "
+                             "tudo no final")
+    parser.add_argument('--recalcular-agregados', action='store_true',
+                        help="Reconstrói as tabelas agregadas (AGG_*) a partir da FATO_OCORRENCIA ao final")
+    parser.add_argument('--forcar', action='store_true',
+                        help="Relê os arquivos do zero mesmo que o manifesto diga que já foram carregados "
+                             "(só as linhas novas ou alteradas são gravadas)")
+    parser.add_argument('--metricas', default=ARQUIVO_RELATORIO,
+                        help="Arquivo JSON lines com o tempo por etapa de cada arquivo e da execução")
+    parser.add_argument('--profile', metavar='ARQUIVO',
+                        help="Carrega só um arquivo (caminho local ou parte do nome, ex.: 2019) sob cProfile e "
+                             "tracemalloc e grava o perfil em data/profile")
+    parser.add_argument('--profile-saida', default=DIRETORIO_PERFIL,
+                        help="Diretório do .prof e do relatório do --profile")
+    parser.add_argument('--metricas-porta', type=int,
+                        help="Serve o snapshot das métricas em http://127.0.0.1:<porta>/metricas durante a carga")
+    return parser.parse_args(argv)
+
+
+def criar_banco(args):
+
+    """Banco de destino escolhido na linha de comando (ver bancos_etl.py)"""
+
+    if args.banco == 'sqlite':
+        return BancoSQLite(args.sqlite, bulk=args.bulk)
+    return BancoMySQL(DB_CONFIG, bulk=args.bulk, local_infile=args.modo_carga == 'load_data')
+
+
+def main(argv=None):
+    args = parse_args(argv)
     print("# SISTEMA DE COLETA E CARGA - CRIMES CURITIBA")
+    METRICAS.iniciar_execucao(args.metricas)
+    if args.metricas_porta:
+        servir_http(args.metricas_porta)
+    ##############################################################
+    # 1. SELECIONAR OS ARQUIVOS (portal ou locais, filtrados)
+    ##############################################################
+    # --profile com um arquivo local não precisa dos links do portal
+    if args.profile and os.path.exists(args.profile):
+        todos_links = [args.profile]
+    else:
+        if args.arquivos:
+            todos_links = listar_arquivos_locais(args.arquivos)
+        else:
+            print("\nBuscando links dos arquivos CSV...")
+            # pegamos os links dos CSVs antigos (2016-2024)
+            links_antigos = get_csv_links_antigos()
+            # os dados de 2025 até o momento não foram encontrados = modificar esta função uma outra hora
+            #links_2025 = get_csv_links_2025()
+            links_2025 = []
+
+            # Combine todos os links em uma única lista
+            todos_links = links_antigos + links_2025
+
+        # Se nenhum link encontrado, encerrar
+        if not todos_links:
+            print("\n  Nenhum CSV encontrado. Verifique sua conexão com a internet.")
+            return
+
+        encontrados = len(todos_links)
+        todos_links = filtrar_arquivos(todos_links, args.anos, args.filtro)
+        if len(todos_links) < encontrados:
+            print(f"\n{len(todos_links)} de {encontrados} arquivos selecionados (--anos/--filtro)")
+        if not todos_links:
+            print("\n  Nenhum arquivo corresponde à seleção.")
+            return
+
+        # Todos os links selecionados
+        for i in todos_links:
+            print(i)
+
+        if args.profile:
+            try:
+                todos_links = [selecionar_arquivo_perfil(args.profile, todos_links)]
+            except ValueError as e:
+                print(f"\n❌ --profile: {e}")
+                sys.exit(1)
+
+    banco = criar_banco(args)
+    if args.modo_carga not in banco.modos_carga:
+        print(f"\n❌ --modo-carga {args.modo_carga} não é suportado no {banco.nome} "
+              f"(use {', '.join(banco.modos_carga)})")
+        sys.exit(1)
+    if args.workers > 1 and not banco.escritores_concorrentes:
+        print(f"⚠️  O {banco.nome} aceita um escritor por vez: --workers ignorado, carga pelo pipeline")
+        args.workers = 1
+
+    ##############################################################
+    # 2. SIMULAÇÃO E ETAPAS SEM BANCO (--dry-run, --etapa baixar/transformar)
+    ##############################################################
+    if args.dry_run:
+        # O banco é opcional aqui: só o manifesto é lido (um SQLite que ainda não existe não é criado)
+        try:
+            engine = banco.criar_engine() if banco.existe() else None
+        except Exception as e:
+            print(f"⚠️  Sem conexão com o banco ({e}): estimando sem o manifesto")
+            engine = None
+        imprimir_estimativa(estimar_carga(todos_links, engine, args.forcar))
+        return
+
+    if args.etapa in ('baixar', 'transformar'):
+        if args.etapa == 'transformar' and not staging_disponivel():
+            print("\n❌ --etapa transformar precisa do pyarrow (pip install pyarrow)")
+            sys.exit(1)
+        print(f"\nExecutando só a etapa '{args.etapa}' em {len(todos_links)} arquivo(s)...")
+        inicio = time.perf_counter()
+        imprimir_resumo(executar_etapa(todos_links, args.etapa, args.downloads, args.chunk_size))
+        imprimir_etapas(METRICAS.finalizar_execucao())
+        print(f"⏱️  Tempo total: {(time.perf_counter() - inicio) / 60:.2f} minutos")
+        return
+
     ###############################################################
-    # 1. CRIAR CONEXÃO COM MYSQL
+    # 3. CRIAR CONEXÃO COM O BANCO (MySQL ou SQLite)
     ##############################################################
     try:
-        connection_string = (
-            f"mysql+pymysql://{DB_CONFIG['user']}:{DB_CONFIG['password']}"
-            f"@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
-            f"?charset=utf8mb4"
-        )     
-
-        engine = create_engine(connection_string, pool_pre_ping=True)      
+        engine = banco.criar_engine()
+        METRICAS.observar(engine)
         # Testar conexão
         with engine.connect() as conn:
             conn.execute(text("SELECT 1"))
 
-        print("Conexão com o Banco de Dados MySQL estabelecida!")
+        print(f"Conexão com o banco {banco.descricao()} estabelecida!")
+
+        # No SQLite o modelo estrela é criado aqui (no MySQL vem do setup_database.sql)
+        banco.criar_esquema(engine)
+        garantir_tabela_manifesto(engine)
+        garantir_chave_fato(engine)
+        # Calendário e relógio completos (DIM_TEMPO/DIM_HORA) antes da carga
+        preparar_dimensoes_fixas(engine)
+
+        # Carrega as dimensões em memória uma única vez por execução
+        cache = CacheDimensoes(modo_chaves=args.chaves)
+        with engine.connect() as conn:
+            cache.carregar(conn)
+        print(f"Cache de dimensões carregado: {len(cache.tempo)} datas, {len(cache.natureza)} naturezas, "
+              f"{len(cache.local)} locais, {len(cache.hora)} horários, {len(cache.chaves_fato)} chaves da fato")
 
     except Exception as e:
-        print(f"\nERRO DE CONEXÃO COM MYSQL:")
+        print(f"\nERRO DE CONEXÃO COM {banco.descricao()}:")
         print(f"   {e}\n")
+        if banco.nome != 'mysql':
+            sys.exit(1)
         print("\nVerifique:")
         print("   1. MySQL está rodando?")
         print("   2. Usuário e senha estão corretos?")
         print("   3. Banco 'crimes_curitiba' foi criado? (Execute setup_database.sql)")
         sys.exit(1)
 
-    ##############################################################
-    # 2. BUSCAR LINKS DOS CSVS
-    ##############################################################
-    print("\nBuscando links dos arquivos CSV...")
-    # pegamos os links dos CSVs antigos (2016-2024)
-    links_antigos = get_csv_links_antigos()
-    # os dados de 2025 até o momento não foram encontrados = modificar esta função uma outra hora
-    #links_2025 = get_csv_links_2025()
-    links_2025 = []
-
-    # Combine todos os links em uma única lista
-    todos_links = links_antigos + links_2025
-   
-    # Se nenhum link encontrado, encerrar
-    if not todos_links:
-        print("\n  Nenhum CSV encontrado. Verifique sua conexão com a internet.")
-        return
+    # --etapa carregar: nada vai à rede, só as cópias já baixadas em data/raw são usadas
+    offline = args.etapa == 'carregar'
 
-    # Todos os links encontrados
-    for i in todos_links:
-        print(i)
+    if args.profile:
+        imprimir_resumo([perfilar_carga(todos_links[0], engine, cache, args.modo_carga, args.chunk_size,
+                                        args.forcar, not args.sem_staging, args.profile_saida, offline)])
+        return
 
     ##############################################################
-    # 3. PROCESSAR CADA CSV E CARREGAR NO MYSQL
+    # 4. PROCESSAR CADA CSV E CARREGAR NO BANCO
     ##############################################################
     print("\nIniciando processamento dos arquivos CSV...")
-    # Percorremos cada link e processamos
-    for i, url in enumerate(todos_links, 1):
-        print(f"\n[{i}/{len(todos_links)}]", end=" ")
-        processar_csv_para_mysql(url, engine)
+    inicio = time.perf_counter()
+    if args.bulk:
+        banco.preparar_carga_em_massa(engine)
+    try:
+        if args.workers > 1:
+            print(f"Usando {args.workers} processos em paralelo")
+            resultados = processar_em_paralelo(todos_links, banco, args.workers, args.modo_carga, args.chunk_size,
+                                               args.forcar, not args.sem_staging, args.chaves, offline)
+        else:
+            # Download, leitura e gravação sobrepostos (ver processar_em_pipeline)
+            resultados = processar_em_pipeline(todos_links, engine, cache, modo_carga=args.modo_carga,
+                                               tamanho_chunk=args.chunk_size, forcar=args.forcar,
+                                               usar_staging=not args.sem_staging, threads_download=args.downloads,
+                                               offline=offline)
+            cache.imprimir_estatisticas()
+    finally:
+        # Mesmo com a carga interrompida a tabela fato volta a ter índices e FKs
+        if args.bulk:
+            banco.finalizar_carga_em_massa(engine)
+
+    imprimir_resumo(resultados)
+    if args.recalcular_agregados:
+        recalcular_agregados(engine)
+    imprimir_etapas(METRICAS.finalizar_execucao())
+    print(f"📈 Métricas gravadas em {args.metricas}")
+    print(f"⏱️  Tempo total: {(time.perf_counter() - inicio) / 60:.2f} minutos")
 
     '''
     ##############################################################
-    # 4. ESTATÍSTICAS FINAIS
+    # 5. ESTATÍSTICAS FINAIS
     ##############################################################
     print("\nCalculando estatísticas finais...")
     
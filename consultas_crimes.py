@@ -0,0 +1,300 @@
+#######################################################################
+# CONSULTAS PRONTAS - CRIMES CURITIBA
+#######################################################################
+
+# As análises de consultas_uteis.sql como funções Python parametrizadas que devolvem DataFrames.
+# Sem filtro, as contagens vêm das tabelas agregadas (AGG_*); com filtro (ano, tipo de crime)
+# a consulta vai na tabela fato pelas dimensões.
+#
+# Os resultados ficam em cache no disco (data/cache/consultas), com chave formada pelo
+# banco (URL sem senha), pela consulta, pelos parâmetros e pela versão dos dados
+# (CARGA_VERSAO, incrementada pelo loader a cada chunk gravado): repetir uma chamada
+# não vai ao banco enquanto não chegarem dados novos.
+#
+# Exemplo (notebook):
+#   import consultas_crimes as cc
+#   cc.top_bairros(limite=10, ano=2023)
+#   cc.crimes_por_periodo(tipo_crime='FURTO')
+#   cc.comparacao_anual()
+#
+# Num banco SQLite montado com `coleta_mysql_v2.py --banco sqlite`:
+#   from bancos_etl import BancoSQLite
+#   cc.usar_banco(BancoSQLite('data/crimes_curitiba.db'))
+#######################################################################
+
+import glob
+import hashlib
+import json
+import os
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from bancos_etl import BancoMySQL
+from coleta_mysql_v2 import DB_CONFIG, DIAS_SEMANA, ler_versao_dados
+
+#############################################################
+# CONFIGURAÇÕES
+#############################################################
+
+DIRETORIO_CACHE = os.path.join('data', 'cache', 'consultas')
+
+ORDEM_PERIODOS = ['MADRUGADA', 'MANHÃ', 'TARDE', 'NOITE']
+
+_ENGINE = None
+
+
+def get_engine():
+
+    """Engine padrão (DB_CONFIG do loader), criada uma vez por processo"""
+
+    global _ENGINE
+    if _ENGINE is None:
+        _ENGINE = BancoMySQL(DB_CONFIG).criar_engine()
+    return _ENGINE
+
+
+def usar_banco(banco):
+
+    """Troca o banco padrão das consultas (ex.: BancoSQLite('data/crimes_curitiba.db'))"""
+
+    global _ENGINE
+    _ENGINE = banco.criar_engine()
+    return _ENGINE
+
+#############################################################
+# CACHE DE RESULTADOS
+#############################################################
+
+def _versao_dados(connection):
+
+    """Versão dos dados ou None se o banco não tem CARGA_VERSAO (nesse caso não há cache)"""
+
+    try:
+        return ler_versao_dados(connection)
+    except DBAPIError:
+        connection.rollback()
+        return None
+
+
+def consultar(nome, sql, parametros=None, engine=None, usar_cache=True):
+
+    """
+    Executa `sql` e devolve um DataFrame, passando pelo cache em disco.
+    O arquivo é identificado por nome + hash(URL do banco, sql, parâmetros) e guarda a versão dos
+    dados no nome: quando a versão muda, o arquivo antigo da mesma consulta é apagado e a consulta
+    roda de novo. A URL separa bancos diferentes, cujas versões podem coincidir.
+    """
+
+    engine = engine or get_engine()
+    parametros = parametros or {}
+    banco = engine.url.render_as_string(hide_password=True)
+    identificador = hashlib.sha256(
+        json.dumps([banco, sql, parametros], sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()[:16]
+    prefixo = os.path.join(DIRETORIO_CACHE, f"{nome}-{identificador}")
+
+    with engine.connect() as connection:
+        versao = _versao_dados(connection) if usar_cache else None
+        caminho = f"{prefixo}-v{versao}.pkl"
+        if versao is not None and os.path.exists(caminho):
+            return pd.read_pickle(caminho)
+
+        df = pd.read_sql(text(sql), connection, params=parametros)
+
+    if versao is not None:
+        os.makedirs(DIRETORIO_CACHE, exist_ok=True)
+        for antigo in glob.glob(f"{glob.escape(prefixo)}-v*.pkl"):
+            os.remove(antigo)
+        temporario = caminho + '.tmp'
+        df.to_pickle(temporario)
+        os.replace(temporario, caminho)
+    return df
+
+
+def limpar_cache():
+
+    """Apaga todos os resultados em cache"""
+
+    for caminho in glob.glob(os.path.join(DIRETORIO_CACHE, '*.pkl')):
+        os.remove(caminho)
+
+#############################################################
+# FILTROS
+#############################################################
+
+def _filtros(ano=None, tipo_crime=None):
+
+    """JOINs, WHERE e parâmetros dos filtros opcionais sobre a tabela fato (alias f)"""
+
+    joins, condicoes, parametros = [], [], {}
+    if ano is not None:
+        joins.append("JOIN DIM_TEMPO ft ON f.tempo_id = ft.tempo_id")
+        condicoes.append("ft.ocorrencia_ano = :ano")
+        parametros['ano'] = int(ano)
+    if tipo_crime is not None:
+        joins.append("JOIN DIM_NATUREZA fn ON f.natureza_id = fn.natureza_id")
+        condicoes.append("fn.natureza1_descricao = :tipo_crime")
+        parametros['tipo_crime'] = tipo_crime
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+    return ' '.join(joins), where, parametros
+
+
+def _com_percentual(df, coluna='total_ocorrencias', total=None):
+    total = df[coluna].sum() if total is None else total
+    df['percentual'] = (df[coluna] * 100.0 / total).round(2) if total else 0.0
+    return df
+
+
+def _ordenar(df, coluna, ordem):
+    df[coluna] = pd.Categorical(df[coluna], categories=ordem, ordered=True)
+    return df.sort_values(coluna).reset_index(drop=True)
+
+#############################################################
+# ANÁLISES
+#############################################################
+
+def tendencia_anual(engine=None):
+
+    """Ocorrências por ano, com o percentual de cada ano"""
+
+    df = consultar('tendencia_anual', """
+        SELECT ocorrencia_ano, total AS total_ocorrencias
+        FROM AGG_CRIMES_ANO
+        ORDER BY ocorrencia_ano
+    """, engine=engine)
+    return _com_percentual(df)
+
+
+def tendencia_mensal(ano=None, engine=None):
+
+    """Ocorrências por ano e mês (só do `ano`, se informado)"""
+
+    where, parametros = ("WHERE ocorrencia_ano = :ano", {'ano': int(ano)}) if ano is not None else ("", {})
+    return consultar('tendencia_mensal', f"""
+        SELECT ocorrencia_ano, ocorrencia_mes, nome_mes, total AS total_ocorrencias
+        FROM AGG_CRIMES_MES
+        {where}
+        ORDER BY ocorrencia_ano, ocorrencia_mes
+    """, parametros, engine=engine)
+
+
+def comparacao_anual(engine=None):
+
+    """Crescimento ano a ano: total, total do ano anterior e variação percentual"""
+
+    df = tendencia_anual(engine=engine)[['ocorrencia_ano', 'total_ocorrencias']]
+    df['ano_anterior'] = df['total_ocorrencias'].shift(1)
+    df['variacao_percentual'] = ((df['total_ocorrencias'] - df['ano_anterior']) * 100.0
+                                 / df['ano_anterior']).round(2)
+    return df
+
+
+def top_bairros(limite=20, ano=None, engine=None):
+
+    """Bairros com mais ocorrências (percentual sobre o total do período)"""
+
+    if ano is None:
+        df = consultar('top_bairros', """
+            SELECT NULLIF(bairro_nome, '') AS bairro_nome, NULLIF(regional_nome, '') AS regional_nome,
+                   total AS total_ocorrencias
+            FROM AGG_CRIMES_BAIRRO
+        """, engine=engine)
+    else:
+        joins, where, parametros = _filtros(ano=ano)
+        df = consultar('top_bairros', f"""
+            SELECT l.bairro_nome, l.regional_nome, COUNT(*) AS total_ocorrencias
+            FROM FATO_OCORRENCIA f
+            JOIN DIM_LOCAL l ON f.local_id = l.local_id
+            {joins}
+            {where}
+            GROUP BY l.bairro_nome, l.regional_nome
+        """, parametros, engine=engine)
+    # O percentual é sobre todas as ocorrências do período, não só sobre as do top
+    df = _com_percentual(df)
+    return df.sort_values('total_ocorrencias', ascending=False).head(limite).reset_index(drop=True)
+
+
+def top_tipos_crime(limite=15, ano=None, engine=None):
+
+    """Tipos de crime (NATUREZA1_DESCRICAO) mais frequentes"""
+
+    if ano is None:
+        df = consultar('top_tipos_crime', """
+            SELECT NULLIF(tipo_crime, '') AS tipo_crime, total AS total_ocorrencias
+            FROM AGG_CRIMES_TIPO
+        """, engine=engine)
+    else:
+        joins, where, parametros = _filtros(ano=ano)
+        df = consultar('top_tipos_crime', f"""
+            SELECT n.natureza1_descricao AS tipo_crime, COUNT(*) AS total_ocorrencias
+            FROM FATO_OCORRENCIA f
+            JOIN DIM_NATUREZA n ON f.natureza_id = n.natureza_id
+            {joins}
+            {where}
+            GROUP BY n.natureza1_descricao
+        """, parametros, engine=engine)
+    df = _com_percentual(df)
+    return df.sort_values('total_ocorrencias', ascending=False).head(limite).reset_index(drop=True)
+
+
+def categorias(ano=None, engine=None):
+
+    """Ocorrências por categoria de crime"""
+
+    if ano is None:
+        df = consultar('categorias', """
+            SELECT categoria_crime, total AS total_ocorrencias
+            FROM AGG_CRIMES_CATEGORIA
+        """, engine=engine)
+    else:
+        joins, where, parametros = _filtros(ano=ano)
+        df = consultar('categorias', f"""
+            SELECT n.categoria_crime, COUNT(*) AS total_ocorrencias
+            FROM FATO_OCORRENCIA f
+            JOIN DIM_NATUREZA n ON f.natureza_id = n.natureza_id
+            {joins}
+            {where}
+            GROUP BY n.categoria_crime
+        """, parametros, engine=engine)
+    df = _com_percentual(df)
+    return df.sort_values('total_ocorrencias', ascending=False).reset_index(drop=True)
+
+
+def crimes_por_periodo(ano=None, tipo_crime=None, engine=None):
+
+    """Ocorrências por período do dia (ocorrências sem horário válido ficam de fora)"""
+
+    if ano is None and tipo_crime is None:
+        df = consultar('crimes_por_periodo', """
+            SELECT periodo_dia, total AS total_ocorrencias
+            FROM AGG_CRIMES_PERIODO
+        """, engine=engine)
+    else:
+        joins, where, parametros = _filtros(ano, tipo_crime)
+        df = consultar('crimes_por_periodo', f"""
+            SELECT h.periodo_dia, COUNT(*) AS total_ocorrencias
+            FROM FATO_OCORRENCIA f
+            JOIN DIM_HORA h ON f.hora_id = h.hora_id
+            {joins}
+            {where}
+            GROUP BY h.periodo_dia
+        """, parametros, engine=engine)
+    return _ordenar(_com_percentual(df), 'periodo_dia', ORDEM_PERIODOS)
+
+
+def crimes_por_dia_semana(ano=None, tipo_crime=None, engine=None):
+
+    """Ocorrências por dia da semana (segunda a domingo)"""
+
+    joins, where, parametros = _filtros(ano, tipo_crime)
+    df = consultar('crimes_por_dia_semana', f"""
+        SELECT t.ocorrencia_dia_semana, COUNT(*) AS total_ocorrencias
+        FROM FATO_OCORRENCIA f
+        JOIN DIM_TEMPO t ON f.tempo_id = t.tempo_id
+        {joins}
+        {where}
+        GROUP BY t.ocorrencia_dia_semana
+    """, parametros, engine=engine)
+    return _ordenar(_com_percentual(df), 'ocorrencia_dia_semana', DIAS_SEMANA)
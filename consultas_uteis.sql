@@ -3,6 +3,8 @@
 -- =====================================================
 -- Use estas queries no MySQL Workbench ou como referência
 -- para criar visualizações no Power BI
+-- Contagens simples leem as tabelas agregadas AGG_*; os "Top N" contam pelas chaves
+-- da fato e ranqueiam com funções de janela (MySQL 8.0+ / MariaDB 10.2+)
 
 USE crimes_curitiba;
 
@@ -13,10 +15,9 @@ USE crimes_curitiba;
 -- Total de ocorrências por ano
 SELECT 
     ocorrencia_ano,
-    COUNT(*) AS total_ocorrencias,
-    ROUND(COUNT(*) * 100.0 / SUM(COUNT(*)) OVER (), 2) AS percentual
-FROM vw_ocorrencias_completas
-GROUP BY ocorrencia_ano
+    total_ocorrencias,
+    ROUND(total_ocorrencias * 100.0 / SUM(total_ocorrencias) OVER (), 2) AS percentual
+FROM vw_crimes_por_ano
 ORDER BY ocorrencia_ano;
 
 -- Total geral de ocorrências
@@ -37,9 +38,8 @@ FROM DIM_TEMPO;
 SELECT 
     ocorrencia_ano,
     nome_mes,
-    COUNT(*) AS total_ocorrencias
-FROM vw_ocorrencias_completas
-GROUP BY ocorrencia_ano, ocorrencia_mes, nome_mes
+    total AS total_ocorrencias
+FROM AGG_CRIMES_MES
 ORDER BY ocorrencia_ano, ocorrencia_mes;
 
 -- Ocorrências por dia da semana
@@ -53,13 +53,12 @@ ORDER BY
     FIELD(ocorrencia_dia_semana, 'DOMINGO', 'SEGUNDA-FEIRA', 'TERÇA-FEIRA', 
           'QUARTA-FEIRA', 'QUINTA-FEIRA', 'SEXTA-FEIRA', 'SÁBADO');
 
--- Ocorrências por período do dia
+-- Ocorrências por período do dia (ocorrências sem horário válido ficam de fora)
 SELECT 
     periodo_dia,
-    COUNT(*) AS total_ocorrencias,
-    ROUND(COUNT(*) * 100.0 / SUM(COUNT(*)) OVER (), 2) AS percentual
-FROM vw_ocorrencias_completas
-GROUP BY periodo_dia
+    total_ocorrencias,
+    ROUND(total_ocorrencias * 100.0 / SUM(total_ocorrencias) OVER (), 2) AS percentual
+FROM vw_crimes_por_periodo
 ORDER BY 
     FIELD(periodo_dia, 'MADRUGADA', 'MANHÃ', 'TARDE', 'NOITE');
 
@@ -71,37 +70,50 @@ ORDER BY
 SELECT 
     bairro_nome,
     regional_nome,
-    COUNT(*) AS total_ocorrencias,
-    ROUND(COUNT(*) * 100.0 / (SELECT COUNT(*) FROM FATO_OCORRENCIA), 2) AS percentual
-FROM vw_ocorrencias_completas
-GROUP BY bairro_nome, regional_nome
+    total_ocorrencias,
+    ROUND(total_ocorrencias * 100.0 / SUM(total_ocorrencias) OVER (), 2) AS percentual
+FROM vw_top_bairros
 ORDER BY total_ocorrencias DESC
 LIMIT 20;
 
 -- Ocorrências por regional
 SELECT 
     regional_nome,
-    COUNT(*) AS total_ocorrencias,
+    SUM(total_ocorrencias) AS total_ocorrencias,
+    -- Intencional: a view troca '' por NULL, então bairro sem nome não conta como bairro
     COUNT(DISTINCT bairro_nome) AS numero_bairros
-FROM vw_ocorrencias_completas
+FROM vw_top_bairros
 WHERE regional_nome IS NOT NULL
 GROUP BY regional_nome
 ORDER BY total_ocorrencias DESC;
 
 -- Evolução temporal por bairro (Top 5)
-SELECT 
-    bairro_nome,
-    ocorrencia_ano,
-    COUNT(*) AS total_ocorrencias
-FROM vw_ocorrencias_completas
-WHERE bairro_nome IN (
-    SELECT bairro_nome 
-    FROM vw_ocorrencias_completas 
-    GROUP BY bairro_nome 
-    ORDER BY COUNT(*) DESC 
-    LIMIT 5
+WITH por_chaves AS (
+    SELECT local_id, tempo_id, COUNT(*) AS total
+    FROM FATO_OCORRENCIA
+    GROUP BY local_id, tempo_id
+),
+por_bairro_ano AS (
+    SELECT 
+        l.bairro_nome,
+        t.ocorrencia_ano,
+        SUM(c.total) AS total_ocorrencias,
+        SUM(SUM(c.total)) OVER (PARTITION BY l.bairro_nome) AS total_bairro
+    FROM por_chaves c
+    JOIN DIM_LOCAL l ON c.local_id = l.local_id
+    JOIN DIM_TEMPO t ON c.tempo_id = t.tempo_id
+    GROUP BY l.bairro_nome, t.ocorrencia_ano
+),
+ranking AS (
+    SELECT 
+        por_bairro_ano.*,
+        DENSE_RANK() OVER (ORDER BY total_bairro DESC, bairro_nome) AS posicao_bairro
+    FROM por_bairro_ano
 )
-GROUP BY bairro_nome, ocorrencia_ano
+SELECT bairro_nome, ocorrencia_ano, total_ocorrencias
+FROM ranking
+-- Bairro nulo ocupa sua posição no ranking, mas não entra no resultado
+WHERE posicao_bairro <= 5 AND bairro_nome IS NOT NULL
 ORDER BY bairro_nome, ocorrencia_ano;
 
 -- =====================================================
@@ -110,38 +122,47 @@ ORDER BY bairro_nome, ocorrencia_ano;
 
 -- Top 15 tipos de crime
 SELECT 
-    tipo_crime,
-    COUNT(*) AS total_ocorrencias,
-    ROUND(COUNT(*) * 100.0 / (SELECT COUNT(*) FROM FATO_OCORRENCIA), 2) AS percentual
-FROM vw_ocorrencias_completas
-GROUP BY tipo_crime
+    NULLIF(tipo_crime, '') AS tipo_crime,
+    total AS total_ocorrencias,
+    ROUND(total * 100.0 / SUM(total) OVER (), 2) AS percentual
+FROM AGG_CRIMES_TIPO
 ORDER BY total_ocorrencias DESC
 LIMIT 15;
 
 -- Evolução dos principais crimes ao longo dos anos
-SELECT 
-    ocorrencia_ano,
-    tipo_crime,
-    COUNT(*) AS total_ocorrencias
-FROM vw_ocorrencias_completas
-WHERE tipo_crime IN (
-    SELECT tipo_crime 
-    FROM vw_ocorrencias_completas 
-    GROUP BY tipo_crime 
-    ORDER BY COUNT(*) DESC 
-    LIMIT 5
+WITH por_chaves AS (
+    SELECT natureza_id, tempo_id, COUNT(*) AS total
+    FROM FATO_OCORRENCIA
+    GROUP BY natureza_id, tempo_id
+),
+por_ano_tipo AS (
+    SELECT 
+        t.ocorrencia_ano,
+        n.natureza1_descricao AS tipo_crime,
+        SUM(c.total) AS total_ocorrencias,
+        SUM(SUM(c.total)) OVER (PARTITION BY n.natureza1_descricao) AS total_tipo
+    FROM por_chaves c
+    JOIN DIM_NATUREZA n ON c.natureza_id = n.natureza_id
+    JOIN DIM_TEMPO t ON c.tempo_id = t.tempo_id
+    GROUP BY t.ocorrencia_ano, n.natureza1_descricao
+),
+ranking AS (
+    SELECT 
+        por_ano_tipo.*,
+        DENSE_RANK() OVER (ORDER BY total_tipo DESC, tipo_crime) AS posicao_tipo
+    FROM por_ano_tipo
 )
-GROUP BY ocorrencia_ano, tipo_crime
+SELECT ocorrencia_ano, tipo_crime, total_ocorrencias
+FROM ranking
+WHERE posicao_tipo <= 5 AND tipo_crime IS NOT NULL
 ORDER BY tipo_crime, ocorrencia_ano;
 
 -- Categorias de crime (agregado)
 SELECT 
-    n.categoria_crime,
-    COUNT(*) AS total_ocorrencias,
-    ROUND(COUNT(*) * 100.0 / (SELECT COUNT(*) FROM FATO_OCORRENCIA), 2) AS percentual
-FROM FATO_OCORRENCIA f
-JOIN DIM_NATUREZA n ON f.natureza_id = n.natureza_id
-GROUP BY n.categoria_crime
+    categoria_crime,
+    total AS total_ocorrencias,
+    ROUND(total * 100.0 / SUM(total) OVER (), 2) AS percentual
+FROM AGG_CRIMES_CATEGORIA
 ORDER BY total_ocorrencias DESC;
 
 -- =====================================================
@@ -149,65 +170,97 @@ ORDER BY total_ocorrencias DESC;
 -- =====================================================
 
 -- Crime por dia da semana (Top 5 crimes)
-SELECT 
-    ocorrencia_dia_semana,
-    tipo_crime,
-    COUNT(*) AS total_ocorrencias
-FROM vw_ocorrencias_completas
-WHERE tipo_crime IN (
-    SELECT tipo_crime 
-    FROM vw_ocorrencias_completas 
-    GROUP BY tipo_crime 
-    ORDER BY COUNT(*) DESC 
-    LIMIT 5
+WITH por_chaves AS (
+    SELECT natureza_id, tempo_id, COUNT(*) AS total
+    FROM FATO_OCORRENCIA
+    GROUP BY natureza_id, tempo_id
+),
+por_dia_tipo AS (
+    SELECT 
+        t.ocorrencia_dia_semana,
+        n.natureza1_descricao AS tipo_crime,
+        SUM(c.total) AS total_ocorrencias,
+        SUM(SUM(c.total)) OVER (PARTITION BY n.natureza1_descricao) AS total_tipo
+    FROM por_chaves c
+    JOIN DIM_NATUREZA n ON c.natureza_id = n.natureza_id
+    JOIN DIM_TEMPO t ON c.tempo_id = t.tempo_id
+    GROUP BY t.ocorrencia_dia_semana, n.natureza1_descricao
+),
+ranking AS (
+    SELECT 
+        por_dia_tipo.*,
+        DENSE_RANK() OVER (ORDER BY total_tipo DESC, tipo_crime) AS posicao_tipo
+    FROM por_dia_tipo
 )
-GROUP BY ocorrencia_dia_semana, tipo_crime
+SELECT ocorrencia_dia_semana, tipo_crime, total_ocorrencias
+FROM ranking
+WHERE posicao_tipo <= 5 AND tipo_crime IS NOT NULL
 ORDER BY 
     FIELD(ocorrencia_dia_semana, 'DOMINGO', 'SEGUNDA-FEIRA', 'TERÇA-FEIRA', 
           'QUARTA-FEIRA', 'QUINTA-FEIRA', 'SEXTA-FEIRA', 'SÁBADO'),
     total_ocorrencias DESC;
 
 -- Crime por período do dia (Top 5 crimes)
-SELECT 
-    periodo_dia,
-    tipo_crime,
-    COUNT(*) AS total_ocorrencias
-FROM vw_ocorrencias_completas
-WHERE tipo_crime IN (
-    SELECT tipo_crime 
-    FROM vw_ocorrencias_completas 
-    GROUP BY tipo_crime 
-    ORDER BY COUNT(*) DESC 
-    LIMIT 5
+WITH por_chaves AS (
+    SELECT hora_id, natureza_id, COUNT(*) AS total
+    FROM FATO_OCORRENCIA
+    GROUP BY hora_id, natureza_id
+),
+por_periodo_tipo AS (
+    SELECT 
+        h.periodo_dia,
+        n.natureza1_descricao AS tipo_crime,
+        SUM(c.total) AS total_ocorrencias,
+        SUM(SUM(c.total)) OVER (PARTITION BY n.natureza1_descricao) AS total_tipo
+    FROM por_chaves c
+    JOIN DIM_NATUREZA n ON c.natureza_id = n.natureza_id
+    -- LEFT JOIN: ocorrências sem horário contam no ranking e aparecem com período nulo
+    LEFT JOIN DIM_HORA h ON c.hora_id = h.hora_id
+    GROUP BY h.periodo_dia, n.natureza1_descricao
+),
+ranking AS (
+    SELECT 
+        por_periodo_tipo.*,
+        DENSE_RANK() OVER (ORDER BY total_tipo DESC, tipo_crime) AS posicao_tipo
+    FROM por_periodo_tipo
 )
-GROUP BY periodo_dia, tipo_crime
+SELECT periodo_dia, tipo_crime, total_ocorrencias
+FROM ranking
+WHERE posicao_tipo <= 5 AND tipo_crime IS NOT NULL
 ORDER BY 
     FIELD(periodo_dia, 'MADRUGADA', 'MANHÃ', 'TARDE', 'NOITE'),
     total_ocorrencias DESC;
 
 -- Bairros mais perigosos por tipo de crime (matriz)
-SELECT 
-    b.bairro_nome,
-    c.tipo_crime,
-    COUNT(*) AS total_ocorrencias
-FROM vw_ocorrencias_completas b
-JOIN vw_ocorrencias_completas c ON b.bairro_nome = c.bairro_nome
-WHERE b.bairro_nome IN (
-    SELECT bairro_nome 
-    FROM vw_ocorrencias_completas 
-    GROUP BY bairro_nome 
-    ORDER BY COUNT(*) DESC 
-    LIMIT 10
-)
-AND c.tipo_crime IN (
-    SELECT tipo_crime 
-    FROM vw_ocorrencias_completas 
-    GROUP BY tipo_crime 
-    ORDER BY COUNT(*) DESC 
-    LIMIT 5
+WITH por_chaves AS (
+    SELECT local_id, natureza_id, COUNT(*) AS total
+    FROM FATO_OCORRENCIA
+    GROUP BY local_id, natureza_id
+),
+por_bairro_tipo AS (
+    SELECT 
+        l.bairro_nome,
+        n.natureza1_descricao AS tipo_crime,
+        SUM(c.total) AS total_ocorrencias,
+        SUM(SUM(c.total)) OVER (PARTITION BY l.bairro_nome) AS total_bairro,
+        SUM(SUM(c.total)) OVER (PARTITION BY n.natureza1_descricao) AS total_tipo
+    FROM por_chaves c
+    JOIN DIM_LOCAL l ON c.local_id = l.local_id
+    JOIN DIM_NATUREZA n ON c.natureza_id = n.natureza_id
+    GROUP BY l.bairro_nome, n.natureza1_descricao
+),
+ranking AS (
+    SELECT 
+        por_bairro_tipo.*,
+        DENSE_RANK() OVER (ORDER BY total_bairro DESC, bairro_nome) AS posicao_bairro,
+        DENSE_RANK() OVER (ORDER BY total_tipo DESC, tipo_crime) AS posicao_tipo
+    FROM por_bairro_tipo
 )
-GROUP BY b.bairro_nome, c.tipo_crime
-ORDER BY b.bairro_nome, total_ocorrencias DESC;
+SELECT bairro_nome, tipo_crime, total_ocorrencias
+FROM ranking
+WHERE posicao_bairro <= 10 AND posicao_tipo <= 5
+  AND bairro_nome IS NOT NULL AND tipo_crime IS NOT NULL
+ORDER BY bairro_nome, total_ocorrencias DESC;
 
 -- =====================================================
 -- 6. ANÁLISES COMPARATIVAS
@@ -216,31 +269,23 @@ ORDER BY b.bairro_nome, total_ocorrencias DESC;
 -- Comparação ano a ano (crescimento)
 SELECT 
     ocorrencia_ano,
-    COUNT(*) AS total_ocorrencias,
-    LAG(COUNT(*)) OVER (ORDER BY ocorrencia_ano) AS ano_anterior,
+    total_ocorrencias,
+    LAG(total_ocorrencias) OVER (ORDER BY ocorrencia_ano) AS ano_anterior,
     ROUND(
-        (COUNT(*) - LAG(COUNT(*)) OVER (ORDER BY ocorrencia_ano)) * 100.0 / 
-        LAG(COUNT(*)) OVER (ORDER BY ocorrencia_ano), 
+        (total_ocorrencias - LAG(total_ocorrencias) OVER (ORDER BY ocorrencia_ano)) * 100.0 / 
+        LAG(total_ocorrencias) OVER (ORDER BY ocorrencia_ano), 
         2
     ) AS variacao_percentual
-FROM vw_ocorrencias_completas
-GROUP BY ocorrencia_ano
+FROM vw_crimes_por_ano
 ORDER BY ocorrencia_ano;
 
 -- Média mensal por ano
 SELECT 
     ocorrencia_ano,
-    ROUND(COUNT(*) / 12.0, 0) AS media_mensal,
-    MAX(mes_count) AS mes_pico,
-    MIN(mes_count) AS mes_menor
-FROM (
-    SELECT 
-        ocorrencia_ano,
-        ocorrencia_mes,
-        COUNT(*) AS mes_count
-    FROM vw_ocorrencias_completas
-    GROUP BY ocorrencia_ano, ocorrencia_mes
-) AS monthly
+    ROUND(SUM(total) / 12.0, 0) AS media_mensal,
+    MAX(total) AS mes_pico,
+    MIN(total) AS mes_menor
+FROM AGG_CRIMES_MES
 GROUP BY ocorrencia_ano
 ORDER BY ocorrencia_ano;
 
@@ -275,8 +320,8 @@ LIMIT 5;
 -- =====================================================
 
 -- Anos disponíveis (para filtro)
-SELECT DISTINCT ocorrencia_ano 
-FROM vw_ocorrencias_completas 
+SELECT ocorrencia_ano 
+FROM vw_crimes_por_ano 
 ORDER BY ocorrencia_ano;
 
 -- Bairros disponíveis (para filtro)
@@ -0,0 +1,309 @@
+#######################################################################
+# HARNESS DE LATÊNCIA DAS CONSULTAS - CRIMES CURITIBA
+#######################################################################
+
+# Este script:
+# 1. Lê todas as consultas de consultas_uteis.sql (o comentário acima de cada uma vira o nome)
+# 2. Executa cada consulta algumas vezes e registra a latência (mínima e mediana) e as linhas
+# 3. Guarda o plano de execução (EXPLAIN no MySQL, EXPLAIN QUERY PLAN no SQLite)
+#    e sinaliza as tabelas lidas por varredura completa (full scan)
+# 4. Compara com uma execução anterior (--baseline) para provar ganhos de índices
+#    e apontar regressões (latência maior ou full scan novo)
+#
+# Exemplos:
+#   python harness_consultas.py --saida data/bench/consultas_antes.json
+#   python harness_consultas.py --baseline data/bench/consultas_antes.json
+#   python harness_consultas.py --filtro bairro --repeticoes 5
+#   python harness_consultas.py --url sqlite:///data/bench/v2.db
+#   python harness_consultas.py --sqlite data/crimes_curitiba.db
+#######################################################################
+
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+from sqlalchemy import create_engine
+
+from bancos_etl import BancoMySQL, BancoSQLite
+from coleta_mysql_v2 import DB_CONFIG
+
+#############################################################
+# CONFIGURAÇÕES
+#############################################################
+
+ARQUIVO_CONSULTAS = 'consultas_uteis.sql'
+REPETICOES = 3
+
+# Tempo máximo de cada execução: uma consulta que estoura vira erro e o harness segue
+TIMEOUT_SEGUNDOS = 60
+
+# Regressão: mediana acima de LIMITE_REGRESSAO x baseline (diferenças menores que
+# MS_MINIMO_REGRESSAO são ruído de medição e não contam)
+LIMITE_REGRESSAO = 1.5
+MS_MINIMO_REGRESSAO = 5.0
+
+# Tabelas pequenas por construção: ler inteiras é o plano esperado, não um alerta
+TABELAS_SEM_ALERTA = re.compile(r'^AGG_', re.IGNORECASE)
+
+URL_PADRAO = BancoMySQL(DB_CONFIG).url()
+
+#############################################################
+# LEITURA DO ARQUIVO DE CONSULTAS
+#############################################################
+
+def separar_comandos(sql):
+
+    """Divide o script nos ';' que estão fora de strings e de comentários '--'"""
+
+    comandos, inicio, aspas, i = [], 0, None, 0
+    while i < len(sql):
+        caractere = sql[i]
+        if aspas:
+            if caractere == aspas:
+                aspas = None
+        elif sql.startswith('--', i):
+            fim = sql.find('\n', i)
+            i = len(sql) if fim == -1 else fim
+            continue
+        elif caractere in ("'", '"', '`'):
+            aspas = caractere
+        elif caractere == ';':
+            comandos.append(sql[inicio:i])
+            inicio = i + 1
+        i += 1
+    if sql[inicio:].strip():
+        comandos.append(sql[inicio:])
+    return comandos
+
+
+def ler_consultas(caminho=ARQUIVO_CONSULTAS):
+
+    """
+    Devolve as consultas (SELECT/WITH) do arquivo, na ordem, como dicionários
+    {'id', 'secao', 'nome', 'sql'}. A seção vem dos cabeçalhos '-- N. TÍTULO' e o nome
+    do último comentário antes da consulta. Outros comandos (USE ...) são ignorados:
+    o banco já vem da URL de conexão.
+    """
+
+    with open(caminho, encoding='utf-8') as f:
+        comandos = separar_comandos(f.read())
+
+    consultas, secao = [], ''
+    for comando in comandos:
+        nome, corpo = '', []
+        for linha in comando.splitlines():
+            texto = linha.strip()
+            if not texto:
+                continue
+            if not texto.startswith('--'):
+                corpo.append(linha)
+                continue
+            comentario = texto.lstrip('-').strip()
+            if not comentario or set(comentario) == {'='}:
+                continue
+            if re.match(r'^\d+\.\s', comentario):
+                secao = comentario
+            elif not corpo:
+                nome = comentario
+
+        sql = '\n'.join(corpo).strip()
+        if re.match(r'^(SELECT|WITH)\b', sql, re.IGNORECASE):
+            consultas.append({'id': len(consultas) + 1, 'secao': secao, 'nome': nome or sql.split('\n')[0],
+                              'sql': sql})
+    return consultas
+
+#############################################################
+# PLANO DE EXECUÇÃO
+#############################################################
+
+def plano_mysql(connection, sql):
+
+    """
+    EXPLAIN tradicional: uma linha por tabela acessada.
+    type = 'ALL' é varredura completa; tabelas derivadas (<derived2>, <union1,2>) são
+    temporárias da própria consulta e não contam.
+    """
+
+    resultado = connection.exec_driver_sql(f"EXPLAIN {sql}")
+    colunas = list(resultado.keys())
+    linhas = [dict(zip(colunas, linha)) for linha in resultado.fetchall()]
+    plano = [
+        f"{l.get('table')}: type={l.get('type')} key={l.get('key')} rows={l.get('rows')} "
+        f"{l.get('Extra') or ''}".strip()
+        for l in linhas
+    ]
+    full_scans = sorted({
+        l['table'] for l in linhas
+        if l.get('type') == 'ALL' and l.get('table') and not str(l['table']).startswith('<')
+        and not TABELAS_SEM_ALERTA.match(l['table'])
+    })
+    return plano, full_scans
+
+
+def plano_sqlite(connection, sql):
+
+    """EXPLAIN QUERY PLAN: 'SCAN tabela' sem índice é varredura completa"""
+
+    plano = [linha[-1] for linha in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+    full_scans = sorted({
+        m.group(1) for detalhe in plano
+        for m in [re.match(r'^SCAN (\w+)(?: AS \w+)?$', detalhe)]
+        if m and m.group(1) != 'CONSTANT' and not TABELAS_SEM_ALERTA.match(m.group(1))
+    })
+    return plano, full_scans
+
+
+PLANOS = {'mysql': plano_mysql, 'sqlite': plano_sqlite}
+
+
+def limitar_tempo(connection, segundos):
+
+    """Interrompe execuções mais longas que `segundos` (MAX_EXECUTION_TIME no MySQL, progress handler no SQLite)"""
+
+    if connection.dialect.name == 'mysql':
+        connection.exec_driver_sql(f"SET SESSION MAX_EXECUTION_TIME = {int(segundos * 1000)}")
+    elif connection.dialect.name == 'sqlite':
+        estado = {'inicio': time.perf_counter()}
+
+        def verificar():
+            return time.perf_counter() - estado['inicio'] > segundos
+
+        connection.connection.driver_connection.set_progress_handler(verificar, 100000)
+        # O relógio reinicia a cada execução
+        connection.info['reiniciar_relogio'] = lambda: estado.update(inicio=time.perf_counter())
+
+#############################################################
+# MEDIÇÃO
+#############################################################
+
+def medir_consulta(connection, consulta, repeticoes=REPETICOES):
+
+    """Executa a consulta `repeticoes` vezes (lendo todas as linhas) e coleta o plano"""
+
+    resultado = {k: consulta[k] for k in ('id', 'secao', 'nome')}
+    try:
+        tempos = []
+        for _ in range(repeticoes):
+            connection.info.get('reiniciar_relogio', lambda: None)()
+            inicio = time.perf_counter()
+            linhas = connection.exec_driver_sql(consulta['sql']).fetchall()
+            tempos.append((time.perf_counter() - inicio) * 1000)
+        connection.info.get('reiniciar_relogio', lambda: None)()
+        explicar = PLANOS.get(connection.dialect.name)
+        plano, full_scans = explicar(connection, consulta['sql']) if explicar else ([], [])
+        resultado.update(linhas=len(linhas), ms_min=round(min(tempos), 2),
+                         ms_mediana=round(statistics.median(tempos), 2),
+                         full_scans=full_scans, plano=plano, erro=None)
+    except Exception as e:
+        connection.rollback()
+        resultado.update(linhas=0, ms_min=None, ms_mediana=None, full_scans=[], plano=[],
+                         erro=str(e).split('\n')[0])
+    return resultado
+
+
+def comparar(resultado, anterior):
+
+    """Diferenças em relação à baseline: variação da mediana, regressão e full scans novos"""
+
+    if not anterior or resultado['erro'] or anterior.get('erro'):
+        return {}
+    antes, agora = anterior['ms_mediana'], resultado['ms_mediana']
+    return {
+        'razao': round(agora / antes, 2) if antes else None,
+        'regressao': agora > antes * LIMITE_REGRESSAO and agora - antes > MS_MINIMO_REGRESSAO,
+        'full_scans_novos': sorted(set(resultado['full_scans']) - set(anterior['full_scans'])),
+    }
+
+#############################################################
+# RELATÓRIO
+#############################################################
+
+def imprimir_resultados(resultados):
+    print(f"\n{'#':>3}  {'mediana':>10}  {'mínimo':>10}  {'linhas':>7}  consulta")
+    secao = None
+    for r in resultados:
+        if r['secao'] != secao:
+            secao = r['secao']
+            print(f"\n   {secao}")
+        if r['erro']:
+            print(f"{r['id']:>3}  {'-':>10}  {'-':>10}  {'-':>7}  {r['nome']}\n        ❌ {r['erro']}")
+            continue
+        marca = '  ⚠️  full scan: ' + ', '.join(r['full_scans']) if r['full_scans'] else ''
+        print(f"{r['id']:>3}  {r['ms_mediana']:>8.1f}ms  {r['ms_min']:>8.1f}ms  {r['linhas']:>7}  {r['nome']}{marca}")
+        comparacao = r.get('baseline') or {}
+        if comparacao.get('razao') is not None:
+            alerta = '  🔴 REGRESSÃO' if comparacao['regressao'] else ''
+            print(f"        vs baseline: {comparacao['razao']:.2f}x{alerta}")
+        if comparacao.get('full_scans_novos'):
+            print(f"        🔴 full scan novo: {', '.join(comparacao['full_scans_novos'])}")
+
+    medidas = [r for r in resultados if not r['erro']]
+    print(f"\n📊 {len(medidas)} consultas medidas, {len(resultados) - len(medidas)} com erro, "
+          f"{sum(1 for r in medidas if r['full_scans'])} com full scan, "
+          f"{sum(r['ms_mediana'] for r in medidas):.1f} ms no total (medianas)")
+
+
+def tem_regressao(resultados):
+    return any((r.get('baseline') or {}).get('regressao') or (r.get('baseline') or {}).get('full_scans_novos')
+               for r in resultados)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Latência e plano de execução das consultas de consultas_uteis.sql")
+    parser.add_argument('--url', default=URL_PADRAO, help="URL SQLAlchemy do banco (padrão: DB_CONFIG do loader)")
+    parser.add_argument('--sqlite', metavar='ARQUIVO',
+                        help="Banco SQLite do loader (--banco sqlite), com os PRAGMAs e o FIELD() do BancoSQLite")
+    parser.add_argument('--arquivo', default=ARQUIVO_CONSULTAS)
+    parser.add_argument('--repeticoes', type=int, default=REPETICOES)
+    parser.add_argument('--timeout', type=float, default=TIMEOUT_SEGUNDOS,
+                        help="Segundos máximos por execução (a consulta vira erro)")
+    parser.add_argument('--filtro', help="Só as consultas cujo nome ou seção contém este texto")
+    parser.add_argument('--saida', help="Grava o resultado em JSON (para servir de baseline depois)")
+    parser.add_argument('--baseline', help="JSON de uma execução anterior para comparação")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    consultas = ler_consultas(args.arquivo)
+    if args.filtro:
+        filtro = args.filtro.lower()
+        consultas = [c for c in consultas if filtro in c['nome'].lower() or filtro in c['secao'].lower()]
+    print(f"🔎 {len(consultas)} consultas em {args.arquivo}, {args.repeticoes} execuções cada")
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = {r['nome']: r for r in json.load(f)['resultados']}
+
+    engine = BancoSQLite(args.sqlite).criar_engine() if args.sqlite else create_engine(args.url)
+    resultados = []
+    with engine.connect() as connection:
+        limitar_tempo(connection, args.timeout)
+        for consulta in consultas:
+            resultado = medir_consulta(connection, consulta, args.repeticoes)
+            resultado['baseline'] = comparar(resultado, baseline.get(consulta['nome']))
+            resultados.append(resultado)
+
+    imprimir_resultados(resultados)
+
+    if args.saida:
+        os.makedirs(os.path.dirname(args.saida) or '.', exist_ok=True)
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump({'arquivo': args.arquivo, 'dialeto': engine.dialect.name, 'repeticoes': args.repeticoes,
+                       'resultados': resultados}, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Resultado gravado em {args.saida}")
+
+    # Código de saída != 0 permite usar o harness para barrar regressões
+    if tem_regressao(resultados):
+        print("\n🔴 Regressões em relação à baseline")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+#######################################################################
+# MÉTRICAS DO ETL - CRIMES CURITIBA
+#######################################################################
+
+# Cronômetros e contadores por etapa da carga, usados pelos dois loaders
+# (coleta_mysql.py e coleta_mysql_v2.py):
+# 1. Tempo e chamadas por etapa (download, staging Parquet, leitura, conversão, dimensões, chave_fato,
+#    fatos, agregados, remoção de versões antigas, commit)
+# 2. Contadores (linhas lidas, inseridas, já gravadas, chunks, bytes baixados, queries enviadas ao banco)
+# 3. Um registro JSON por arquivo e um por execução em data/metricas/cargas.jsonl
+# 4. Opcional: snapshot das métricas em http://127.0.0.1:<porta>/metricas durante a carga
+#
+# As medições são atribuídas ao arquivo que a thread está processando (ver Metricas.arquivo),
+# então download, leitura e gravação de arquivos diferentes podem acontecer ao mesmo tempo
+# (pipeline) sem misturar os números.
+#
+# Exemplo:
+#   tail -n 1 data/metricas/cargas.jsonl | python -m json.tool
+#   curl -s http://127.0.0.1:9100/metricas
+#######################################################################
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+from sqlalchemy import event
+
+#############################################################
+# CONFIGURAÇÕES
+#############################################################
+
+ARQUIVO_RELATORIO = os.path.join('data', 'metricas', 'cargas.jsonl')
+
+# Ordem das etapas nos relatórios
+ETAPAS = ('download', 'staging', 'leitura', 'conversao', 'dimensoes', 'chaves', 'fatos', 'agregados',
+          'substituicao', 'commit')
+
+# Medições feitas fora de um arquivo (cache das dimensões, calendário, etc.)
+SEM_ARQUIVO = '_execucao'
+
+
+def nome_arquivo(origem):
+
+    """Nome do arquivo de uma URL ou caminho local (a mesma chave para os dois)"""
+
+    return os.path.basename(unquote(urlparse(origem).path)) or origem
+
+
+def _acumuladores():
+    return {'segundos': defaultdict(float), 'chamadas': defaultdict(int), 'contadores': defaultdict(int)}
+
+
+def _somar(destino, origem):
+    for campo in ('segundos', 'chamadas', 'contadores'):
+        for chave, valor in origem[campo].items():
+            destino[campo][chave] += valor
+
+
+def _exportar(acumuladores):
+
+    """Acumuladores -> dicionário serializável, com as etapas na ordem de ETAPAS"""
+
+    nomes = sorted(acumuladores['segundos'], key=lambda e: (ETAPAS.index(e) if e in ETAPAS else len(ETAPAS), e))
+    return {
+        'etapas': {e: {'segundos': round(acumuladores['segundos'][e], 3), 'chamadas': acumuladores['chamadas'][e]}
+                   for e in nomes},
+        'contadores': dict(acumuladores['contadores']),
+    }
+
+#############################################################
+# COLETA
+#############################################################
+
+class Metricas:
+
+    """
+    Acumula tempo por etapa e contadores por arquivo. Thread-safe: cada thread informa
+    o arquivo em que está trabalhando com `with METRICAS.arquivo(origem)`.
+    Um arquivo sai de "em andamento" quando fechar_arquivo é chamado; registrar_arquivo
+    soma o registro nos totais da execução e grava a linha no relatório.
+    """
+
+    def __init__(self):
+        self._trava = threading.Lock()
+        self._local = threading.local()
+        self.destino = None
+        self.iniciar_execucao()
+
+    def iniciar_execucao(self, destino=None):
+        with self._trava:
+            self.destino = destino
+            self.execucao = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+            self.inicio = time.time()
+            self.totais = _acumuladores()
+            self.em_andamento = defaultdict(_acumuladores)
+            self.arquivos_registrados = 0
+            self.linhas_registradas = 0
+            self.segundos_arquivos = 0.0
+
+    # --- arquivo atual da thread ---
+
+    @contextlib.contextmanager
+    def arquivo(self, origem):
+        anterior = getattr(self._local, 'arquivo', None)
+        self._local.arquivo = nome_arquivo(origem)
+        try:
+            yield
+        finally:
+            self._local.arquivo = anterior
+
+    def _atual(self):
+        return self.em_andamento[getattr(self._local, 'arquivo', None) or SEM_ARQUIVO]
+
+    # --- medições ---
+
+    @contextlib.contextmanager
+    def etapa(self, nome):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            segundos = time.perf_counter() - inicio
+            with self._trava:
+                acumuladores = self._atual()
+                acumuladores['segundos'][nome] += segundos
+                acumuladores['chamadas'][nome] += 1
+
+    def medir(self, nome):
+
+        """Decorador: mede cada chamada da função como a etapa `nome`"""
+
+        def decorador(funcao):
+            @functools.wraps(funcao)
+            def envolvida(*args, **kwargs):
+                with self.etapa(nome):
+                    return funcao(*args, **kwargs)
+            return envolvida
+        return decorador
+
+    def medir_iterador(self, iteravel, nome):
+
+        """Mede o tempo gasto produzindo cada item (ex.: chunks lidos do CSV)"""
+
+        iterador = iter(iteravel)
+        while True:
+            with self.etapa(nome):
+                try:
+                    item = next(iterador)
+                except StopIteration:
+                    return
+            yield item
+
+    def contar(self, nome, quantidade=1):
+        with self._trava:
+            self._atual()['contadores'][nome] += quantidade
+
+    def observar(self, engine):
+
+        """Conta as queries enviadas pela engine (um executemany conta como uma)"""
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _contar_query(conn, cursor, statement, parameters, context, executemany):
+            self.contar('queries')
+
+    # --- fechamento e relatório ---
+
+    def fechar_arquivo(self, origem, linhas, segundos):
+
+        """Tira o arquivo de "em andamento" e devolve suas métricas, com linhas/s e queries"""
+
+        with self._trava:
+            acumuladores = self.em_andamento.pop(nome_arquivo(origem), None) or _acumuladores()
+        registro = _exportar(acumuladores)
+        registro.update(
+            linhas=linhas,
+            segundos=round(segundos, 3),
+            linhas_por_segundo=round(linhas / segundos, 1) if segundos else 0.0,
+            queries=registro['contadores'].get('queries', 0),
+        )
+        return registro
+
+    def registrar_arquivo(self, resumo):
+
+        """
+        Soma as métricas de um arquivo (resumo['metricas'], vindas deste processo ou de um worker)
+        nos totais da execução e grava uma linha {'tipo': 'arquivo', ...} no relatório.
+        Resumos sem métricas (arquivo pulado ou com erro antes da carga) fecham o que foi medido até ali.
+        """
+
+        metricas = resumo.get('metricas') or self.fechar_arquivo(resumo['arquivo'], 0, 0.0)
+        with self._trava:
+            for etapa, dados in metricas['etapas'].items():
+                self.totais['segundos'][etapa] += dados['segundos']
+                self.totais['chamadas'][etapa] += dados['chamadas']
+            for contador, valor in metricas['contadores'].items():
+                self.totais['contadores'][contador] += valor
+            self.arquivos_registrados += 1
+            self.linhas_registradas += metricas['linhas']
+            self.segundos_arquivos += metricas['segundos']
+        self._gravar({
+            'tipo': 'arquivo', 'execucao': self.execucao, 'registrado_em': datetime.now().isoformat(timespec='seconds'),
+            'arquivo': resumo['arquivo'], 'status': resumo.get('status'), 'erro': resumo.get('erro'),
+            'inseridos': resumo.get('inseridos', 0), 'erros': resumo.get('erros', 0), **metricas,
+        })
+
+    def snapshot(self):
+
+        """Totais da execução (arquivos registrados + em andamento) e o detalhe de cada arquivo em andamento"""
+
+        with self._trava:
+            totais = _acumuladores()
+            _somar(totais, self.totais)
+            em_andamento = {}
+            for nome, acumuladores in self.em_andamento.items():
+                _somar(totais, acumuladores)
+                em_andamento[nome] = _exportar(acumuladores)
+            resultado = _exportar(totais)
+            resultado.update(
+                execucao=self.execucao,
+                inicio=datetime.fromtimestamp(self.inicio).isoformat(timespec='seconds'),
+                segundos_decorridos=round(time.time() - self.inicio, 1),
+                arquivos_concluidos=self.arquivos_registrados,
+                linhas=self.linhas_registradas,
+                linhas_por_segundo=(round(self.linhas_registradas / self.segundos_arquivos, 1)
+                                    if self.segundos_arquivos else 0.0),
+                queries=resultado['contadores'].get('queries', 0),
+                em_andamento=em_andamento,
+            )
+        return resultado
+
+    def finalizar_execucao(self):
+
+        """Grava a linha {'tipo': 'execucao', ...} com os totais e devolve o snapshot"""
+
+        resultado = self.snapshot()
+        self._gravar({'tipo': 'execucao', 'registrado_em': datetime.now().isoformat(timespec='seconds'),
+                      **resultado})
+        return resultado
+
+    def _gravar(self, registro):
+        if not self.destino:
+            return
+        os.makedirs(os.path.dirname(self.destino) or '.', exist_ok=True)
+        linha = json.dumps(registro, ensure_ascii=False, default=str)
+        with self._trava, open(self.destino, 'a', encoding='utf-8') as f:
+            f.write(linha + '\n')
+
+
+METRICAS = Metricas()
+
+#############################################################
+# RELATÓRIO NO TERMINAL
+#############################################################
+
+def imprimir_etapas(resultado):
+    etapas = resultado['etapas']
+    total = sum(d['segundos'] for d in etapas.values()) or 1.0
+    print(f"\n⏱️  Tempo por etapa ({resultado['linhas']:,} linhas, {resultado['linhas_por_segundo']:,.0f} linhas/s, "
+          f"{resultado['queries']:,} queries):")
+    for etapa, dados in etapas.items():
+        print(f"   {etapa:<12}{dados['segundos']:>10.2f}s{dados['segundos'] * 100 / total:>6.1f}%"
+              f"{dados['chamadas']:>10} chamadas")
+
+#############################################################
+# ENDPOINT HTTP
+#############################################################
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.rstrip('/') not in ('', '/metricas'):
+            self.send_error(404)
+            return
+        corpo = json.dumps(METRICAS.snapshot(), ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def servir_http(porta, host='127.0.0.1'):
+
+    """Sobe o endpoint GET /metricas numa thread daemon e devolve o servidor (para shutdown)"""
+
+    servidor = ThreadingHTTPServer((host, porta), _Handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    print(f"📈 Métricas em http://{host}:{servidor.server_address[1]}/metricas")
+    return servidor
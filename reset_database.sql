@@ -0,0 +1,35 @@
+-- Apaga as tabelas e as views dos dois modelos (coleta_mysql.py e coleta_mysql_v2.py) do banco
+-- crimes_curitiba, COM TODOS OS DADOS, inclusive o manifesto de cargas. Depois recrie o esquema:
+--   mysql -u root -p < reset_database.sql
+--   mysql -u root -p < setup_database.sql
+
+USE crimes_curitiba;
+
+-- Modelo v2 (views primeiro; fato antes das dimensões por causa das FKs)
+DROP VIEW IF EXISTS vw_crimes_por_periodo;
+DROP VIEW IF EXISTS vw_top_bairros;
+DROP VIEW IF EXISTS vw_crimes_por_ano;
+DROP VIEW IF EXISTS vw_ocorrencias_completas;
+DROP TABLE IF EXISTS AGG_CRIMES_ANO;
+DROP TABLE IF EXISTS AGG_CRIMES_MES;
+DROP TABLE IF EXISTS AGG_CRIMES_BAIRRO;
+DROP TABLE IF EXISTS AGG_CRIMES_TIPO;
+DROP TABLE IF EXISTS AGG_CRIMES_CATEGORIA;
+DROP TABLE IF EXISTS AGG_CRIMES_PERIODO;
+DROP TABLE IF EXISTS FATO_OCORRENCIA;
+DROP TABLE IF EXISTS DIM_TEMPO;
+DROP TABLE IF EXISTS DIM_NATUREZA;
+DROP TABLE IF EXISTS DIM_LOCAL;
+DROP TABLE IF EXISTS DIM_HORA;
+
+-- Controle de carga criado pelo coleta_mysql_v2.py (sem ele, os arquivos seriam pulados como já carregados)
+DROP TABLE IF EXISTS CARGA_MANIFESTO;
+DROP TABLE IF EXISTS CARGA_VERSAO;
+
+-- Modelo v1 (ordem correta para não quebrar FKs)
+DROP TABLE IF EXISTS OCORRENCIA;
+DROP TABLE IF EXISTS TEMPO;
+DROP TABLE IF EXISTS NATUREZA;
+DROP TABLE IF EXISTS LOCAL;
+
+SELECT 'Tabelas removidas: rode o setup_database.sql para criá-las de novo' AS status;
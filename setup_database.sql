@@ -1,21 +1,20 @@
 -- 1. Cria o banco de dados (se não existir) e seleciona ele
-CREATE DATABASE IF NOT EXISTS crimes_db 
+-- Um único banco para os dois loaders: coleta_mysql.py (TEMPO, NATUREZA, LOCAL, OCORRENCIA)
+-- e coleta_mysql_v2.py (DIM_*, FATO_OCORRENCIA, AGG_*)
+CREATE DATABASE IF NOT EXISTS crimes_curitiba 
 CHARACTER SET utf8mb4 
 COLLATE utf8mb4_unicode_ci;
 
-USE crimes_db;
+USE crimes_curitiba;
 
--- 2. Limpeza: Remove tabelas antigas se existirem (Ordem correta para não quebrar FKs)
-DROP TABLE IF EXISTS OCORRENCIA;
-DROP TABLE IF EXISTS TEMPO;
-DROP TABLE IF EXISTS NATUREZA;
-DROP TABLE IF EXISTS LOCAL;
+-- 2. O script só cria o que ainda não existe e pode ser executado de novo sem perder dados.
+-- Para apagar tudo e recomeçar do zero, rode antes o reset_database.sql
 
 -- -----------------------------------------------------
 -- 3. Tabela Dimensão: TEMPO
 -- Armazena as datas para evitar repetição
 -- -----------------------------------------------------
-CREATE TABLE TEMPO (
+CREATE TABLE IF NOT EXISTS TEMPO (
     tempo_id INT AUTO_INCREMENT PRIMARY KEY,
     data_completa DATE NOT NULL,
     ocorrencia_ano INT,
@@ -31,7 +30,7 @@ CREATE TABLE TEMPO (
 -- 4. Tabela Dimensão: NATUREZA
 -- Armazena os tipos de crime e descrições
 -- -----------------------------------------------------
-CREATE TABLE NATUREZA (
+CREATE TABLE IF NOT EXISTS NATUREZA (
     natureza_id INT AUTO_INCREMENT PRIMARY KEY,
     natureza1_descricao VARCHAR(255),
     natureza2_descricao VARCHAR(255),
@@ -45,7 +44,7 @@ CREATE TABLE NATUREZA (
 -- 5. Tabela Dimensão: LOCAL
 -- Armazena endereços, bairros e regionais
 -- -----------------------------------------------------
-CREATE TABLE LOCAL (
+CREATE TABLE IF NOT EXISTS LOCAL (
     local_id INT AUTO_INCREMENT PRIMARY KEY,
     bairro_nome VARCHAR(100),
     regional_nome VARCHAR(100),
@@ -60,12 +59,16 @@ CREATE TABLE LOCAL (
 -- 6. Tabela Fato: OCORRENCIA
 -- Liga tudo e armazena o evento
 -- -----------------------------------------------------
-CREATE TABLE OCORRENCIA (
+CREATE TABLE IF NOT EXISTS OCORRENCIA (
     ocorrencia_id INT AUTO_INCREMENT PRIMARY KEY,
     tempo_id INT NOT NULL,
     natureza_id INT NOT NULL,
     local_id INT NOT NULL,
     ocorrencia_hora VARCHAR(10), -- Mantemos varchar pois as vezes vem "10:30" as vezes "NULL"
+    atendimento_numero BIGINT,
+    chave_ocorrencia BIGINT NOT NULL, -- hash da linha: rodar o script de novo não duplica ocorrências
+
+    UNIQUE KEY uk_ocorrencia_chave (chave_ocorrencia),
     
     -- Chaves Estrangeiras (FK) conectando às dimensões
     CONSTRAINT fk_ocorrencia_tempo 
@@ -82,4 +85,207 @@ CREATE TABLE OCORRENCIA (
 ) ENGINE=InnoDB;
 
 -- Confirmação
-SELECT 'Tabelas criadas com sucesso!' AS status;
\ No newline at end of file
+SELECT 'Modelo v1 criado com sucesso!' AS status;
+
+-- =====================================================
+-- MODELO DIMENSIONAL v2 (coleta_mysql_v2.py)
+-- =====================================================
+-- DIM_TEMPO e DIM_HORA são pré-geradas pelo loader (preparar_dimensoes_fixas), com
+-- tempo_id = aaaammdd e hora_id = minuto do dia + 1.
+-- Ids em BIGINT para aceitar os dois modos de chave de DIM_NATUREZA/DIM_LOCAL:
+--   --chaves auto_increment (padrão): ids gerados pelo AUTO_INCREMENT
+--   --chaves hash: natureza_id/local_id = hash de 63 bits da chave natural
+-- Use sempre o mesmo modo num banco.
+
+-- -----------------------------------------------------
+-- Dimensão: DIM_TEMPO
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS DIM_TEMPO (
+    tempo_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    data_completa DATE NOT NULL,
+    ocorrencia_ano INT,
+    ocorrencia_mes INT,
+    ocorrencia_dia INT,
+    ocorrencia_dia_semana VARCHAR(50),
+    ocorrencia_periodo VARCHAR(50),
+    nome_mes VARCHAR(20),
+    trimestre TINYINT,
+    semestre TINYINT,
+
+    UNIQUE KEY idx_dim_tempo_data (data_completa),
+    -- Filtros e agrupamentos por ano/mês e dia da semana (o InnoDB inclui o tempo_id em cada índice)
+    INDEX idx_dim_tempo_ano_mes (ocorrencia_ano, ocorrencia_mes, nome_mes),
+    INDEX idx_dim_tempo_dia_semana (ocorrencia_dia_semana)
+) ENGINE=InnoDB;
+
+-- -----------------------------------------------------
+-- Dimensão: DIM_NATUREZA
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS DIM_NATUREZA (
+    natureza_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    natureza1_codigo INT,
+    natureza1_descricao VARCHAR(255),
+    natureza2_descricao VARCHAR(255),
+    tipo_envolvimento VARCHAR(100),
+    categoria_crime VARCHAR(50),
+
+    -- Busca pela chave natural (get_or_create_natureza); também atende os filtros por tipo de crime
+    INDEX idx_dim_natureza_busca (natureza1_descricao, natureza2_descricao, tipo_envolvimento),
+    INDEX idx_dim_natureza_categoria (categoria_crime)
+) ENGINE=InnoDB;
+
+-- -----------------------------------------------------
+-- Dimensão: DIM_LOCAL
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS DIM_LOCAL (
+    local_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    bairro_nome VARCHAR(100),
+    regional_nome VARCHAR(100),
+    logradouro_nome VARCHAR(255),
+    classificacao_bairro_regional VARCHAR(100),
+
+    -- Busca pela chave natural (get_or_create_local); também atende os filtros por bairro
+    INDEX idx_dim_local_busca (bairro_nome, regional_nome, logradouro_nome),
+    INDEX idx_dim_local_regional (regional_nome, bairro_nome)
+) ENGINE=InnoDB;
+
+-- -----------------------------------------------------
+-- Dimensão: DIM_HORA
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS DIM_HORA (
+    hora_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    hora_completa VARCHAR(8) NOT NULL,
+    hora TINYINT,
+    minuto TINYINT,
+    periodo_dia VARCHAR(20),
+
+    UNIQUE KEY idx_dim_hora_completa (hora_completa),
+    INDEX idx_dim_hora_periodo (periodo_dia, hora)
+) ENGINE=InnoDB;
+
+-- -----------------------------------------------------
+-- Fato: FATO_OCORRENCIA
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS FATO_OCORRENCIA (
+    ocorrencia_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    tempo_id BIGINT NOT NULL,
+    natureza_id BIGINT NOT NULL,
+    local_id BIGINT NOT NULL,
+    hora_id BIGINT,
+    atendimento_numero BIGINT,
+    -- Chave da carga idempotente: hash de 63 bits do atendimento, das chaves das dimensões e da
+    -- ordem da linha entre as iguais do mesmo arquivo (ver calcular_chaves_fato no loader)
+    chave_fato BIGINT NOT NULL,
+    -- Arquivo de origem da linha (hash do nome do arquivo, ver id_arquivo no loader)
+    arquivo_id BIGINT,
+
+    -- Recarregar um arquivo não duplica linhas: o loader grava com INSERT IGNORE e, no fim da
+    -- recarga, remove as linhas do mesmo arquivo cuja chave não veio mais nele
+    UNIQUE KEY uk_fato_chave (chave_fato),
+    INDEX idx_fato_arquivo (arquivo_id, chave_fato),
+
+    -- Índices compostos que cobrem as chaves das dimensões: os relatórios filtrados por data,
+    -- bairro ou tipo de crime chegam na fato pela dimensão filtrada e leem as demais chaves
+    -- do próprio índice, sem acessar a linha. A primeira coluna de cada um atende também a FK.
+    -- (harness_consultas.py mede a latência e o plano das consultas com e sem eles)
+    INDEX idx_fato_tempo (tempo_id, natureza_id, local_id, hora_id),
+    INDEX idx_fato_local (local_id, tempo_id, natureza_id, hora_id),
+    INDEX idx_fato_natureza (natureza_id, tempo_id, local_id, hora_id),
+    INDEX idx_fato_hora (hora_id, natureza_id),
+
+    CONSTRAINT fk_fato_tempo FOREIGN KEY (tempo_id) REFERENCES DIM_TEMPO (tempo_id),
+    CONSTRAINT fk_fato_natureza FOREIGN KEY (natureza_id) REFERENCES DIM_NATUREZA (natureza_id),
+    CONSTRAINT fk_fato_local FOREIGN KEY (local_id) REFERENCES DIM_LOCAL (local_id),
+    CONSTRAINT fk_fato_hora FOREIGN KEY (hora_id) REFERENCES DIM_HORA (hora_id)
+) ENGINE=InnoDB;
+
+-- As tabelas CARGA_MANIFESTO (controle de retomada) e CARGA_VERSAO (versão dos dados,
+-- usada pelo cache do consultas_crimes.py) são criadas pelo próprio loader.
+
+-- -----------------------------------------------------
+-- Tabelas agregadas dos relatórios padrão
+-- Mantidas pelo loader: cada chunk soma as suas contagens na mesma transação
+-- em que grava a FATO_OCORRENCIA. Para reconstruir a partir da tabela fato:
+--   python coleta_mysql_v2.py --recalcular-agregados
+-- Textos ausentes ficam como '' (a chave primária não aceita NULL).
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS AGG_CRIMES_ANO (
+    ocorrencia_ano INT NOT NULL PRIMARY KEY,
+    total BIGINT NOT NULL
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS AGG_CRIMES_MES (
+    ocorrencia_ano INT NOT NULL,
+    ocorrencia_mes INT NOT NULL,
+    nome_mes VARCHAR(20),
+    total BIGINT NOT NULL,
+    PRIMARY KEY (ocorrencia_ano, ocorrencia_mes)
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS AGG_CRIMES_BAIRRO (
+    bairro_nome VARCHAR(100) NOT NULL,
+    regional_nome VARCHAR(100) NOT NULL,
+    total BIGINT NOT NULL,
+    PRIMARY KEY (bairro_nome, regional_nome)
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS AGG_CRIMES_TIPO (
+    tipo_crime VARCHAR(255) NOT NULL PRIMARY KEY,
+    total BIGINT NOT NULL
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS AGG_CRIMES_CATEGORIA (
+    categoria_crime VARCHAR(50) NOT NULL PRIMARY KEY,
+    total BIGINT NOT NULL
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS AGG_CRIMES_PERIODO (
+    periodo_dia VARCHAR(20) NOT NULL PRIMARY KEY,
+    total BIGINT NOT NULL
+) ENGINE=InnoDB;
+
+-- -----------------------------------------------------
+-- Views para análise (consultas_uteis.sql e Power BI)
+-- -----------------------------------------------------
+CREATE OR REPLACE VIEW vw_ocorrencias_completas AS
+SELECT
+    f.ocorrencia_id,
+    f.atendimento_numero,
+    t.data_completa,
+    t.ocorrencia_ano,
+    t.ocorrencia_mes,
+    t.nome_mes,
+    t.ocorrencia_dia_semana,
+    t.trimestre,
+    t.semestre,
+    h.hora_completa,
+    h.hora,
+    h.periodo_dia,
+    n.natureza1_descricao AS tipo_crime,
+    n.natureza2_descricao,
+    n.tipo_envolvimento,
+    n.categoria_crime,
+    l.bairro_nome,
+    l.regional_nome,
+    l.logradouro_nome
+FROM FATO_OCORRENCIA f
+JOIN DIM_TEMPO t ON f.tempo_id = t.tempo_id
+JOIN DIM_NATUREZA n ON f.natureza_id = n.natureza_id
+JOIN DIM_LOCAL l ON f.local_id = l.local_id
+LEFT JOIN DIM_HORA h ON f.hora_id = h.hora_id;
+
+-- Views de resumo: leem as tabelas agregadas (sem varrer a tabela fato)
+CREATE OR REPLACE VIEW vw_crimes_por_ano AS
+SELECT ocorrencia_ano, total AS total_ocorrencias
+FROM AGG_CRIMES_ANO;
+
+CREATE OR REPLACE VIEW vw_top_bairros AS
+SELECT NULLIF(bairro_nome, '') AS bairro_nome, NULLIF(regional_nome, '') AS regional_nome,
+       total AS total_ocorrencias
+FROM AGG_CRIMES_BAIRRO;
+
+CREATE OR REPLACE VIEW vw_crimes_por_periodo AS
+SELECT periodo_dia, total AS total_ocorrencias
+FROM AGG_CRIMES_PERIODO;
+
+SELECT 'Modelo v2 criado com sucesso!' AS status;
\ No newline at end of file
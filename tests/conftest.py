@@ -0,0 +1,65 @@
+import csv
+import os
+import re
+import sys
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+# Os scripts do projeto ficam na raiz do repositório (sem pacote)
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+import benchmark_etl  # noqa: E402
+import coleta_mysql_v2  # noqa: E402
+
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+
+    """Banco SQLite vazio com o modelo estrela e o manifesto; data/ fica dentro do tmp_path"""
+
+    monkeypatch.chdir(tmp_path)
+    engine = benchmark_etl.criar_banco_local(str(tmp_path / 'crimes.db'))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def cache(banco):
+    cache = coleta_mysql_v2.CacheDimensoes()
+    with banco.connect() as connection:
+        cache.carregar(connection)
+    return cache
+
+
+@pytest.fixture
+def load_data_emulado(monkeypatch):
+
+    """
+    LOAD DATA LOCAL INFILE no SQLite, com a semântica do MySQL: o TSV é lido na ordem da lista
+    de colunas do comando, campos a mais na linha são descartados e '\\N' vira NULL (IGNORE:
+    chave repetida é pulada). SHOW COUNT(*) WARNINGS responde 0.
+    """
+
+    execute = Connection.execute
+
+    def executar(self, statement, parametros=None, *args, **kwargs):
+        sql = str(statement).strip()
+        if sql.startswith('LOAD DATA'):
+            tabela = re.search(r'INTO TABLE (\w+)', sql).group(1)
+            colunas = [coluna.strip() for coluna in sql[sql.rindex('(') + 1:sql.rindex(')')].split(',')]
+            with open(parametros['arquivo'], encoding='utf-8', newline='') as arquivo:
+                linhas = [tuple(None if campo == '\\N' else campo for campo in linha[:len(colunas)])
+                          for linha in csv.reader(arquivo, delimiter='\t')]
+            marcadores = ', '.join('?' * len(colunas))
+            return self.exec_driver_sql(
+                f"INSERT OR IGNORE INTO {tabela} ({', '.join(colunas)}) VALUES ({marcadores})", linhas
+            )
+        if sql == 'SHOW COUNT(*) WARNINGS':
+            return execute(self, text("SELECT 0"))
+        return execute(self, statement, parametros, *args, **kwargs)
+
+    monkeypatch.setattr(Connection, 'execute', executar)
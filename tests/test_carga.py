@@ -0,0 +1,456 @@
+"""
+Carga ponta a ponta do coleta_mysql_v2.py num SQLite temporário, com CSVs locais ou servidos por
+um http.server local: GET condicional (304), retomada após queda, recarga idempotente, modos de
+carga, workers, staging Parquet, chaves hash e tabelas agregadas.
+"""
+
+import functools
+import os
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
+
+import benchmark_etl
+import coleta_mysql_v2
+from bancos_etl import BancoSQLite
+
+
+@pytest.fixture
+def servidor(tmp_path, monkeypatch):
+
+    """Serve um diretório temporário por HTTP; devolve (diretório, url base, status das respostas)"""
+
+    diretorio = tmp_path / 'portal'
+    diretorio.mkdir()
+    respostas = []
+
+    class Handler(SimpleHTTPRequestHandler):
+        def log_request(self, code='-', size='-'):
+            respostas.append(int(code))
+
+        def log_message(self, *args):
+            pass
+
+    monkeypatch.setenv('NO_PROXY', '127.0.0.1')
+    http = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(Handler, directory=str(diretorio)))
+    thread = threading.Thread(target=http.serve_forever, daemon=True)
+    thread.start()
+    yield diretorio, f'http://127.0.0.1:{http.server_address[1]}', respostas
+    http.shutdown()
+    http.server_close()
+
+
+def gerar_csv(caminho, linhas, ano=2019, seed=1):
+
+    """CSV sintético; os atendimentos começam em 1.000.000 em todo arquivo, como nos anuais do portal"""
+
+    benchmark_etl.gerar_csv_sigesguarda(str(caminho), linhas, ano=ano, seed=seed)
+    return pd.read_csv(caminho, sep=';', encoding='latin1', dtype=str)
+
+
+def gravar_csv(caminho, df, minutos=1):
+
+    """Reescreve o CSV e adianta a data de modificação"""
+
+    df.to_csv(caminho, sep=';', encoding='latin1', index=False)
+    adiantar_data(caminho, minutos)
+
+
+def adiantar_data(caminho, minutos=1):
+
+    """Data de modificação no futuro: o http.server compara o If-Modified-Since em segundos"""
+
+    futuro = time.time() + 60 * minutos
+    os.utime(caminho, (futuro, futuro))
+
+
+def derrubar_no_chunk(monkeypatch, numero):
+
+    """Faz o carregar_chunk falhar no chunk `numero` (queda no meio do arquivo); devolve o original"""
+
+    carregar_chunk = coleta_mysql_v2.carregar_chunk
+    chamadas = []
+
+    def cair(*args, **kwargs):
+        chamadas.append(1)
+        if len(chamadas) == numero:
+            raise RuntimeError('queda simulada')
+        return carregar_chunk(*args, **kwargs)
+
+    monkeypatch.setattr(coleta_mysql_v2, 'carregar_chunk', cair)
+    return carregar_chunk
+
+
+def carregar(url, banco, cache, usar_staging=False, **opcoes):
+    return coleta_mysql_v2.processar_arquivo(url, banco, cache, usar_staging=usar_staging, **opcoes)
+
+
+def contar_fatos(banco, arquivo=None):
+    sql = "SELECT COUNT(*) FROM FATO_OCORRENCIA"
+    parametros = {}
+    if arquivo is not None:
+        sql += " WHERE arquivo_id = :arquivo"
+        parametros['arquivo'] = coleta_mysql_v2.id_arquivo(arquivo)
+    with banco.connect() as connection:
+        return connection.execute(text(sql), parametros).scalar()
+
+
+def status_manifesto(banco, url):
+    with banco.connect() as connection:
+        return coleta_mysql_v2.ler_manifesto(connection, url)['status']
+
+
+def agregados(banco):
+    with banco.connect() as connection:
+        return {tabela: sorted(map(tuple, connection.execute(text(f"SELECT * FROM {tabela}")).all()))
+                for tabela in coleta_mysql_v2.AGREGADOS}
+
+
+def assert_agregados_conferem(banco):
+
+    """As tabelas agregadas mantidas pelo loader são iguais às recalculadas a partir da fato"""
+
+    mantidos = agregados(banco)
+    coleta_mysql_v2.recalcular_agregados(banco)
+    assert mantidos == agregados(banco)
+
+
+def test_download_condicional_so_recarrega_conteudo_novo(banco, cache, servidor):
+    diretorio, base, respostas = servidor
+    csv = diretorio / 'ocorrencias_2019.csv'
+    gerar_csv(csv, 300)
+    url = f'{base}/ocorrencias_2019.csv'
+
+    primeiro = carregar(url, banco, cache)
+    assert respostas == [200]
+    assert primeiro['status'] == 'baixado'
+    assert primeiro['inseridos'] == contar_fatos(banco) == 300
+    assert coleta_mysql_v2.CONTADOR_DOWNLOADS[url] == 1
+
+    # Mesmo arquivo no servidor: 304, nada baixado nem gravado
+    segundo = carregar(url, banco, cache)
+    assert respostas[-1] == 304
+    assert segundo['status'] == 'já carregado'
+    assert coleta_mysql_v2.CONTADOR_DOWNLOADS[url] == 1
+
+    # touch: o servidor manda o arquivo de novo, mas o hash é o mesmo e a carga é pulada
+    adiantar_data(csv)
+    terceiro = carregar(url, banco, cache)
+    assert respostas[-1] == 200
+    assert coleta_mysql_v2.CONTADOR_DOWNLOADS[url] == 2
+    assert terceiro['status'] == 'já carregado'
+    assert contar_fatos(banco) == 300
+
+    # Conteúdo novo: gravado, e as linhas que saíram do arquivo são removidas
+    novo = gerar_csv(csv, 200, seed=2)
+    adiantar_data(csv, minutos=2)
+    quarto = carregar(url, banco, cache)
+    assert respostas[-1] == 200
+    assert quarto['inseridos'] + quarto['ja_gravados'] == len(novo)
+    assert quarto['substituidos'] == 300 - quarto['ja_gravados']
+    assert contar_fatos(banco) == len(novo)
+    assert status_manifesto(banco, url) == 'COMPLETO'
+    assert_agregados_conferem(banco)
+
+
+def test_retomada_apos_queda_grava_todas_as_linhas(banco, cache, servidor, monkeypatch):
+    diretorio, base, _ = servidor
+    csv = diretorio / 'retomada_2019.csv'
+    df = gerar_csv(csv, 4)
+    # A linha 3 (chunk 2) é igual à linha 1, que já estará confirmada quando a carga cair
+    df.iloc[2] = df.iloc[0]
+    gravar_csv(csv, df)
+    url = f'{base}/retomada_2019.csv'
+
+    carregar_chunk = derrubar_no_chunk(monkeypatch, 2)
+    interrompida = carregar(url, banco, cache, tamanho_chunk=2)
+    assert interrompida['chunks_com_erro'] == 1
+    assert contar_fatos(banco) == 2
+    assert status_manifesto(banco, url) == 'EM_ANDAMENTO'
+
+    monkeypatch.setattr(coleta_mysql_v2, 'carregar_chunk', carregar_chunk)
+    retomada = carregar(url, banco, cache, tamanho_chunk=2)
+    assert 'retomado' in retomada['status']
+    assert retomada['inseridos'] == 2
+    assert retomada['ja_gravados'] == 2
+    assert contar_fatos(banco) == 4
+    assert status_manifesto(banco, url) == 'COMPLETO'
+    assert_agregados_conferem(banco)
+
+
+def test_recarga_so_substitui_linhas_do_proprio_arquivo(banco, cache, servidor):
+    diretorio, base, _ = servidor
+    urls = {}
+    for ano in (2019, 2020):
+        gerar_csv(diretorio / f'ocorrencias_{ano}.csv', 600, ano=ano, seed=ano)
+        urls[ano] = f'{base}/ocorrencias_{ano}.csv'
+        carregar(urls[ano], banco, cache)
+    assert contar_fatos(banco) == 1200
+
+    # --forcar com o mesmo conteúdo: nada gravado nem removido (os atendimentos se repetem entre os anos)
+    recarga = carregar(urls[2019], banco, cache, forcar=True)
+    assert (recarga['inseridos'], recarga['ja_gravados'], recarga['substituidos']) == (0, 600, 0)
+    assert contar_fatos(banco) == 1200
+
+    # Um atendimento some do arquivo e uma linha muda de natureza
+    csv = diretorio / 'ocorrencias_2019.csv'
+    df = pd.read_csv(csv, sep=';', encoding='latin1', dtype=str)
+    alvo = df['ATENDIMENTO_NUMERO'].iloc[10]
+    removidas = int((df['ATENDIMENTO_NUMERO'] == alvo).sum())
+    df = df[df['ATENDIMENTO_NUMERO'] != alvo].reset_index(drop=True)
+    df.loc[0, 'NATUREZA1_DESCRICAO'] = 'NATUREZA ALTERADA'
+    gravar_csv(csv, df)
+
+    alterada = carregar(urls[2019], banco, cache)
+    assert alterada['inseridos'] == 1
+    assert alterada['substituidos'] == removidas + 1
+    assert contar_fatos(banco, 'ocorrencias_2019.csv') == 600 - removidas
+    assert contar_fatos(banco, 'ocorrencias_2020.csv') == 600
+    assert_agregados_conferem(banco)
+
+
+def test_linhas_rejeitadas_pelo_banco_nao_entram_nos_agregados(banco, cache, servidor):
+    diretorio, base, _ = servidor
+    gerar_csv(diretorio / 'ocorrencias_2019.csv', 300)
+    gerar_csv(diretorio / 'copia_2019.csv', 300)
+    carregar(f'{base}/ocorrencias_2019.csv', banco, cache)
+
+    # Filtro de chaves desatualizado (como se outro processo tivesse gravado as linhas): o
+    # INSERT OR IGNORE rejeita todas e os agregados não podem mudar
+    cache.chaves_fato = cache.chaves_fato[:0]
+    copia = carregar(f'{base}/copia_2019.csv', banco, cache)
+    assert copia['inseridos'] == 0
+    assert copia['rejeitados'] == 300
+    assert contar_fatos(banco) == 300
+    assert_agregados_conferem(banco)
+
+
+
+def test_load_data_grava_o_arquivo_de_cada_linha(banco, cache, servidor, load_data_emulado):
+    diretorio, base, _ = servidor
+    df = gerar_csv(diretorio / 'ocorrencias_2019.csv', 300)
+    carregar(f'{base}/ocorrencias_2019.csv', banco, cache, modo_carga='load_data')
+    with banco.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM FATO_OCORRENCIA WHERE arquivo_id IS NULL")).scalar() == 0
+    assert contar_fatos(banco, 'ocorrencias_2019.csv') == 300
+
+    # Metade das linhas já está no banco e o filtro de chaves não sabe: o LOAD DATA rejeita essas,
+    # e só as aceitas (achadas pelo arquivo_id) entram nos agregados
+    copia = pd.concat([df.iloc[:150], gerar_csv(diretorio / 'outro_2019.csv', 150, seed=2)])
+    gravar_csv(diretorio / 'copia_2019.csv', copia)
+    cache.chaves_fato = cache.chaves_fato[:0]
+    resumo = carregar(f'{base}/copia_2019.csv', banco, cache, modo_carga='load_data')
+    assert (resumo['inseridos'], resumo['rejeitados']) == (150, 150)
+    assert contar_fatos(banco) == 450
+    assert_agregados_conferem(banco)
+
+
+def test_deadlock_refaz_o_chunk_com_a_mesma_ordem_das_linhas(banco, tmp_path, monkeypatch):
+    csv = tmp_path / 'ocorrencias_2019.csv'
+    df = gerar_csv(csv, 6)
+    # Linhas repetidas nos dois chunks: a ordem entre as iguais entra na chave_fato
+    df.iloc[1] = df.iloc[0]
+    df.iloc[4] = df.iloc[0]
+    gravar_csv(csv, df)
+    cache = coleta_mysql_v2.CacheDimensoes(modo_chaves='hash')
+
+    inserir_fatos = coleta_mysql_v2.inserir_fatos
+    chamadas = []
+
+    def deadlock_no_segundo_chunk(connection, fatos):
+        chamadas.append(1)
+        if len(chamadas) == 2:
+            raise OperationalError('INSERT', {}, Exception(1213, 'Deadlock found when trying to get lock'))
+        return inserir_fatos(connection, fatos)
+
+    monkeypatch.setattr(coleta_mysql_v2, 'inserir_fatos', deadlock_no_segundo_chunk)
+    monkeypatch.setattr(coleta_mysql_v2, 'ESPERA_DEADLOCK', 0)
+    resumo = carregar(str(csv), banco, cache, tamanho_chunk=3)
+    assert len(chamadas) == 3
+    assert (resumo['chunks_com_erro'], resumo['inseridos']) == (0, 6)
+    assert status_manifesto(banco, str(csv)) == 'COMPLETO'
+
+    # As chaves refeitas são as de uma carga sem deadlock: a recarga não grava nem remove nada
+    monkeypatch.setattr(coleta_mysql_v2, 'inserir_fatos', inserir_fatos)
+    recarga = carregar(str(csv), banco, cache, tamanho_chunk=3, forcar=True)
+    assert (recarga['inseridos'], recarga['ja_gravados'], recarga['substituidos']) == (0, 6, 0)
+    assert_agregados_conferem(banco)
+
+
+def test_chaves_hash_gravam_as_dimensoes_na_ordem_do_id(banco, tmp_path, monkeypatch):
+    gerar_csv(tmp_path / 'ocorrencias_2019.csv', 300)
+    ids = {'DIM_NATUREZA': [], 'DIM_LOCAL': []}
+    execute = Connection.execute
+
+    def registrar_insercoes(self, statement, parametros=None, *args, **kwargs):
+        for tabela, lista in ids.items():
+            if str(statement).startswith(f'INSERT OR IGNORE INTO {tabela} '):
+                lista.append([registro[f"{tabela.split('_')[1].lower()}_id"] for registro in parametros])
+        return execute(self, statement, parametros, *args, **kwargs)
+
+    monkeypatch.setattr(Connection, 'execute', registrar_insercoes)
+    cache = coleta_mysql_v2.CacheDimensoes(modo_chaves='hash')
+    carregar(str(tmp_path / 'ocorrencias_2019.csv'), banco, cache, tamanho_chunk=100)
+    for lotes in ids.values():
+        assert lotes and all(lote == sorted(lote) for lote in lotes)
+
+
+def test_dry_run_de_arquivo_em_andamento_conta_o_arquivo_inteiro(banco, cache, tmp_path, monkeypatch):
+    csv = str(tmp_path / 'ocorrencias_2019.csv')
+    gerar_csv(csv, 6)
+    derrubar_no_chunk(monkeypatch, 2)
+    carregar(csv, banco, cache, tamanho_chunk=3)
+    assert status_manifesto(banco, csv) == 'EM_ANDAMENTO'
+
+    # A retomada relê as 6 linhas (as 3 confirmadas são puladas pelo filtro de chaves)
+    estimativa, = coleta_mysql_v2.estimar_carga([csv], banco)
+    assert (estimativa['linhas'], estimativa['a_carregar']) == (6, 6)
+    assert 'pula 3 já confirmadas' in estimativa['manifesto']
+
+
+def fatos_por_chave(banco):
+
+    """Linhas da fato pelas chaves naturais (os ids do AUTO_INCREMENT dependem da ordem da carga)"""
+
+    with banco.connect() as connection:
+        return sorted(map(tuple, connection.execute(text("""
+            SELECT f.atendimento_numero, f.chave_fato, f.arquivo_id, f.tempo_id, f.hora_id,
+                   n.natureza1_descricao, n.natureza2_descricao, n.tipo_envolvimento,
+                   l.bairro_nome, l.regional_nome, l.logradouro_nome
+            FROM FATO_OCORRENCIA f
+            JOIN DIM_NATUREZA n ON f.natureza_id = n.natureza_id
+            JOIN DIM_LOCAL l ON f.local_id = l.local_id
+        """)).all()), key=str)
+
+
+def test_load_data_grava_as_mesmas_linhas_do_insert(banco, cache, tmp_path, load_data_emulado):
+    csv = str(tmp_path / 'ocorrencias_2019.csv')
+    gerar_csv(csv, 500)
+    outro = benchmark_etl.criar_banco_local(str(tmp_path / 'insert.db'))
+    with outro.connect() as connection:
+        cache_insert = coleta_mysql_v2.CacheDimensoes()
+        cache_insert.carregar(connection)
+
+    resumo = carregar(csv, banco, cache, modo_carga='load_data', tamanho_chunk=200)
+    carregar(csv, outro, cache_insert, tamanho_chunk=200)
+    assert (resumo['inseridos'], resumo['rejeitados']) == (500, 0)
+    assert fatos_por_chave(banco) == fatos_por_chave(outro)
+    assert agregados(banco) == agregados(outro)
+    outro.dispose()
+
+
+def test_workers_gravam_o_mesmo_que_a_carga_sequencial(banco, tmp_path):
+    links = []
+    for ano in (2019, 2020, 2021):
+        links.append(str(tmp_path / f'ocorrencias_{ano}.csv'))
+        gerar_csv(links[-1], 300, ano=ano, seed=ano)
+
+    # Um processo por arquivo (no modo 'hash' o SQLite aguenta os escritores se revezando)
+    resultados = coleta_mysql_v2.processar_em_paralelo(
+        links, BancoSQLite(str(tmp_path / 'crimes.db')), 3, 'insert', 100, usar_staging=False, modo_chaves='hash'
+    )
+    assert [r['arquivo'] for r in resultados] == [os.path.basename(link) for link in links]
+    assert [(r['inseridos'], r['erro']) for r in resultados] == [(300, None)] * 3
+
+    sequencial = benchmark_etl.criar_banco_local(str(tmp_path / 'sequencial.db'))
+    cache = coleta_mysql_v2.CacheDimensoes(modo_chaves='hash')
+    for link in links:
+        carregar(link, sequencial, cache, tamanho_chunk=100)
+    assert fatos_por_chave(banco) == fatos_por_chave(sequencial)
+    assert agregados(banco) == agregados(sequencial)
+    with banco.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM DIM_NATUREZA")).scalar() == connection.execute(text(
+            "SELECT COUNT(*) FROM (SELECT DISTINCT natureza1_descricao, natureza2_descricao, tipo_envolvimento "
+            "FROM DIM_NATUREZA) d")).scalar()
+    sequencial.dispose()
+
+
+def test_staging_parquet_particiona_por_ano_e_mantem_as_chaves(banco, cache, tmp_path):
+    csv = str(tmp_path / 'ocorrencias_2019_2020.csv')
+    anos = [gerar_csv(tmp_path / f'{ano}.csv', 200, ano=ano, seed=ano) for ano in (2019, 2020)]
+    # Anos intercalados: no staging as linhas ficam agrupadas por partição
+    df = pd.concat(anos).sort_index(kind='stable').reset_index(drop=True)
+    df.iloc[5] = df.iloc[1]
+    gravar_csv(csv, df)
+
+    resumo = carregar(csv, banco, cache, usar_staging=True, tamanho_chunk=150)
+    assert resumo['inseridos'] == 400
+    particoes = coleta_mysql_v2.arquivos_staging(os.path.basename(csv))
+    assert [os.path.basename(os.path.dirname(p)) for p in particoes] == ['OCORRENCIA_ANO=2019', 'OCORRENCIA_ANO=2020']
+    assert len(coleta_mysql_v2.ler_staging(anos=[2019])) == (df['OCORRENCIA_ANO'] == '2019').sum()
+
+    # Mesmo conteúdo: o staging não é gerado de novo
+    datas = [os.path.getmtime(p) for p in particoes]
+    download = coleta_mysql_v2.baixar_csv(csv)
+    assert coleta_mysql_v2.converter_para_staging(csv, download['sha256'], download['encoding']) == 400
+    assert [os.path.getmtime(p) for p in particoes] == datas
+
+    # Lido direto do CSV, o arquivo dá as mesmas chave_fato (a ordem entre linhas iguais é a mesma)
+    recarga = carregar(csv, banco, cache, usar_staging=False, forcar=True)
+    assert (recarga['inseridos'], recarga['ja_gravados'], recarga['substituidos']) == (0, 400, 0)
+    assert_agregados_conferem(banco)
+
+
+def test_chaves_hash_sao_a_chave_natural_e_colisao_interrompe_o_chunk(banco, tmp_path):
+    csv = str(tmp_path / 'ocorrencias_2019.csv')
+    df = gerar_csv(csv, 300)
+    carregar(csv, banco, coleta_mysql_v2.CacheDimensoes(modo_chaves='hash'))
+    with banco.connect() as connection:
+        for tabela, coluna_id, colunas in (
+            ('DIM_NATUREZA', 'natureza_id', 'natureza1_descricao, natureza2_descricao, tipo_envolvimento'),
+            ('DIM_LOCAL', 'local_id', 'bairro_nome, regional_nome, logradouro_nome'),
+        ):
+            linhas = connection.execute(text(f"SELECT {coluna_id}, {colunas} FROM {tabela}")).all()
+            assert linhas and all(linha[0] == coleta_mysql_v2.chave_hash(*linha[1:]) for linha in linhas)
+
+    # Outro banco em que o id da primeira natureza do arquivo já pertence a outra chave natural
+    outro = benchmark_etl.criar_banco_local(str(tmp_path / 'outro.db'))
+    natureza = df.loc[0, ['NATUREZA1_DESCRICAO', 'NATUREZA2_DESCRICAO', 'TIPO_ENVOLVIMENTO']]
+    with outro.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO DIM_NATUREZA (natureza_id, natureza1_descricao) VALUES (:id, 'OUTRA NATUREZA')"
+        ), {'id': coleta_mysql_v2.chave_hash(*natureza)})
+    cache = coleta_mysql_v2.CacheDimensoes(modo_chaves='hash')
+    with outro.connect() as connection:
+        cache.carregar(connection)
+    resumo = carregar(csv, outro, cache)
+    assert resumo['chunks_com_erro'] == 1
+    assert 'DIM_NATUREZA.natureza_id' in resumo['erro'] and 'colide' in resumo['erro']
+    assert contar_fatos(outro) == 0
+    outro.dispose()
+
+
+def test_agregados_acompanham_insercoes_e_remocoes(banco, cache, tmp_path):
+    csvs = {ano: str(tmp_path / f'ocorrencias_{ano}.csv') for ano in (2019, 2020)}
+    df = gerar_csv(csvs[2019], 300, ano=2019)
+    df_2020 = gerar_csv(csvs[2020], 200, ano=2020, seed=2)
+    for csv in csvs.values():
+        carregar(csv, banco, cache, tamanho_chunk=120)
+    with banco.connect() as connection:
+        assert dict(connection.execute(text("SELECT ocorrencia_ano, total FROM AGG_CRIMES_ANO")).all()) == {
+            2019: 300, 2020: 200}
+    assert_agregados_conferem(banco)
+
+    # Um bairro inteiro sai do arquivo de 2019 e um bairro novo aparece
+    bairro = df['ATENDIMENTO_BAIRRO_NOME'].iloc[0]
+    sem_bairro = df[df['ATENDIMENTO_BAIRRO_NOME'] != bairro].reset_index(drop=True)
+    sem_bairro.loc[0, 'ATENDIMENTO_BAIRRO_NOME'] = 'BAIRRO NOVO'
+    gravar_csv(csvs[2019], sem_bairro)
+    carregar(csvs[2019], banco, cache, tamanho_chunk=120)
+
+    with banco.connect() as connection:
+        assert dict(connection.execute(text("SELECT ocorrencia_ano, total FROM AGG_CRIMES_ANO")).all()) == {
+            2019: len(sem_bairro), 2020: 200}
+        bairros = dict(connection.execute(text(
+            "SELECT bairro_nome, SUM(total) FROM AGG_CRIMES_BAIRRO GROUP BY bairro_nome")).all())
+        # Chaves que chegam a zero saem da tabela
+        assert connection.execute(text("SELECT COUNT(*) FROM AGG_CRIMES_BAIRRO WHERE total <= 0")).scalar() == 0
+    assert bairros.get(bairro, 0) == (df_2020['ATENDIMENTO_BAIRRO_NOME'] == bairro).sum()
+    assert bairros['BAIRRO NOVO'] == 1
+    assert_agregados_conferem(banco)
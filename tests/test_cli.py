@@ -0,0 +1,109 @@
+"""
+coleta_mysql_v2.main() com --banco sqlite e CSVs locais: seleção de arquivos (--anos, --filtro,
+--arquivos, --dry-run) e carga em massa (--bulk).
+"""
+
+import argparse
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import benchmark_etl
+import coleta_mysql_v2
+from bancos_etl import INDICES_FATO, BancoSQLite, validar_chaves_estrangeiras
+
+
+@pytest.fixture
+def arquivos(tmp_path, monkeypatch):
+
+    """Um CSV pequeno por ano (2018 a 2021) em tmp_path/csv; o diretório de trabalho é o tmp_path"""
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'csv').mkdir()
+    for ano in range(2018, 2022):
+        benchmark_etl.gerar_csv_sigesguarda(str(tmp_path / 'csv' / f'{ano}-01-01_sigesguarda.csv'), 50, ano=ano)
+    return tmp_path
+
+
+def executar(*argv):
+    coleta_mysql_v2.main(['--banco', 'sqlite', '--sqlite', 'crimes.db', '--sem-staging', '--chunk-size', '20',
+                          '--arquivos', 'csv/*.csv', *argv])
+    return create_engine('sqlite:///crimes.db')
+
+
+def urls_carregadas(engine):
+    with engine.connect() as connection:
+        return sorted(os.path.basename(url) for url in
+                      connection.execute(text("SELECT url FROM CARGA_MANIFESTO WHERE status = 'COMPLETO'")).scalars())
+
+
+def indices_fato(engine):
+    with engine.connect() as connection:
+        return set(connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'FATO_OCORRENCIA' AND sql IS NOT NULL"
+        )).scalars())
+
+
+@pytest.mark.parametrize('valor, faixa', [
+    ('2019', (2019, 2019)), ('2019-2021', (2019, 2021)), ('2019-', (2019, None)), ('-2021', (None, 2021)),
+])
+def test_faixa_anos(valor, faixa):
+    assert coleta_mysql_v2.faixa_anos(valor) == faixa
+
+
+@pytest.mark.parametrize('valor', ['2021-2019', 'dois mil', '2019-20x'])
+def test_faixa_anos_invalida(valor):
+    with pytest.raises(argparse.ArgumentTypeError):
+        coleta_mysql_v2.faixa_anos(valor)
+
+
+def test_filtrar_arquivos():
+    links = ['https://x/2018-03-01_sigesguarda_-_base_de_dados.csv', 'https://x/2020-03-01_sigesguarda.csv',
+             'https://x/2021%2003%2001_SIGESGUARDA.csv', 'https://x/base_sem_ano.csv']
+    assert coleta_mysql_v2.filtrar_arquivos(links, (2019, None)) == links[1:3]
+    assert coleta_mysql_v2.filtrar_arquivos(links, filtros=['base_de', 'sem_ano']) == [links[0], links[3]]
+    # O filtro também casa com o nome decodificado da URL
+    assert coleta_mysql_v2.filtrar_arquivos(links, (2020, 2021), ['2021 03']) == [links[2]]
+
+
+def test_anos_e_filtro_escolhem_os_arquivos_carregados(arquivos):
+    engine = executar('--anos', '2019-2021', '--filtro', '2019|2021')
+    assert urls_carregadas(engine) == ['2019-01-01_sigesguarda.csv', '2021-01-01_sigesguarda.csv']
+
+    # --dry-run não grava nada: o manifesto continua igual
+    executar('--anos', '2018-', '--dry-run')
+    assert urls_carregadas(engine) == ['2019-01-01_sigesguarda.csv', '2021-01-01_sigesguarda.csv']
+    engine.dispose()
+
+
+def test_bulk_remove_e_recria_indices_da_fato(arquivos, monkeypatch):
+    engine = benchmark_etl.criar_banco_local('crimes.db')
+    antes = indices_fato(engine)
+    assert set(INDICES_FATO) <= antes
+
+    # Índices que existem enquanto cada arquivo é gravado
+    durante = []
+    processar = coleta_mysql_v2.processar_csv_para_mysql
+
+    def registrar_indices(csv_url, engine, *args, **kwargs):
+        durante.append(indices_fato(engine))
+        return processar(csv_url, engine, *args, **kwargs)
+
+    monkeypatch.setattr(coleta_mysql_v2, 'processar_csv_para_mysql', registrar_indices)
+    executar('--bulk')
+    assert len(durante) == 4 and all(not (indices & set(INDICES_FATO)) for indices in durante)
+    assert indices_fato(engine) == antes
+    assert not any(validar_chaves_estrangeiras(engine).values())
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM FATO_OCORRENCIA")).scalar() == 200
+
+    # Com as FKs desligadas uma linha órfã entra, e a validação do fim da carga a encontra
+    bulk = BancoSQLite('crimes.db', bulk=True).criar_engine()
+    with bulk.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO FATO_OCORRENCIA (tempo_id, natureza_id, local_id, chave_fato) VALUES (1, 1, 1, 1)"
+        ))
+    assert validar_chaves_estrangeiras(engine)['tempo_id'] == 1
+    bulk.dispose()
+    engine.dispose()
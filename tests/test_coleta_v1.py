@@ -0,0 +1,78 @@
+"""
+Carga do coleta_mysql.py (v1) num SQLite temporário: dimensões resolvidas em lote (SELECT ... IN e um
+executemany para as que faltam) e recarga idempotente pela chave_ocorrencia.
+"""
+
+import pandas as pd
+from sqlalchemy import text
+
+import benchmark_etl
+import coleta_mysql
+
+
+def contar(banco, tabela):
+    with banco.connect() as connection:
+        return connection.execute(text(f"SELECT COUNT(*) FROM {tabela}")).scalar()
+
+
+def test_dimensoes_em_lote_reaproveitam_ids_e_recarga_nao_duplica(banco, tmp_path, monkeypatch):
+    csv = tmp_path / 'v1.csv'
+    benchmark_etl.gerar_csv_sigesguarda(str(csv), 600)
+    monkeypatch.setattr(coleta_mysql, 'TAMANHO_LOTE_DIMENSAO', 7)
+
+    dados = pd.read_csv(csv, sep=';', encoding='latin1', dtype=str)
+    local = {coluna: coleta_mysql.limpar_valor(dados[campo].iloc[0]) for coluna, campo in (
+        ('bairro', 'ATENDIMENTO_BAIRRO_NOME'), ('regional', 'ATENDIMENTO_REGIONAL_NOME'),
+        ('logradouro', 'ATENDIMENTO_LOGRADOURO_NOME'))}
+    # Local gravado antes, repetido (uma linha por execução do get_or_create antigo): fica o menor id
+    with banco.begin() as connection:
+        for _ in range(2):
+            connection.execute(text(
+                "INSERT INTO LOCAL (bairro_nome, regional_nome, logradouro_nome) VALUES (:bairro, :regional, :logradouro)"
+            ), local)
+
+    coleta_mysql.process_csv_url_to_db(str(csv), banco)
+    dimensoes = {tabela: contar(banco, tabela) for tabela in ('TEMPO', 'NATUREZA', 'LOCAL')}
+    assert contar(banco, 'OCORRENCIA') == len(dados)
+
+    with banco.connect() as connection:
+        # Uma linha por chave de busca, além da repetida gravada antes
+        repetidas = connection.execute(text("""
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM LOCAL GROUP BY bairro_nome, regional_nome, logradouro_nome HAVING COUNT(*) > 1
+            ) AS r
+        """)).scalar()
+        assert repetidas == 1
+        assert connection.execute(text("SELECT COUNT(*) FROM NATUREZA GROUP BY natureza1_descricao, "
+                                       "natureza2_descricao, tipo_envolvimento HAVING COUNT(*) > 1")).first() is None
+        # Cada fato aponta para a data da sua linha
+        datas = connection.execute(text("""
+            SELECT t.data_completa, COUNT(*) FROM OCORRENCIA o JOIN TEMPO t ON t.tempo_id = o.tempo_id
+            GROUP BY t.data_completa
+        """)).all()
+        usados = connection.execute(text(
+            "SELECT DISTINCT l.local_id FROM OCORRENCIA o JOIN LOCAL l ON l.local_id = o.local_id "
+            "WHERE l.bairro_nome = :bairro AND l.regional_nome = :regional AND l.logradouro_nome = :logradouro"
+        ), local).scalars().all()
+
+    esperadas = pd.to_datetime(dados['OCORRENCIA_DATA'], dayfirst=True, errors='coerce').dt.strftime('%Y-%m-%d').value_counts()
+    assert {str(data)[:10]: total for data, total in datas} == esperadas.to_dict()
+    assert usados == [1]
+
+    coleta_mysql.process_csv_url_to_db(str(csv), banco)
+    assert contar(banco, 'OCORRENCIA') == len(dados)
+    assert {tabela: contar(banco, tabela) for tabela in ('TEMPO', 'NATUREZA', 'LOCAL')} == dimensoes
+
+
+def test_chaves_ocorrencia_contam_iguais_entre_lotes():
+    linhas = pd.DataFrame({col: ['X'] * 4 for col in coleta_mysql.COLUNAS_CHAVE_OCORRENCIA})
+    linhas.loc[2, 'ATENDIMENTO_NUMERO'] = 'Y'
+
+    vistas = {}
+    inteiro = coleta_mysql.chaves_ocorrencia(linhas, {})
+    em_lotes = list(coleta_mysql.chaves_ocorrencia(linhas.iloc[:2], vistas)) + \
+        list(coleta_mysql.chaves_ocorrencia(linhas.iloc[2:], vistas))
+
+    assert list(inteiro) == em_lotes
+    assert len(set(em_lotes)) == 4
+    assert sorted(vistas.values()) == [1, 3]
@@ -0,0 +1,57 @@
+"""
+Cache de resultados do consultas_crimes.py: uma consulta repetida não vai ao banco enquanto a
+versão dos dados não muda, e cada banco tem o seu cache.
+"""
+
+import pandas as pd
+
+import benchmark_etl
+import coleta_mysql_v2
+import consultas_crimes
+
+
+def carregar_csv(engine, caminho, linhas, ano, seed=1):
+    benchmark_etl.gerar_csv_sigesguarda(str(caminho), linhas, ano=ano, seed=seed)
+    cache = coleta_mysql_v2.CacheDimensoes()
+    with engine.connect() as connection:
+        cache.carregar(connection)
+    return coleta_mysql_v2.processar_arquivo(str(caminho), engine, cache, usar_staging=False)
+
+
+def contar_idas_ao_banco(monkeypatch):
+    idas = []
+    read_sql = pd.read_sql
+
+    def read_sql_contado(*args, **kwargs):
+        idas.append(1)
+        return read_sql(*args, **kwargs)
+
+    monkeypatch.setattr(consultas_crimes.pd, 'read_sql', read_sql_contado)
+    return idas
+
+
+def test_cache_so_volta_ao_banco_quando_chegam_dados_novos(banco, tmp_path, monkeypatch):
+    carregar_csv(banco, tmp_path / 'ocorrencias_2019.csv', 300, 2019)
+    idas = contar_idas_ao_banco(monkeypatch)
+
+    primeira = consultas_crimes.tendencia_anual(engine=banco)
+    assert consultas_crimes.tendencia_anual(engine=banco).equals(primeira)
+    assert len(idas) == 1
+    assert primeira['total_ocorrencias'].tolist() == [300]
+
+    carregar_csv(banco, tmp_path / 'ocorrencias_2020.csv', 200, 2020)
+    depois = consultas_crimes.tendencia_anual(engine=banco)
+    assert len(idas) == 2
+    assert depois['total_ocorrencias'].tolist() == [300, 200]
+
+
+def test_cache_separa_bancos_com_a_mesma_versao(banco, tmp_path):
+    outro = benchmark_etl.criar_banco_local(str(tmp_path / 'outro.db'))
+    carregar_csv(banco, tmp_path / 'ocorrencias_2019.csv', 300, 2019)
+    carregar_csv(outro, tmp_path / 'ocorrencias_2020.csv', 200, 2020)
+    with banco.connect() as a, outro.connect() as b:
+        assert coleta_mysql_v2.ler_versao_dados(a) == coleta_mysql_v2.ler_versao_dados(b)
+
+    assert consultas_crimes.tendencia_anual(engine=banco)['ocorrencia_ano'].tolist() == [2019]
+    assert consultas_crimes.tendencia_anual(engine=outro)['ocorrencia_ano'].tolist() == [2020]
+    outro.dispose()
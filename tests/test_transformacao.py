@@ -0,0 +1,61 @@
+"""
+Transformações vetorizadas do coleta_mysql_v2.py: categoria do crime, período do dia e nome do mês
+calculados uma vez por valor distinto e espalhados para as linhas.
+"""
+
+import pandas as pd
+
+import coleta_mysql_v2
+
+DESCRICOES = {
+    'FURTO QUALIFICADO': 'FURTO',
+    # Mais de uma palavra-chave: vale a primeira categoria de CATEGORIAS_CRIME
+    'ROUBO E FURTO': 'FURTO',
+    'roubo a transeunte': 'ROUBO',
+    'LESAO CORPORAL': 'LESÃO CORPORAL',
+    'POSSE DE ENTORPECENTES': 'DROGAS',
+    'ACIDENTE DE TRANSITO': 'TRÂNSITO',
+    'AMEAÇA': 'AMEAÇA',
+    'DANO': 'DANO AO PATRIMÔNIO',
+    'TENTATIVA DE HOMICIDIO': 'HOMICÍDIO',
+    'PERTURBAÇÃO DO SOSSEGO': 'OUTROS',
+    '': 'NÃO INFORMADO',
+    'nan': 'NÃO INFORMADO',
+    None: 'NÃO INFORMADO',
+}
+
+HORAS = {
+    '00:00': 'MADRUGADA', '05:59': 'MADRUGADA', '06:00': 'MANHÃ', '07:15:00': 'MANHÃ', '7': 'MANHÃ',
+    '12:00': 'TARDE', '18:30': 'NOITE', '23:59': 'NOITE',
+    '24:00': 'NÃO INFORMADO', '10:75': 'NÃO INFORMADO', 'xx': 'NÃO INFORMADO', None: 'NÃO INFORMADO',
+}
+
+
+def repetir(valores, vezes=3):
+
+    """Cada valor várias vezes, embaralhado e com um índice que não começa em 0 (como num chunk)"""
+
+    serie = pd.Series(list(valores) * vezes, dtype=object)
+    return serie.sample(frac=1, random_state=1).set_axis(range(1000, 1000 + len(serie)))
+
+
+def test_categorizar_crimes():
+    descricoes = repetir(DESCRICOES)
+    esperado = descricoes.map(lambda d: DESCRICOES[d])
+    pd.testing.assert_series_equal(coleta_mysql_v2.categorizar_crimes(descricoes), esperado, check_dtype=False)
+    # Colunas lidas como category (tipos compactos do chunk) dão o mesmo resultado
+    categorias = descricoes.astype('category')
+    pd.testing.assert_series_equal(coleta_mysql_v2.categorizar_crimes(categorias), esperado, check_dtype=False)
+
+
+def test_classificar_periodos():
+    horas = repetir(HORAS)
+    pd.testing.assert_series_equal(coleta_mysql_v2.classificar_periodos(horas), horas.map(lambda h: HORAS[h]),
+                                   check_dtype=False)
+
+
+def test_nomes_meses():
+    meses = pd.Series([1, 3, 12, 0, 13, None, 3])
+    assert coleta_mysql_v2.nomes_meses(meses).tolist() == [
+        'JANEIRO', 'MARÇO', 'DEZEMBRO', 'NÃO INFORMADO', 'NÃO INFORMADO', 'NÃO INFORMADO', 'MARÇO'
+    ]